@@ -0,0 +1,98 @@
+"""
+Import time of libraries and integration jobs, every module is imported in a fresh interpreter:
+
+    python benchmarks/import_time.py --repeat 5 --output import_time.json
+    python benchmarks/import_time.py --compare base.json import_time.json
+
+Heavy dependencies loaded by import are listed too: they are expected to load only when used.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INTEGRATIONS = os.path.join(ROOT, 'integrations')
+LIBS = [os.path.join(ROOT, 'libs', name) for name in ('pyhttp', 'pymysklad', 'pywb')]
+
+MODULES = ['pyhttp', 'profiling', 'pymyskald', 'pywb', 'nomeclature',
+           'stocks_sync', 'sales_update', 'procucts_update', 'photo_update', 'run']
+HEAVY_MODULES = ('pandas', 'numpy', 'tqdm')
+
+MEASURE_CODE = '''
+import json, sys, time
+started = time.perf_counter()
+import {module}
+print(json.dumps({{'seconds': time.perf_counter() - started,
+                  'heavy': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+
+def measure(module) -> dict:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(LIBS + [env.get('PYTHONPATH', '')])
+    output = subprocess.run([sys.executable, '-c', MEASURE_CODE.format(module=module, heavy=HEAVY_MODULES)],
+                            cwd=INTEGRATIONS, env=env, stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def get_result(module, repeat) -> dict:
+    """
+    Median of `repeat` runs, the first one compiles .pyc files and is not counted.
+    """
+    measure(module)
+    runs = [measure(module) for _ in range(repeat)]
+    return {'module': module,
+            'seconds': round(statistics.median(run['seconds'] for run in runs), 4),
+            'heavy': runs[-1]['heavy']}
+
+
+def compare(base_path, new_path, tolerance) -> int:
+    with open(base_path) as base_file, open(new_path) as new_file:
+        base = {result['module']: result for result in json.loads(base_file.read())['results']}
+        new = json.loads(new_file.read())['results']
+
+    failed = False
+    print(f'{"module":<18}{"base, ms":>10}{"new, ms":>10}  heavy')
+    for result in new:
+        base_result = base.get(result['module'])
+        if base_result is None:
+            continue
+        slower = result['seconds'] > base_result['seconds'] * (1 + tolerance)
+        new_heavy = set(result['heavy']) - set(base_result['heavy'])
+        failed = failed or slower or bool(new_heavy)
+        mark = ' !' if slower or new_heavy else ''
+        print(f'{result["module"]:<18}{base_result["seconds"] * 1000:>10.0f}{result["seconds"] * 1000:>10.0f}'
+              f'  {", ".join(result["heavy"]) or "-"}{mark}')
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import time of libraries and integration jobs')
+    parser.add_argument('--modules', nargs='+', choices=MODULES, default=MODULES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='import_time.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two results files')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed share of import time growth')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(args.compare[0], args.compare[1], args.tolerance))
+
+    results = []
+    for module in args.modules:
+        results.append(get_result(module, args.repeat))
+        print(f'{module:<18}{results[-1]["seconds"] * 1000:>8.0f} ms  {", ".join(results[-1]["heavy"]) or "-"}')
+
+    with open(args.output, 'w') as output:
+        output.write(json.dumps({'created': datetime.now().isoformat(timespec='seconds'),
+                                 'python': sys.version.split()[0],
+                                 'results': results}, indent=2))
+    print(f'Results saved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+"""
+End-to-end benchmarks of integration jobs against local fake MoySklad and Wildberries servers.
+Every job runs in its own process with fresh fakes, results are saved to json:
+wall time, cpu time, peak RSS, HTTP requests per endpoint counted by fakes and client side metrics.
+
+    python benchmarks/run.py --skus 1000 10000 --warehouses 1 10 --output results.json
+    python benchmarks/run.py --compare base.json results.json
+
+Same workload can be replayed from cassettes (see pyhttp.Cassette), recorded with fakes or in production:
+
+    python benchmarks/run.py --skus 10000 --record cassettes
+    python benchmarks/run.py --replay cassettes --output replay.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INTEGRATIONS = os.path.join(ROOT, 'integrations')
+LIBS = [os.path.join(ROOT, 'libs', name) for name in ('pyhttp', 'pymysklad', 'pywb')]
+sys.path[:0] = LIBS
+
+from fake_moysklad import FakeMoySklad  # noqa: E402
+from fake_wb import COUNTRIES, FakeWildberries  # noqa: E402
+
+# Job name -> script and its arguments, `all` runs every job in one process.
+JOBS = {
+    'stocks_sync': ['stocks_sync.py'],
+    'sales_update': ['sales_update.py'],
+    'products_update': ['procucts_update.py'],
+    'photo_update': ['photo_update.py'],
+    'all': ['run.py', '--parallel'],
+}
+DEFAULT_JOBS = ['stocks_sync', 'sales_update', 'products_update', 'photo_update']
+# Fake WB card has 1 barcode when single, 2 colors x 3 sizes otherwise, half of cards are single.
+ITEMS_PER_CARD = 3.5
+
+
+def seed_moysklad(fake_ms: FakeMoySklad, fake_wb: FakeWildberries, known_share=0.9, images_share=0.5, seed=0):
+    """
+    Fills MoySklad with part of WB catalog as previous runs of integrations would do:
+    `known_share` of items exist, `images_share` of them have images, stores have random stocks.
+    """
+    rnd = random.Random(seed)
+    brands = fake_ms.add_custom_entity('Бренды')
+    countries = fake_ms.add_custom_entity('Страна производства')
+    for brand in sorted({item['brand'] for item in fake_wb.items}):
+        fake_ms.add(f'customentity/{brands["id"]}', {'name': brand})
+    for country in COUNTRIES:
+        fake_ms.add(f'customentity/{countries["id"]}', {'name': country})
+        fake_ms.add('country', {'name': country})
+    for attribute_name in ('Основной цвет', 'Размер', 'Баркод'):
+        fake_ms.add_attribute('product', attribute_name)
+    fake_ms.add_attribute('product', 'Бренд', custom_entity=brands)
+    fake_ms.add('currency', {'name': 'руб', 'isoCode': 'RUB'})
+    fake_ms.add('uom', {'name': 'шт'})
+    fake_ms.add('counterparty', {'name': 'ООО "Поставщик"'})
+    fake_ms.add('organization', {'name': 'Организация'})
+    chars = {char_name: fake_ms.add_characteristic(char_name)['id'] for char_name in ('Размер', 'Цвет', 'Баркод')}
+
+    stores = [fake_ms.add('store', {'name': f'[WB] {warehouse}'}) for warehouse in fake_wb.warehouses]
+
+    base_products = dict()
+    for item in fake_wb.items:
+        if rnd.random() > known_share:
+            continue
+        if item['supplierVendorCode'] == '':
+            entity_name = 'product'
+            entity = fake_ms.add('product', {'name': f'{item["vendorCode"]} {item["brand"]} {item["subject"]}',
+                                             'code': item['key'],
+                                             'barcodes': [{'ean13': item['barcode']}]})
+        else:
+            entity_name = 'variant'
+            base_product = base_products.get(item['supplierVendorCode'])
+            if base_product is None:
+                base_product = fake_ms.add('product', {'name': item['supplierVendorCode'],
+                                                       'code': f'{item["supplierVendorCode"]}_base'})
+                base_products[item['supplierVendorCode']] = base_product
+            entity = fake_ms.add('variant', {
+                'code': item['key'],
+                'barcodes': [{'ean13': item['barcode']}],
+                'product': {'meta': base_product['meta']},
+                'characteristics': [{'id': chars['Размер'], 'value': item['size']},
+                                    {'id': chars['Цвет'], 'value': item['vendorCode']},
+                                    {'id': chars['Баркод'], 'value': item['barcode']}],
+            })
+
+        if rnd.random() < images_share:
+            for photo in item['photos']:
+                fake_ms.add_image(entity_name, entity['id'], photo.split('/')[-1], b'')
+        for store in stores:
+            if rnd.random() < 0.3:
+                fake_ms.stocks[store['id']][entity['meta']['href']] = float(rnd.randint(1, 30))
+
+
+def get_peak_rss_mb(rusage) -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    if sys.platform == 'darwin':
+        return rusage.ru_maxrss / 2 ** 20
+    return rusage.ru_maxrss / 2 ** 10
+
+
+def run_process(job, workdir, env, profile_dir=None):
+    """
+    :return: exit code, wall seconds, rusage and HTTP metrics (see pyhttp.Metrics) of job process.
+    """
+    env = dict(env)
+    env['PYTHONPATH'] = os.pathsep.join(LIBS + [INTEGRATIONS])
+    args = [sys.executable, os.path.join(INTEGRATIONS, JOBS[job][0])] + JOBS[job][1:]
+    if profile_dir:
+        env['PROFILE_DIR'] = os.path.abspath(profile_dir)
+        args.append('--profile')
+    shutil.copy(os.path.join(ROOT, 'config.json'), workdir)
+    log_path = os.path.join(workdir, 'output.log')
+    with open(log_path, 'w') as log:
+        started = time.perf_counter()
+        process = subprocess.Popen(args, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall_seconds = time.perf_counter() - started
+    returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
+    if returncode != 0:
+        with open(log_path) as log:
+            print(''.join(log.readlines()[-20:]))
+
+    http_metrics = {'endpoints': []}
+    if os.path.exists(env['HTTP_METRICS']):
+        with open(env['HTTP_METRICS']) as metrics_file:
+            http_metrics = json.loads(metrics_file.read())
+    return returncode, wall_seconds, rusage, http_metrics
+
+
+def get_job_env(workdir):
+    env = dict(os.environ)
+    env.update({
+        'MS_TOKEN': 'benchmark',
+        'WB_TOKEN': 'benchmark',
+        'WB_TOKEN_64': 'benchmark',
+        'SUPPLIER_ID': 'benchmark',
+        'WB_CURSOR_PATH': os.path.join(workdir, 'wb_cursor.json'),
+        'WB_SALES_FAILURES_PATH': os.path.join(workdir, 'wb_sales_failures.json'),
+        'PHOTO_CACHE_DIR': os.path.join(workdir, '.photo_cache'),
+        'HTTP_METRICS': os.path.join(workdir, 'http_metrics.json'),
+        'TRACE_PATH': os.path.join(workdir, 'trace.json'),
+        # Client side MoySklad limit would hide job work behind sleeps.
+        'MS_MIN_REQUEST_INTERVAL': '0',
+        'WB_MIN_REQUEST_INTERVAL': '0',
+    })
+    return env
+
+
+def get_result(job, skus, warehouses, returncode, wall_seconds, rusage, http_metrics, requests) -> dict:
+    return {
+        'job': job,
+        'skus': skus,
+        'warehouses': warehouses,
+        'returncode': returncode,
+        'wall_seconds': round(wall_seconds, 3),
+        'cpu_user_seconds': round(rusage.ru_utime, 3),
+        'cpu_system_seconds': round(rusage.ru_stime, 3),
+        'peak_rss_mb': round(get_peak_rss_mb(rusage), 1),
+        'requests': requests,
+        'http': http_metrics['endpoints'],
+    }
+
+
+def run_job(job, skus, warehouses, sales_per_day, latency, keep_workdir=False, record_dir=None,
+            profile_dir=None) -> dict:
+    """
+    Runs job against fresh fakes, with record_dir its traffic is saved to record_dir/{job}.jsonl.gz cassette.
+    """
+    fake_wb = FakeWildberries(cards=max(1, round(skus / ITEMS_PER_CARD)), warehouses=warehouses,
+                              sales_per_day=sales_per_day, days=1, latency=latency)
+    fake_ms = FakeMoySklad(latency=latency)
+    seed_moysklad(fake_ms, fake_wb)
+    ms_url = fake_ms.start()
+    wb_url = fake_wb.start()
+
+    redirects = dict(fake_wb.get_redirects(wb_url))
+    redirects['https://online.moysklad.ru'] = ms_url
+
+    workdir = tempfile.mkdtemp(prefix=f'bench_{job}_')
+    env = get_job_env(workdir)
+    env['HTTP_REDIRECTS'] = ','.join(f'{source}={target}' for source, target in redirects.items())
+    if record_dir:
+        os.makedirs(record_dir, exist_ok=True)
+        env.update({'HTTP_CASSETTE': os.path.abspath(os.path.join(record_dir, f'{job}.jsonl.gz')),
+                    'HTTP_CASSETTE_MODE': 'record'})
+    try:
+        returncode, wall_seconds, rusage, http_metrics = run_process(job, workdir, env, profile_dir)
+    finally:
+        fake_ms.stop()
+        fake_wb.stop()
+        if not keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return get_result(job, len(fake_wb.items), warehouses, returncode, wall_seconds, rusage, http_metrics, {
+        'moysklad': dict(sorted(fake_ms.request_counts.items())),
+        'wildberries': dict(sorted(fake_wb.request_counts.items())),
+    })
+
+
+def replay_job(job, cassette_dir, timing='zero', keep_workdir=False, profile_dir=None) -> dict:
+    """
+    Runs job against cassette recorded by --record or by production run with HTTP_CASSETTE_MODE=record.
+    Requests are counted per url path, requests missing in cassette are counted separately.
+    """
+    workdir = tempfile.mkdtemp(prefix=f'bench_{job}_')
+    report_path = os.path.join(workdir, 'cassette_report.json')
+    env = get_job_env(workdir)
+    env.update({
+        'HTTP_CASSETTE': os.path.abspath(os.path.join(cassette_dir, f'{job}.jsonl.gz')),
+        'HTTP_CASSETTE_MODE': 'replay',
+        'HTTP_CASSETTE_TIMING': timing,
+        'HTTP_CASSETTE_REPORT': report_path,
+    })
+    try:
+        returncode, wall_seconds, rusage, http_metrics = run_process(job, workdir, env, profile_dir)
+        report = {'served': {}, 'missed': {}}
+        if os.path.exists(report_path):
+            with open(report_path) as report_file:
+                report = json.loads(report_file.read())
+    finally:
+        if not keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return get_result(job, None, None, returncode, wall_seconds, rusage, http_metrics,
+                      {'cassette': report['served'], 'missed': report['missed']})
+
+
+def get_requests_total(run) -> int:
+    return sum(count for counts in run['requests'].values() for count in counts.values())
+
+
+def print_run(run):
+    print(f'  {run["wall_seconds"]}s wall, {run["cpu_user_seconds"]}s user cpu, '
+          f'{run["peak_rss_mb"]} MB, {get_requests_total(run)} requests, exit {run["returncode"]}')
+
+
+def get_run_key(run):
+    return run['job'], run['skus'], run['warehouses']
+
+
+def compare(base_path, new_path, tolerance=0.0) -> int:
+    """
+    Prints difference of two results files.
+    :return: 1 when requests count of any endpoint grew more than tolerance share, else 0.
+    """
+    with open(base_path) as base_file:
+        base_runs = {get_run_key(run): run for run in json.loads(base_file.read())['runs']}
+    with open(new_path) as new_file:
+        new_runs = json.loads(new_file.read())['runs']
+
+    regressions = []
+    print(f'{"job":<16}{"skus":>8}{"wh":>4}{"wall, s":>18}{"cpu, s":>18}{"rss, MB":>18}{"requests":>18}')
+    for run in new_runs:
+        base = base_runs.get(get_run_key(run))
+        if base is None:
+            continue
+        base_cpu = base['cpu_user_seconds'] + base['cpu_system_seconds']
+        cpu = run['cpu_user_seconds'] + run['cpu_system_seconds']
+        print(f'{run["job"]:<16}{str(run["skus"]):>8}{str(run["warehouses"]):>4}'
+              f'{base["wall_seconds"]:>9.1f} ->{run["wall_seconds"]:>6.1f}'
+              f'{base_cpu:>9.1f} ->{cpu:>6.1f}'
+              f'{base["peak_rss_mb"]:>9.0f} ->{run["peak_rss_mb"]:>6.0f}'
+              f'{get_requests_total(base):>9} ->{get_requests_total(run):>6}')
+
+        for service, counts in run['requests'].items():
+            base_counts = base['requests'].get(service, {})
+            for endpoint, count in counts.items():
+                base_count = base_counts.get(endpoint, 0)
+                if count > base_count * (1 + tolerance):
+                    regressions.append(f'{run["job"]} {run["skus"]}/{run["warehouses"]} {service} {endpoint}: '
+                                       f'{base_count} -> {count}')
+
+    if regressions:
+        print('Requests count regressions:')
+        for regression in regressions:
+            print(regression)
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark integration jobs against local fake APIs')
+    parser.add_argument('--jobs', nargs='+', choices=list(JOBS), default=DEFAULT_JOBS)
+    parser.add_argument('--skus', nargs='+', type=int, default=[1000], help='WB barcodes count')
+    parser.add_argument('--warehouses', nargs='+', type=int, default=[3])
+    parser.add_argument('--sales-per-day', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every fake response')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--record', metavar='DIR', help='save traffic of every job to DIR/{job}.jsonl.gz')
+    parser.add_argument('--replay', metavar='DIR', help='run jobs against cassettes in DIR instead of fakes')
+    parser.add_argument('--replay-timing', choices=('zero', 'original'), default='zero')
+    parser.add_argument('--profile', metavar='DIR', help='run jobs with --profile, reports are saved to DIR')
+    parser.add_argument('--keep-workdir', action='store_true', help='keep job working dirs with output.log and trace.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two results files')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed share of requests count growth, photo downloads vary between runs')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(args.compare[0], args.compare[1], args.tolerance))
+
+    runs = []
+    if args.replay:
+        for job in args.jobs:
+            print(f'{job}: replay of {args.replay}')
+            runs.append(replay_job(job, args.replay, args.replay_timing, args.keep_workdir, args.profile))
+            print_run(runs[-1])
+    for skus in ([] if args.replay else args.skus):
+        for warehouses in args.warehouses:
+            for job in args.jobs:
+                print(f'{job}: {skus} SKUs, {warehouses} warehouses')
+                runs.append(run_job(job, skus, warehouses, args.sales_per_day, args.latency,
+                                    args.keep_workdir, args.record, args.profile))
+                print_run(runs[-1])
+
+    with open(args.output, 'w') as output:
+        output.write(json.dumps({'created': datetime.now().isoformat(timespec='seconds'),
+                                 'python': sys.version.split()[0],
+                                 'runs': runs}, indent=2, ensure_ascii=False))
+    print(f'Results saved to {args.output}')
+    if any(run['returncode'] != 0 for run in runs):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
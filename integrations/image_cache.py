@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import threading
+from collections import defaultdict
+
+from pyhttp import write_json_atomically
+
+
+def _read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as json_file:
+        return json.loads(json_file.read())
+
+
+class ImageCache:
+    """
+    Disk cache of image files addressed by sha256 of content.
+    Keeps url -> hash index, so cached image is found without download.
+    Least recently used files are removed when total size is over max_bytes, with their urls in index.
+    """
+    INDEX_FILENAME = 'index.json'
+    BLOBS_DIRNAME = 'blobs'
+
+    def __init__(self, path, max_bytes=512 * 2 ** 20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.blobs_path = os.path.join(path, self.BLOBS_DIRNAME)
+        os.makedirs(self.blobs_path, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._sizes = self._scan_blobs()
+        self.total_bytes = sum(size for _, size in self._sizes.values())
+
+        # Urls of blobs removed outside of cache are dropped too.
+        self.index = dict()
+        self._urls = defaultdict(set)
+        for url, content_hash in _read_json(os.path.join(path, self.INDEX_FILENAME), dict()).items():
+            if content_hash in self._sizes:
+                self._set_hash(url, content_hash)
+
+    def _scan_blobs(self) -> dict:
+        """
+        :return: dict hash -> (last access time, size)
+        """
+        blobs = dict()
+        for name in os.listdir(self.blobs_path):
+            if name.endswith('.tmp'):
+                continue
+            stat = os.stat(os.path.join(self.blobs_path, name))
+            blobs[name] = (stat.st_mtime, stat.st_size)
+        return blobs
+
+    def _set_hash(self, url, content_hash):
+        old_hash = self.index.get(url)
+        if old_hash is not None and old_hash != content_hash:
+            self._urls[old_hash].discard(url)
+        self.index[url] = content_hash
+        self._urls[content_hash].add(url)
+
+    def _blob_path(self, content_hash):
+        return os.path.join(self.blobs_path, content_hash)
+
+    def get_hash(self, url):
+        return self.index.get(url)
+
+    def get(self, url):
+        """
+        Returns cached content of url or None.
+        """
+        content_hash = self.index.get(url)
+        if content_hash is None:
+            return None
+        with self._lock:
+            if content_hash not in self._sizes:
+                return None
+            blob_path = self._blob_path(content_hash)
+            os.utime(blob_path)
+            # Reinserted at the end, so blobs with equal mtime are evicted in access order.
+            size = self._sizes.pop(content_hash)[1]
+            self._sizes[content_hash] = (os.stat(blob_path).st_mtime, size)
+            with open(blob_path, 'rb') as blob:
+                return blob.read()
+
+    def put(self, url, content: bytes) -> str:
+        content_hash = hashlib.sha256(content).hexdigest()
+        blob_path = self._blob_path(content_hash)
+
+        with self._lock:
+            self._set_hash(url, content_hash)
+            if content_hash in self._sizes:
+                return content_hash
+
+            tmp_path = f'{blob_path}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as blob:
+                blob.write(content)
+            os.replace(tmp_path, blob_path)
+            self._sizes[content_hash] = (os.stat(blob_path).st_mtime, len(content))
+            self.total_bytes += len(content)
+            self._evict()
+
+        return content_hash
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        for content_hash, (_, size) in sorted(self._sizes.items(), key=lambda item: item[1][0]):
+            os.remove(self._blob_path(content_hash))
+            del self._sizes[content_hash]
+            self.total_bytes -= size
+            for url in self._urls.pop(content_hash, ()):
+                del self.index[url]
+            if self.total_bytes <= self.max_bytes:
+                return
+
+    def save(self):
+        with self._lock:
+            write_json_atomically(os.path.join(self.path, self.INDEX_FILENAME), self.index)
+
+
+class UploadManifest:
+    """
+    Set of (entity, content hash) pairs already uploaded to MoySklad.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.uploaded = {tuple(item) for item in _read_json(path, [])}
+        self._lock = threading.Lock()
+
+    def __contains__(self, item):
+        return item in self.uploaded
+
+    def add(self, entity, content_hash):
+        with self._lock:
+            self.uploaded.add((entity, content_hash))
+
+    def save(self):
+        with self._lock:
+            write_json_atomically(self.path, sorted(self.uploaded))
@@ -0,0 +1,64 @@
+import json
+import os
+import threading
+
+from nomeclature import WBNomenclature
+from pyhttp import RateLimiter
+from pymyskald import MSAssortment, MSMetadataRegistry, MSStoreRegistry
+from pywb import MIN_REQUEST_INTERVAL
+
+
+class JobContext:
+    """
+    Settings and shared data of integration jobs run in one process:
+    tokens from env, config.json, WB statistics rate limiters and catalog snapshot
+    (WB nomenclature, MoySklad metadata, stores and assortment) which is read once on first use.
+    """
+
+    def __init__(self, config_path='config.json'):
+        self.ms_token = os.getenv('MS_TOKEN')
+        self.wb_token = os.getenv('WB_TOKEN')
+        self.wb_token_64 = os.getenv('WB_TOKEN_64')
+        self.supplier_id = os.getenv('SUPPLIER_ID')
+        with open(config_path) as config_file:
+            self.config = json.loads(config_file.read())
+
+        self._wb_rate_limiters = dict()
+        self._lock = threading.Lock()
+        self._nomenclature = None
+        self._stores = None
+        self._metadata = None
+        self._assortment = None
+
+    def get_wb_rate_limiter(self, request_object) -> RateLimiter:
+        """
+        Statistics API limits requests of each object separately, so jobs share one limiter per object.
+        """
+        with self._lock:
+            if request_object not in self._wb_rate_limiters:
+                self._wb_rate_limiters[request_object] = RateLimiter(MIN_REQUEST_INTERVAL)
+            return self._wb_rate_limiters[request_object]
+
+    def get_nomenclature(self) -> WBNomenclature:
+        with self._lock:
+            if self._nomenclature is None:
+                self._nomenclature = WBNomenclature(self.wb_token, self.supplier_id)
+            return self._nomenclature
+
+    def get_stores(self) -> MSStoreRegistry:
+        with self._lock:
+            if self._stores is None:
+                self._stores = MSStoreRegistry(self.ms_token, os.getenv('MS_STORES_CACHE'))
+            return self._stores
+
+    def get_metadata(self) -> MSMetadataRegistry:
+        with self._lock:
+            if self._metadata is None:
+                self._metadata = MSMetadataRegistry(self.ms_token, os.getenv('MS_METADATA_CACHE'))
+            return self._metadata
+
+    def get_assortment(self) -> MSAssortment:
+        with self._lock:
+            if self._assortment is None:
+                self._assortment = MSAssortment.load(self.ms_token)
+            return self._assortment
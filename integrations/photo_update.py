@@ -1,14 +1,20 @@
 import os
-import requests
-import json
-import base64
-import io
 import logging
+import threading
+import time
+from queue import Queue
+from typing import TYPE_CHECKING
 
-import pandas as pd
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
-from nomeclature import WBNomenclature
-from pymyskald import get_all_single_products_code_id_info, get_all_multi_product_info
+from image_cache import ImageCache, UploadManifest
+from job_context import JobContext
+from profiling import profile_from_argv
+from pyhttp import Session, Base64JsonBody, span
+from pymyskald import get_images_inventory, session as ms_session
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 class ImageFormatException(Exception):
@@ -40,14 +46,13 @@ class Image:
     def __repr__(self):
         return self.filename
 
-    @property
-    def file_data(self):
-        r = requests.get(self.url)
-        image_bytes = io.BytesIO(r.content)
-        return base64.b64encode(image_bytes.read())
+    def download(self, session) -> bytes:
+        r = session.get(self.url)
+        r.raise_for_status()
+        return r.content
 
 
-def get_code_photo_dict_from_df_ph(df_ph: pd.DataFrame) -> dict:
+def get_code_photo_dict_from_df_ph(df_ph: 'pd.DataFrame') -> dict:
     key_photo_dict_all = dict()
     for _, row in df_ph.iterrows():
         photos = []
@@ -62,24 +67,233 @@ def get_code_photo_dict_from_df_ph(df_ph: pd.DataFrame) -> dict:
     return key_photo_dict_all
 
 
-def main():
+class StageMetrics:
+    """
+    Throughput of one pipeline stage, shared by its workers.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.errors = 0
+        self.bytes = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, nbytes, seconds, error=False):
+        with self._lock:
+            if error:
+                self.errors += 1
+            else:
+                self.items += 1
+                self.bytes += nbytes
+            self.busy_seconds += seconds
+
+    def summary(self, elapsed) -> str:
+        elapsed = max(elapsed, 1e-9)
+        return (f'{self.name}: {self.items} items ({self.errors} errors), {self.bytes / 2 ** 20:.1f} MB, '
+                f'{self.items / elapsed:.2f} items/s, {self.bytes / 2 ** 20 / elapsed:.2f} MB/s, '
+                f'busy {self.busy_seconds:.1f}s')
+
+
+class ImageTransferPipeline:
+    """
+    Downloads images from WB and uploads them to MoySklad in two bounded worker pools.
+    Bounded queues between stages keep at most `queue_size` downloaded images in memory:
+    download workers wait while uploads are behind.
+
+    With cache, images are downloaded from WB once. With manifest, entities whose images
+    were all uploaded before are skipped without requesting their MoySklad images list.
+    """
+    STOP = object()
+
+    def __init__(self, ms_token, download_workers=8, upload_workers=4, queue_size=16,
+                 cache: ImageCache = None, manifest: UploadManifest = None):
+        self.ms_token = ms_token
+        self.download_workers = download_workers
+        self.upload_workers = upload_workers
+        self.queue_size = queue_size
+        self.cache = cache
+        self.manifest = manifest
+
+        self.wb_session = Session()
+        self.wb_session.mount('https://', HTTPAdapter(pool_maxsize=download_workers))
+
+        self.skipped = StageMetrics('skipped by manifest')
+        self.listing = StageMetrics('list')
+        self.downloading = StageMetrics('download')
+        self.uploading = StageMetrics('upload')
+
+    def run(self, entity_images):
+        """
+        :param entity_images: iterable of (images request url, list of Image, set of exists filenames).
+        Exists filenames are requested from MoySklad when they are None.
+        """
+        entities_queue = Queue(maxsize=self.download_workers * 2)
+        upload_queue = Queue(maxsize=self.queue_size)
+        started = time.monotonic()
+
+        downloaders = [threading.Thread(target=self._download_worker, args=(entities_queue, upload_queue))
+                       for _ in range(self.download_workers)]
+        uploaders = [threading.Thread(target=self._upload_worker, args=(upload_queue,))
+                     for _ in range(self.upload_workers)]
+        for worker in downloaders + uploaders:
+            worker.start()
+
+        for task in tqdm(entity_images):
+            entities_queue.put(task)
+
+        for _ in downloaders:
+            entities_queue.put(self.STOP)
+        for worker in downloaders:
+            worker.join()
+        for _ in uploaders:
+            upload_queue.put(self.STOP)
+        for worker in uploaders:
+            worker.join()
+
+        elapsed = time.monotonic() - started
+        for stage in (self.skipped, self.listing, self.downloading, self.uploading):
+            print(stage.summary(elapsed))
+
+        if self.cache is not None:
+            self.cache.save()
+        if self.manifest is not None:
+            self.manifest.save()
+
+    @staticmethod
+    def get_entity(request_url) -> str:
+        """
+        'product/{id}' or 'variant/{id}' from images request url.
+        """
+        return '/'.join(request_url.split('/')[-3:-1])
+
+    def is_uploaded(self, entity, image) -> bool:
+        if self.cache is None or self.manifest is None:
+            return False
+        content_hash = self.cache.get_hash(image.url)
+        return content_hash is not None and (entity, content_hash) in self.manifest
+
+    def get_content(self, image) -> bytes:
+        if self.cache is None:
+            return image.download(self.wb_session)
+
+        content = self.cache.get(image.url)
+        if content is None:
+            content = image.download(self.wb_session)
+            self.cache.put(image.url, content)
+        return content
+
+    def mark_exists(self, entity, image):
+        """
+        Image was uploaded before manifest had it: content is downloaded once to learn its hash,
+        so next runs skip images list request of the entity.
+        """
+        if self.cache is None or self.manifest is None:
+            return
+        if self.cache.get_hash(image.url) is None:
+            try:
+                self.get_content(image)
+            except Exception as e:
+                logging.error(f'{image.url}: {e}')
+                return
+        self.manifest.add(entity, self.cache.get_hash(image.url))
+
+    def mark_uploaded(self, entity, image, content):
+        if self.cache is None or self.manifest is None:
+            return
+        self.manifest.add(entity, self.cache.put(image.url, content))
+
+    def get_exists_filenames(self, request_url) -> set:
+        exists_images = ms_session.get(request_url, headers={'Authorization': f'Basic {self.ms_token}'}).json()
+        return {image.get('filename', '') for image in exists_images.get('rows', [])}
+
+    def upload(self, request_url, image, content):
+        request_data = Base64JsonBody(content, {"filename": image.filename})
+        return ms_session.post(request_url, headers={
+            'Authorization': f'Basic {self.ms_token}',
+            'Content-type': 'Application/json'
+        }, data=request_data)
+
+    def _download_worker(self, entities_queue, upload_queue):
+        while True:
+            task = entities_queue.get()
+            if task is self.STOP:
+                return
+            request_url, images, exists_images = task
+            entity = self.get_entity(request_url)
+
+            if all(self.is_uploaded(entity, image) for image in images):
+                self.skipped.add(0, 0.0)
+                continue
+
+            listed = exists_images is None
+            if listed:
+                started = time.monotonic()
+                try:
+                    exists_images = self.get_exists_filenames(request_url)
+                except Exception as e:
+                    self.listing.add(0, time.monotonic() - started, error=True)
+                    logging.error(f'{request_url}: {e}')
+                    continue
+                self.listing.add(0, time.monotonic() - started)
+
+            for image in images:
+                if image.filename in exists_images:
+                    if listed:
+                        self.mark_exists(entity, image)
+                    continue
+                started = time.monotonic()
+                try:
+                    content = self.get_content(image)
+                except Exception as e:
+                    self.downloading.add(0, time.monotonic() - started, error=True)
+                    logging.error(f'{image.url}: {e}')
+                    continue
+                self.downloading.add(len(content), time.monotonic() - started)
+                upload_queue.put((request_url, image, content))
+
+    def _upload_worker(self, upload_queue):
+        while True:
+            task = upload_queue.get()
+            if task is self.STOP:
+                return
+            request_url, image, content = task
+
+            started = time.monotonic()
+            try:
+                r = self.upload(request_url, image, content)
+                error = r.status_code != 200
+                if error:
+                    logging.error(f'{r.status_code} {r.text}')
+                else:
+                    self.mark_uploaded(self.get_entity(request_url), image, content)
+            except Exception as e:
+                error = True
+                logging.error(f'{image.url}: {e}')
+            self.uploading.add(len(content), time.monotonic() - started, error=error)
+
+
+def main(context=None):
+    import pandas as pd
+
+    context = context or JobContext()
     print('Script starts')
-    ms_token = os.getenv('MS_TOKEN')
-    wb_token = os.getenv('WB_TOKEN')
-    supplier_id = os.getenv('SUPPLIER_ID')
+    ms_token = context.ms_token
 
-    nom = WBNomenclature(wb_token, supplier_id)
+    nom = context.get_nomenclature()
 
     logging.info('Get nomenclature from WB')
-    df_single_items = nom.get_single_items()
-    df_single_items['Key'] = df_single_items['chrtId'] + '_' + df_single_items['Баркод']
+    with span('read_wb_nomenclature'):
+        df_single_items = nom.get_single_items()
+        df_single_items['Key'] = df_single_items['chrtId'] + '_' + df_single_items['Баркод']
 
-    df_multi_items = nom.get_multi_items()
-    df_multi_items['Key'] = df_multi_items['chrtId'] + '_' + df_multi_items['Баркод']
+        df_multi_items = nom.get_multi_items()
+        df_multi_items['Key'] = df_multi_items['chrtId'] + '_' + df_multi_items['Баркод']
 
     df_s = df_single_items[['Key', 'Фото']]
     df_m = df_multi_items[['Key', 'Фото']]
-    df_ph = df_s.append(df_m)
+    df_ph = pd.concat([df_s, df_m])
 
     if len(df_ph.Key) == len(set(df_ph.Key)):
         logging.info('Keys are unique')
@@ -88,56 +302,30 @@ def main():
         logging.warning('Duplicates in keys')
 
     key_photo_dict_all = get_code_photo_dict_from_df_ph(df_ph)
-    prods_inf = get_all_single_products_code_id_info(ms_token)
-
-    key_photo_dict = {code: photos for code, photos in key_photo_dict_all.items() if code in prods_inf}
-
-    # upload photos for single items
-    for code, photos in tqdm(key_photo_dict.items(), total=len(key_photo_dict)):
-        product_id = prods_inf[code]
-        request_url = f'https://online.moysklad.ru/api/remap/1.2/entity/product/{product_id}/images'
-
-        exists_images = requests.get(request_url, headers={'Authorization': f'Basic {ms_token}'}).json()
-        exists_images = [image.get('filename', '') for image in exists_images.get('rows', [])]
-        product_images = [image for image in key_photo_dict[code] if image.filename not in exists_images]
-
-        for image in product_images:
-            print(image.url, 'uploading')
-            request_data = {"filename": image.filename,
-                            "content": image.file_data.decode('utf-8')}
-            r = requests.post(request_url, headers={
-                'Authorization': f'Basic {ms_token}',
-                'Content-type': 'Application/json'
-            }, data=json.dumps(request_data))
-
-            if r.status_code != 200:
-                logging.error(r.status_code, r.text)
-
-    # upload photos for multi items
-    variant_code_id_meta = get_all_multi_product_info(ms_token)
-
-    key_photo_dict = {code: photos for code, photos in key_photo_dict_all.items() if code in variant_code_id_meta}
-    for code, photos in tqdm(key_photo_dict.items(), total=len(key_photo_dict)):
-        variant_id = variant_code_id_meta[code]
-        request_url = f'https://online.moysklad.ru/api/remap/1.2/entity/variant/{variant_id}/images'
-
-        exists_images = requests.get(request_url, headers={
-            'Authorization': f'Basic {ms_token}'}).json()
-        exists_images = exists_images.get('rows', [])
-        exists_images_filenames = [image.get('filename', '') for image in exists_images]
-        product_images = [image for image in key_photo_dict[code] if image.filename not in exists_images_filenames]
-
-        for image in product_images:
-            request_data = {"filename": image.filename,
-                            "content": image.file_data.decode('utf-8')}
-            r = requests.post(request_url, headers={
-                'Authorization': f'Basic {ms_token}',
-                'Content-type': 'Application/json'
-            }, data=json.dumps(request_data))
 
-            if r.status_code != 200:
-                logging.error(r.status_code, r.text)
+    entity_images = []
+    for entity_name in ('product', 'variant'):
+        with span('read_ms_images', entity=entity_name):
+            inventory = get_images_inventory(entity_name, ms_token)
+        for code, photos in key_photo_dict_all.items():
+            if code in inventory:
+                entity_id, exists_filenames = inventory[code]
+                entity_images.append(
+                    (f'https://online.moysklad.ru/api/remap/1.2/entity/{entity_name}/{entity_id}/images',
+                     photos, exists_filenames))
+
+    cache_dir = os.getenv('PHOTO_CACHE_DIR', '.photo_cache')
+    cache = ImageCache(cache_dir, max_bytes=int(os.getenv('PHOTO_CACHE_MAX_MB', 512)) * 2 ** 20)
+    manifest = UploadManifest(os.path.join(cache_dir, 'uploaded.json'))
+
+    pipeline = ImageTransferPipeline(ms_token,
+                                     download_workers=int(os.getenv('PHOTO_DOWNLOAD_WORKERS', 8)),
+                                     upload_workers=int(os.getenv('PHOTO_UPLOAD_WORKERS', 4)),
+                                     cache=cache, manifest=manifest)
+    with span('transfer_images', entities=len(entity_images)):
+        pipeline.run(entity_images)
 
 
 if __name__ == "__main__":
+    profile_from_argv()
     main()
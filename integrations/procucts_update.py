@@ -1,55 +1,54 @@
-import os
-import requests
 import json
 from tqdm import tqdm
+from profiling import profile_from_argv
+from pyhttp import span
+from job_context import JobContext
 try:
-    from libs.pywb.nomeclature import WBNomenclature
-    from libs.pymysklad.pymyskald import MSDict, get_product_attributes, MSVariants, MSUserDict, \
-        get_all_multi_product_codes, get_all_product_codes, get_all_single_product_codes, get_product_meta_by_code
+    from libs.pymysklad.pymyskald import MSException, MSMetadataRegistry, MSUserDict, \
+        get_all_multi_product_codes, get_all_product_codes, get_all_single_product_codes, get_product_meta_by_code, \
+        session
 except ImportError:
-    from nomeclature import WBNomenclature
-    from pymyskald import MSDict, get_product_attributes, MSVariants, MSUserDict, \
-        get_all_multi_product_codes, get_all_product_codes, get_all_single_product_codes, get_product_meta_by_code
+    from pymyskald import MSException, MSMetadataRegistry, MSUserDict, \
+        get_all_multi_product_codes, get_all_product_codes, get_all_single_product_codes, get_product_meta_by_code, \
+        session
+
+# Product attributes whose custom entities are filled with new values of WB cards,
+# countries dictionary is found by name when there is no such attribute.
+BRAND_ATTRIBUTE_NAME = 'Бренд'
+COUNTRY_ATTRIBUTE_NAME = 'Страна производства'
 
 class ProductCreator:
     DEFAULT_META_DICT = {
-        'currency': 'руб',
         'uom': 'шт',
         'counterparty': 'ООО "Поставщик"',
     }
+    ATTRIBUTE_NAMES = {
+        'Цвет': 'Основной цвет',
+        'Размер': 'Размер',
+        'Бренд': 'Бренд',
+        'Баркод': 'Баркод',
+    }
 
-    def __init__(self, token, metas):
-        self.metas = metas
+    def __init__(self, token, metadata: MSMetadataRegistry):
         self.token = token
+        self.metadata = metadata
+        self.metas = {key: metadata.get_attribute_meta('product', name) for key, name in self.ATTRIBUTE_NAMES.items()}
         self.default_meta_dict = self.get_default_meta_dict_by_dict()
 
-    @staticmethod
-    def get_default_meta_dict_by_dict():
-        # FIXME: hardcode.
+    def get_default_meta_dict_by_dict(self):
         result = dict()
-
-        result['currency'] = {
-            'href': 'https://online.moysklad.ru/api/remap/1.2/entity/currency/82b987d0-58a3-11eb-0a80-022e00408604',
-            'metadataHref': 'https://online.moysklad.ru/api/remap/1.2/entity/currency/metadata',
-            'type': 'currency',
-            'mediaType': 'application/json',
-            'uuidHref': 'https://online.moysklad.ru/app/#currency/edit?id=82b987d0-58a3-11eb-0a80-022e00408604'}
-
-        result['counterparty'] = {
-            'href': 'https://online.moysklad.ru/api/remap/1.2/entity/counterparty/82b97670-58a3-11eb-0a80-022e00408600',
-            'metadataHref': 'https://online.moysklad.ru/api/remap/1.2/entity/counterparty/metadata',
-            'type': 'counterparty',
-            'mediaType': 'application/json',
-            'uuidHref': 'https://online.moysklad.ru/app/#company/edit?id=82b97670-58a3-11eb-0a80-022e00408600'}
-
-        result['uom'] = {
-            'href': 'https://online.moysklad.ru/api/remap/1.2/entity/uom/19f1edc0-fc42-4001-94cb-c9ec9c62ec10',
-            'metadataHref': 'https://online.moysklad.ru/api/remap/1.2/entity/uom/metadata',
-            'type': 'uom',
-            'mediaType': 'application/json'}
-
+        for entity_name, name in self.DEFAULT_META_DICT.items():
+            entity = self.metadata.get_entity(entity_name, name)
+            if entity is None:
+                raise MSException(f'{entity_name} "{name}" not found')
+            result[entity_name] = entity['meta']
         return result
 
+    def get_country_meta(self, country_name):
+        country = self.metadata.get_entity('country', country_name)
+        if country is not None:
+            return country['meta']
+
     def upload_single_item_from_nom_row(self, row, brands_map):
         auth_header = f'Basic {self.token}'
         request_url = 'https://online.moysklad.ru/api/remap/1.2/entity/product'
@@ -78,9 +77,7 @@ class ProductCreator:
                     "value": row['Размер на бирке']
                 },
                 {
-                    "meta": {
-                        'href': 'https://online.moysklad.ru/api/remap/1.2/entity/product/metadata/attributes/417996a3-600f-11eb-0a80-03a10001b489',
-                        'type': 'attributemetadata', 'mediaType': 'application/json'},
+                    "meta": self.metas['Бренд'],
                     "value": brands_map[row['Бренд']],
                 },
                 {
@@ -96,10 +93,7 @@ class ProductCreator:
             ],
         }
 
-        country_dict = MSDict('country', self.token)
-        country_meta = country_dict.find_item_by_attribute_value('name', row['Страна производитель'])
-        if country_meta is not None:
-            country_meta = country_meta.get_meta()
+        country_meta = self.get_country_meta(row['Страна производитель'])
         if country_meta is not None:
             request_data['country'] = {'meta': country_meta}
 
@@ -107,7 +101,7 @@ class ProductCreator:
             'Authorization': auth_header,
             'Content-Type': 'Application/json',
         }
-        r = requests.post(request_url, headers=headers, data=json.dumps(request_data))
+        r = session.post(request_url, headers=headers, data=json.dumps(request_data))
         return r
 
     def upload_base_item_from_nom_row(self, row, brands_map):
@@ -127,9 +121,7 @@ class ProductCreator:
             },
             "attributes": [
                 {
-                    "meta": {
-                        'href': 'https://online.moysklad.ru/api/remap/1.2/entity/product/metadata/attributes/417996a3-600f-11eb-0a80-03a10001b489',
-                        'type': 'attributemetadata', 'mediaType': 'application/json'},
+                    "meta": self.metas['Бренд'],
                     "value": brands_map[row['Бренд']],
                 },
             ],
@@ -139,10 +131,7 @@ class ProductCreator:
                 },
             ],
         }
-        country_dict = MSDict('country', self.token)
-        country_meta = country_dict.find_item_by_attribute_value('name', row['Страна производитель'])
-        if country_meta is not None:
-            country_meta = country_meta.get_meta()
+        country_meta = self.get_country_meta(row['Страна производитель'])
         if country_meta is not None:
             request_data['country'] = {'meta': country_meta}
 
@@ -150,7 +139,7 @@ class ProductCreator:
             'Content-Type': 'Application/json',
             'Authorization': f'Basic {self.token}'
         }
-        r = requests.post(request_url, headers=headers, data=json.dumps(request_data))
+        r = session.post(request_url, headers=headers, data=json.dumps(request_data))
         return r
 
     def add_modification_to_product(self, product_meta, row, char_dict):
@@ -193,103 +182,110 @@ class ProductCreator:
             'Authorization': f'Basic {self.token}'
         }
 
-        r = requests.post(request_url, headers=headers, data=json.dumps(request_data))
+        r = session.post(request_url, headers=headers, data=json.dumps(request_data))
         return r
 
 
-def main():
+def get_producer_country_dict_id(metadata: MSMetadataRegistry):
+    """
+    Countries dictionary linked to product attribute, accounts without the attribute keep the dictionary
+    with the same name.
+    """
+    try:
+        return metadata.get_attribute_dict_id('product', COUNTRY_ATTRIBUTE_NAME)
+    except MSException:
+        producer_countries = metadata.get_custom_entity(COUNTRY_ATTRIBUTE_NAME)
+    if producer_countries is None:
+        raise MSException(f'Attribute or custom entity "{COUNTRY_ATTRIBUTE_NAME}" not found')
+    return producer_countries['id']
+
+
+def main(context=None):
+    context = context or JobContext()
     print('Script starts')
-    ms_token = os.getenv('MS_TOKEN')
-    wb_token = os.getenv('WB_TOKEN')
-    supplier_id = os.getenv('SUPPLIER_ID')
+    ms_token = context.ms_token
 
     ms_auth = f'Basic {ms_token}'
-    nom = WBNomenclature(wb_token, supplier_id)
+    nom = context.get_nomenclature()
     print('Get meta data from MS')
-    # TODO: функционал получения айдишников по имени, хардкод - плохо.
-    brand_dict_id = '3f3169c7-600f-11eb-0a80-069d0001bb3c'
-    producer_country_dict_id = '214623e3-600f-11eb-0a80-07c20001a5c4'
+    metadata = context.get_metadata()
+    with span('read_ms_metadata'):
+        creator = ProductCreator(ms_token, metadata)
+        brand_dict_id = metadata.get_attribute_dict_id('product', BRAND_ATTRIBUTE_NAME)
+        producer_country_dict_id = get_producer_country_dict_id(metadata)
     brands_dict = MSUserDict(brand_dict_id, ms_token)
     producer_countries_dict = MSUserDict(producer_country_dict_id, ms_token)
 
-    product_attrs = get_product_attributes(ms_token)
-
-    color_meta = product_attrs.find_item_by_attribute_value('name', 'Основной цвет').get_meta()
-    size_meta = product_attrs.find_item_by_attribute_value('name', 'Размер').get_meta()
-    brand_meta = product_attrs.find_item_by_attribute_value('name', 'Бренд').get_meta()
-    barcode_meta = product_attrs.find_item_by_attribute_value('name', 'Баркод').get_meta()
-
-    metas = {
-        'Цвет': color_meta,
-        'Размер': size_meta,
-        'Brand': brand_meta,
-        'Баркод': barcode_meta,
-    }
-
-    variants = MSVariants('variant', ms_token)
     char_names = ['Размер', 'Цвет', 'Баркод']
-    char_dict = variants.get_chars_id_dict_for_list(char_names)
+    with span('read_ms_characteristics'):
+        char_dict = metadata.ensure_characteristics(char_names)
 
     print('Get codes from MS')
-    multi_products_codes = get_all_multi_product_codes(ms_auth)
-    single_product_codes = get_all_single_product_codes(ms_auth)
-    product_codes = get_all_product_codes(ms_auth)
+    with span('read_ms_codes'):
+        multi_products_codes = get_all_multi_product_codes(ms_auth)
+        single_product_codes = get_all_single_product_codes(ms_auth)
+        product_codes = get_all_product_codes(ms_auth)
 
     print('Get nomenclature from WB')
-    new_single_items = nom.get_single_items_filtered_by_keys(single_product_codes)
-    new_multi_items = nom.get_multi_items_filtered_by_keys(multi_products_codes)
+    with span('read_wb_nomenclature'):
+        new_single_items = nom.get_single_items_filtered_by_keys(single_product_codes)
+        new_multi_items = nom.get_multi_items_filtered_by_keys(multi_products_codes)
 
     print('Add new values to MS dicts')
     brands = set(list(new_single_items['Бренд']) + list(new_multi_items['Бренд']))
     countries = set(list(new_single_items['Страна производитель']) + list(new_multi_items['Страна производитель']))
 
-    brands_dict.create_items_if_not_exists(brands)
-    producer_countries_dict.create_items_if_not_exists(countries)
+    with span('update_dicts', brands=len(brands), countries=len(countries)):
+        brands_dict.create_items_if_not_exists(brands)
+        producer_countries_dict.create_items_if_not_exists(countries)
 
-    brands_map = brands_dict.get_items_dict_filtered_by_names(brands)
+        brands_map = brands_dict.get_items_dict_filtered_by_names(brands)
 
-    creator = ProductCreator(ms_token, metas)
     print('Creating new items..')
     error_rows = []
-    for index, row in tqdm(new_single_items.iterrows(), total=len(new_single_items)):
-        try:
-            r = creator.upload_single_item_from_nom_row(row, brands_map)
-            if r.status_code != 200:
-                print(r.json())
-        except Exception as e:
-            print(row)
-            print(str(e))
-            error_rows.append(row)
-
-    for article in tqdm(new_multi_items['Артикул поставщика'].unique(),
-                        total=len(new_multi_items['Артикул поставщика'].unique())):
-        df_item = new_multi_items[new_multi_items['Артикул поставщика'] == article]
-        item_row = df_item.iloc[0]
-
-        if item_row['Артикул поставщика'] + '_base' in product_codes:
-            product_meta = get_product_meta_by_code(item_row['Артикул поставщика'] + '_base', ms_token)
-        else:
-            r = creator.upload_base_item_from_nom_row(item_row, brands_map)
-            if 'errors' in r.json():
-                print(f'error to upload row {item_row}')
-                print(r.text)
-                print(r.json()['errors'])
-                continue
-
-            product = r.json()
-            product_meta = product['meta']
-
-        for index, row in df_item.iterrows():
-            if row['Баркод'] == '':
-                print(f'Пустой баркод у {row["Артикул цвета"]}. Предмет не создан')
-                continue
-            r = creator.add_modification_to_product(product_meta, row, char_dict)
-            if r.status_code != 200:
-                if product_meta is None:
-                    print(f'Product meta is None у {row["Артикул цвета"]}. Предмет не создан')
+    with span('create_single_items', items=len(new_single_items)):
+        for index, row in tqdm(new_single_items.iterrows(), total=len(new_single_items)):
+            try:
+                r = creator.upload_single_item_from_nom_row(row, brands_map)
+                if r.status_code != 200:
+                    print(r.json())
+            except Exception as e:
+                print(row)
+                print(str(e))
+                error_rows.append(row)
+
+    articles = new_multi_items['Артикул поставщика'].unique()
+    with span('create_multi_items', articles=len(articles)):
+        for article in tqdm(articles, total=len(articles)):
+            with span('article', article=article):
+                df_item = new_multi_items[new_multi_items['Артикул поставщика'] == article]
+                item_row = df_item.iloc[0]
+
+                if item_row['Артикул поставщика'] + '_base' in product_codes:
+                    product_meta = get_product_meta_by_code(item_row['Артикул поставщика'] + '_base', ms_token)
                 else:
-                    print(row)
-                    raise Exception(str(r.json()))
+                    r = creator.upload_base_item_from_nom_row(item_row, brands_map)
+                    if 'errors' in r.json():
+                        print(f'error to upload row {item_row}')
+                        print(r.text)
+                        print(r.json()['errors'])
+                        continue
+
+                    product = r.json()
+                    product_meta = product['meta']
+
+                for index, row in df_item.iterrows():
+                    if row['Баркод'] == '':
+                        print(f'Пустой баркод у {row["Артикул цвета"]}. Предмет не создан')
+                        continue
+                    r = creator.add_modification_to_product(product_meta, row, char_dict)
+                    if r.status_code != 200:
+                        if product_meta is None:
+                            print(f'Product meta is None у {row["Артикул цвета"]}. Предмет не создан')
+                        else:
+                            print(row)
+                            raise Exception(str(r.json()))
 
 if __name__ == "__main__":
+    profile_from_argv()
     main()
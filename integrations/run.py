@@ -0,0 +1,122 @@
+"""
+Runs several integration jobs in one process, so they share HTTP sessions, caches and catalog snapshot:
+
+    python integrations/run.py products_update sales_update stocks_sync photo_update --parallel
+
+Jobs keep the order of DEPENDENCIES when they are run together, independent ones run concurrently with --parallel.
+"""
+import argparse
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import photo_update
+import procucts_update
+import sales_update
+import stocks_sync
+from job_context import JobContext
+from profiling import Profiler, start_profiler
+from pyhttp import span
+
+JOBS = {
+    'products_update': procucts_update.main,
+    'sales_update': sales_update.main,
+    'stocks_sync': stocks_sync.main,
+    'photo_update': photo_update.main,
+}
+# Sales and stocks look up barcodes of items created by products_update, photos are uploaded to them.
+# Stocks are compared after sales documents changed them.
+DEPENDENCIES = {
+    'sales_update': ('products_update',),
+    'stocks_sync': ('products_update', 'sales_update'),
+    'photo_update': ('products_update',),
+}
+
+
+class JobResult:
+    def __init__(self, name):
+        self.name = name
+        self.status = 'skipped'
+        self.wall = 0.0
+        self.error = None
+
+
+def run_job(name, context) -> JobResult:
+    result = JobResult(name)
+    started = time.perf_counter()
+    try:
+        with span('job', job=name):
+            JOBS[name](context)
+        result.status = 'ok'
+    except Exception as e:
+        logging.exception(f'{name} failed')
+        result.status = 'failed'
+        result.error = e
+    result.wall = time.perf_counter() - started
+    return result
+
+
+def run_jobs(names, context, parallel=False) -> list:
+    """
+    Runs jobs after their dependencies from `names`. Dependents of failed job are skipped.
+    """
+    results = {name: JobResult(name) for name in names}
+    pending = list(names)
+    finished = set()
+    running = dict()
+    with ThreadPoolExecutor(max_workers=len(names) if parallel else 1) as executor:
+        while pending or running:
+            for name in list(pending):
+                dependencies = [dependency for dependency in DEPENDENCIES.get(name, ()) if dependency in names]
+                if any(results[dependency].status in ('failed', 'skipped') and dependency in finished
+                       for dependency in dependencies):
+                    print(f'{name} skipped: dependency failed')
+                    pending.remove(name)
+                    finished.add(name)
+                elif all(dependency in finished for dependency in dependencies):
+                    pending.remove(name)
+                    running[executor.submit(run_job, name, context)] = name
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name] = future.result()
+                finished.add(name)
+
+    return [results[name] for name in names]
+
+
+def print_summary(results, wall):
+    print(f'{"job":<16}{"status":>8}{"wall, s":>10}')
+    for result in results:
+        print(f'{result.name:<16}{result.status:>8}{result.wall:>10.1f}')
+    print(f'{"total":<16}{"":>8}{wall:>10.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run integration jobs in one process')
+    parser.add_argument('jobs', nargs='*', help=f'jobs to run: {", ".join(JOBS)}, all by default')
+    parser.add_argument('--parallel', action='store_true', help='run independent jobs concurrently')
+    parser.add_argument('--config', default='config.json')
+    parser.add_argument('--profile', action='store_true', help='write profile of the run to PROFILE_DIR')
+    parser.add_argument('--profile-mode', choices=Profiler.MODES, default='sampling')
+    args = parser.parse_args()
+    if args.profile:
+        start_profiler(args.profile_mode)
+
+    unknown_jobs = set(args.jobs) - set(JOBS)
+    if unknown_jobs:
+        parser.error(f'unknown jobs: {", ".join(sorted(unknown_jobs))}')
+    names = [name for name in JOBS if name in args.jobs or not args.jobs]
+    started = time.perf_counter()
+    results = run_jobs(names, JobContext(args.config), args.parallel)
+    print_summary(results, time.perf_counter() - started)
+    if any(result.status != 'ok' for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,80 @@
 import json
-import requests
 from datetime import datetime, timedelta
 import os
-from pywb import WBConnector
-from pymyskald import get_barcode_meta, MSDict
-
-ms_token = os.getenv('MS_TOKEN')
-wb_token_64 = os.getenv('WB_TOKEN_64')
+from pywb import WBConnector, LastChangeCursor
+from pymyskald import get_barcode_meta, MSDict, session
+from profiling import profile_from_argv
+from pyhttp import span, write_json_atomically
+from job_context import JobContext
+
+
+# A row failing this many runs stops holding the cursor and is kept as skipped.
+MAX_SALE_ATTEMPTS = int(os.getenv('WB_SALE_MAX_ATTEMPTS', 5))
+
+
+class SaleFailures:
+    """
+    Sales rows which were not posted, persisted between runs in json file.
+    `retry` rows are requested again: cursor stops before the first of them.
+    `skipped` rows failed permanently or MAX_SALE_ATTEMPTS times, they are kept for manual check only.
+    """
+
+    def __init__(self, path, max_attempts=MAX_SALE_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        data = dict()
+        if os.path.exists(path):
+            with open(path) as failures_file:
+                data = json.loads(failures_file.read())
+        self.retry = data.get('retry', dict())
+        self.skipped = data.get('skipped', dict())
+        self.new_skipped = []
+
+    @staticmethod
+    def _get_entry(row, reason, attempts) -> dict:
+        return {'barcode': row['barcode'], 'lastChangeDate': row['lastChangeDate'], 'reason': reason,
+                'attempts': attempts}
+
+    def fail(self, row, reason):
+        attempts = self.retry.pop(row['saleID'], dict()).get('attempts', 0) + 1
+        if attempts < self.max_attempts:
+            self.retry[row['saleID']] = self._get_entry(row, reason, attempts)
+        else:
+            self.skip(row, reason, attempts)
+
+    def skip(self, row, reason, attempts=1):
+        self.retry.pop(row['saleID'], None)
+        self.skipped[row['saleID']] = self._get_entry(row, reason, attempts)
+        self.new_skipped.append(row['saleID'])
+
+    def resolve(self, sale_ids):
+        for sale_id in sale_ids:
+            self.retry.pop(sale_id, None)
+
+    def expire(self, sale_ids):
+        """
+        Counts the run as attempt for retry rows WB did not return, so they can't hold the cursor forever.
+        :param sale_ids: saleID of rows returned by WB in this run
+        """
+        sale_ids = set(sale_ids)
+        for sale_id, entry in list(self.retry.items()):
+            if sale_id not in sale_ids:
+                self.fail(dict(entry, saleID=sale_id), 'Not returned by WB')
+
+    def get_cursor_date(self, last_change_date):
+        """
+        Cursor stops before the first row to request again, so WB returns it next time.
+        :param last_change_date: lastChangeDate of the last row of this run
+        """
+        retry_date = min((entry['lastChangeDate'] for entry in self.retry.values()), default=None)
+        if retry_date is None:
+            return last_change_date
+        return min(retry_date, last_change_date)
+
+    def save(self):
+        write_json_atomically(self.path, {'retry': self.retry, 'skipped': self.skipped}, indent=2,
+                              ensure_ascii=False)
 
-with open('config.json') as config_file:
-    config = json.loads(config_file.read())
 
 def get_reporting_date_by_gap(days: int = 90) -> str:
     MAX_DAYS = 90
@@ -24,13 +89,6 @@ def get_reporting_date_by_gap(days: int = 90) -> str:
     return reporting_date_from.strftime(DATE_PATTERN)
 
 
-reporting_date = get_reporting_date_by_gap(0)
-
-sales = WBConnector(wb_token_64, 'sales')
-df_sales = sales.get_data_df(reporting_date)
-df_sales['date'] = df_sales['date'].apply(lambda x: x.replace('T', ' ') + '.000')
-
-
 def get_return_request_data(row, config, token, store_meta):
     product_meta = get_barcode_meta(row['barcode'], token)
     if product_meta is None:
@@ -103,37 +161,79 @@ def get_request_data_for_sale(sale_row, config, token, store_meta):
     return request_data
 
 
-exists_sales = MSDict('demand', token=ms_token).get_all_codes()
-exists_returns = MSDict('salesreturn', token=ms_token).get_all_codes()
-df_sales = df_sales[(~df_sales['saleID'].isin(exists_sales))&(~df_sales['saleID'].isin(exists_returns))]
-
-error_barcodes = set()
-for store in df_sales['warehouseName'].unique():
-    store_name = f'[WB] {store}'
-    stores = requests.get(f'https://online.moysklad.ru/api/remap/1.2/entity/store?filter=name={store_name}',
-                              headers={'Authorization': f'Basic {ms_token}'}).json()['rows']
-    if len(stores) == 0:
-        print(f'Склад {store_name} не найден')
-        continue
-    store_meta = stores[0]['meta']
-
-    for index, row in df_sales.iterrows():
-        headers = {'Authorization': f'Basic {ms_token}', 'Content-Type': 'application/json'}
-
-        if ('R' in row['saleID'] or 'D' in row['saleID']) and int(row['quantity']) < 0:
-            request_data = get_return_request_data(row, config, ms_token, store_meta)
-            request_url = 'https://online.moysklad.ru/api/remap/1.2/entity/salesreturn'
-            r = requests.post(request_url, headers=headers, data=json.dumps(request_data))
-        elif 'S' in row['saleID'] and int(row['quantity']) > 0:
-            request_data = get_request_data_for_sale(row, config, ms_token, store_meta)
-            request_url = 'https://online.moysklad.ru/api/remap/1.2/entity/demand'
-            r = requests.post(request_url, headers=headers, data=json.dumps(request_data))
-        else:
-            r = None
+def main(context=None):
+    context = context or JobContext()
+    ms_token = context.ms_token
+    config = context.config
+
+    reporting_date = get_reporting_date_by_gap(0)
 
-        if r is None or r.status_code != 200:
-            error_barcodes.add(row['barcode'])
+    cursor = LastChangeCursor(os.getenv('WB_CURSOR_PATH', 'wb_cursor.json'))
+    sales = WBConnector(context.wb_token_64, 'sales', rate_limiter=context.get_wb_rate_limiter('sales'))
+    with span('read_wb_changes') as changes_span:
+        df_changes = sales.get_changes_df(cursor, reporting_date)
+        changes_span.set_attribute('rows', len(df_changes))
+
+    failures = SaleFailures(os.getenv('WB_SALES_FAILURES_PATH', 'wb_sales_failures.json'))
+    failures.expire(df_changes['saleID'] if len(df_changes) else [])
+    if len(df_changes) == 0:
+        failures.save()
+        print('No changed sales')
+        return
 
-print('Barcodes was not found:')
-for barcode in error_barcodes:
-    print(barcode)
+    df_sales = df_changes.copy()
+    df_sales['date'] = df_sales['date'].apply(lambda x: x.replace('T', ' ') + '.000')
+
+    with span('read_ms_codes'):
+        exists_sales = MSDict('demand', token=ms_token).get_all_codes()
+        exists_returns = MSDict('salesreturn', token=ms_token).get_all_codes()
+    is_exists = df_sales['saleID'].isin(exists_sales) | df_sales['saleID'].isin(exists_returns)
+    failures.resolve(df_sales.loc[is_exists, 'saleID'])
+    df_sales = df_sales[~is_exists]
+
+    with span('read_ms_stores'):
+        stores = context.get_stores().ensure_stores(f'[WB] {store}' for store in df_sales['warehouseName'].unique())
+    for store, df_store_sales in df_sales.groupby('warehouseName'):
+        with span('store', store=store):
+            store_meta = stores[f'[WB] {store}']['meta']
+
+            for index, row in df_store_sales.iterrows():
+                headers = {'Authorization': f'Basic {ms_token}', 'Content-Type': 'application/json'}
+
+                if ('R' in row['saleID'] or 'D' in row['saleID']) and int(row['quantity']) < 0:
+                    request_data = get_return_request_data(row, config, ms_token, store_meta)
+                    request_url = 'https://online.moysklad.ru/api/remap/1.2/entity/salesreturn'
+                elif 'S' in row['saleID'] and int(row['quantity']) > 0:
+                    request_data = get_request_data_for_sale(row, config, ms_token, store_meta)
+                    request_url = 'https://online.moysklad.ru/api/remap/1.2/entity/demand'
+                else:
+                    # Neither sale nor return, the same row will never be posted.
+                    failures.skip(row, f'Unknown saleID type, quantity {row["quantity"]}')
+                    continue
+
+                if request_data is None:
+                    # Product may be created by products_update later, so the row is retried.
+                    failures.fail(row, f'Barcode {row["barcode"]} not found')
+                    continue
+
+                r = session.post(request_url, headers=headers, data=json.dumps(request_data))
+                if r.status_code != 200:
+                    failures.fail(row, f'{r.status_code} {r.text}')
+                else:
+                    failures.resolve([row['saleID']])
+
+    if failures.retry:
+        print('Sales will be requested again:')
+        for sale_id, entry in failures.retry.items():
+            print(sale_id, entry['barcode'], entry['reason'])
+    if failures.new_skipped:
+        print(f'Sales skipped, kept in {failures.path}:')
+        for sale_id in failures.new_skipped:
+            print(sale_id, failures.skipped[sale_id]['barcode'], failures.skipped[sale_id]['reason'])
+    failures.save()
+
+    cursor.set('sales', failures.get_cursor_date(WBConnector.get_last_change_date(df_changes)))
+
+if __name__ == '__main__':
+    profile_from_argv()
+    main()
@@ -1,17 +1,26 @@
+import logging
 import os
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
-from pymyskald import get_ms_stocks_by_store_meta, MSDict, get_barcode_meta
+from job_context import JobContext
+from pymyskald import get_ms_stocks_by_store_meta, MSAssortment, MSDict, get_barcode_meta
 from pywb import WBConnector
+from profiling import profile_from_argv
+from pyhttp import current_span, span
 from datetime import datetime, timedelta
 from tqdm import tqdm
-import json
 
+# MoySklad allows 5 parallel requests for an account.
+STORE_WORKERS = int(os.getenv('STOCKS_SYNC_WORKERS', 4))
 
-def generate_losses_data(losses_dict: dict, config, token, store_meta):
+
+def generate_losses_data(losses_dict: dict, config, token, store_meta, assortment: MSAssortment = None):
     positions = []
     for barcode, quantity in tqdm(losses_dict.items()):
-        position_meta = get_barcode_meta(barcode, token)
+        position_meta = get_barcode_meta(barcode, token) if assortment is None else \
+            assortment.get_barcode_meta(barcode, token)
 
         if position_meta is None:
             print(f'{barcode} not found in MS. sync item failed')
@@ -32,11 +41,12 @@ def generate_losses_data(losses_dict: dict, config, token, store_meta):
     return request_data
 
 
-def generate_supplies_data(supplies_dict: dict, config, token, store_meta):
+def generate_supplies_data(supplies_dict: dict, config, token, store_meta, assortment: MSAssortment = None):
     positions = []
     for barcode, quantity in tqdm(supplies_dict.items()):
 
-        position_meta = get_barcode_meta(barcode, token)
+        position_meta = get_barcode_meta(barcode, token) if assortment is None else \
+            assortment.get_barcode_meta(barcode, token)
 
         if position_meta is None:
             print(f'{barcode} not found in MS. sync item failed')
@@ -80,73 +90,131 @@ def get_reporting_date_by_gap(days: int = 90) -> str:
     return reporting_date_from.strftime(DATE_PATTERN)
 
 
-if __name__ == '__main__':
+class StoreSyncResult:
+    def __init__(self, store):
+        self.store = store
+        self.status = 'skipped'
+        self.wall = 0.0
+        self.supplies = 0
+        self.losses = 0
+        self.error = None
+
+
+def sync_store(store, wb_stocks_df, context, assortment, parent_span=None) -> StoreSyncResult:
+    """
+    Creates supply and loss in MoySklad store `[WB] <store>` so its stocks match WB warehouse.
+    Errors are logged and returned in result, so other stores are synced anyway.
+    """
+    result = StoreSyncResult(store)
+    started = time.perf_counter()
+    ms_token = context.ms_token
+    config = context.config
+    try:
+        with span('store', parent=parent_span, store=store) as store_span:
+            print('STORE:', store)
+            wb_stocks_store_df = wb_stocks_df[wb_stocks_df['warehouseName'] == store]
+
+            wb_stocks = wb_stocks_store_df.groupby('barcode').agg({'quantityNotInOrders': 'sum'})['quantityNotInOrders'].to_dict()
+            wb_stocks = defaultdict(int, wb_stocks)
+
+            print('Read MS Data...')
+            with span('read_ms_data'):
+                store_meta = context.get_stores().get_by_name(f'[WB] {store}')['meta']
+                ms_stocks = get_ms_stocks_by_store_meta(store_meta, ms_token, assortment)
+                ms_stocks = defaultdict(int, ms_stocks)
+
+            all_barcodes = set(ms_stocks.keys()) | set(wb_stocks.keys())
+            compare_dict = {
+                barcode: wb_stocks[barcode] - ms_stocks[barcode]
+                for barcode in all_barcodes
+            }
+
+            supplies = {barcode: difference for barcode, difference in compare_dict.items() if difference > 0}
+            losses = {barcode: difference for barcode, difference in compare_dict.items() if difference < 0}
+            store_span.set_attribute('supplies', len(supplies))
+            store_span.set_attribute('losses', len(losses))
+
+            print('Generating supply request')
+            with span('generate_supplies', barcodes=len(supplies)):
+                supplies_data = generate_supplies_data(supplies, config, ms_token, store_meta, assortment)
+            print('Generating losses request')
+            with span('generate_losses', barcodes=len(losses)):
+                losses_data = generate_losses_data(losses, config, ms_token, store_meta, assortment)
+            result.supplies = len(supplies_data['positions'])
+            result.losses = len(losses_data['positions'])
+
+            supply_ms_dict = MSDict('supply', ms_token)
+            losses_ms_dict = MSDict('loss', ms_token)
+            with span('create_documents', supplies=len(supplies_data['positions']),
+                      losses=len(losses_data['positions'])):
+                if len(supplies_data['positions']) > 0:
+                    if len(supplies_data['positions']) < 500:
+                        result_supplies = supply_ms_dict.create(supplies_data)
+                    if len(supplies_data['positions']) >= 500:
+                        data = supplies_data.copy()
+                        data['positions'] = data['positions'][:500]
+                        result_supplies = supply_ms_dict.create(data)
+                        print(f'Incomes result:', result_supplies)
+
+                        data = supplies_data.copy()
+                        data['positions'] = data['positions'][500:1000]
+                        result_supplies = supply_ms_dict.create(data)
+                        print(f'Incomes result:', result_supplies)
+
+                        if len(supplies_data['positions']) > 1000:
+                            data = supplies_data.copy()
+                            data['positions'] = data['positions'][1000:1500]
+                            result_supplies = supply_ms_dict.create(data)
+                            print(f'Incomes result:', result_supplies)
+
+                if len(losses_data['positions']) > 0:
+                    result_loses = losses_ms_dict.create(losses_data)
+                    print(f'Losses result:', result_loses.status_code)
+        result.status = 'ok'
+    except Exception as e:
+        logging.exception(f'Store {store} sync failed')
+        result.status = 'failed'
+        result.error = e
+    finally:
+        result.wall = time.perf_counter() - started
+    return result
+
+
+def print_summary(results):
+    print(f'{"store":<32}{"status":>10}{"supplies":>10}{"losses":>8}{"wall, s":>10}')
+    for result in results:
+        print(f'{result.store:<32}{result.status:>10}{result.supplies:>10}{result.losses:>8}{result.wall:>10.1f}')
+
+
+def main(context=None):
+    context = context or JobContext()
     print('Sync started...')
-    ms_token = os.getenv('MS_TOKEN')
-    wb_token_64 = os.getenv('WB_TOKEN_64')
-    with open('config.json') as config_file:
-        config = json.loads(config_file.read())
-    store_dict = MSDict('store', ms_token)
 
-    wb_connector = WBConnector(wb_token_64, 'stocks')
+    wb_connector = WBConnector(context.wb_token_64, 'stocks', rate_limiter=context.get_wb_rate_limiter('stocks'))
 
     print('Read WB data...')
-    wb_stocks_df = wb_connector.get_data_df(get_reporting_date_by_gap(365)).fillna('')
-    wb_stocks_df = wb_stocks_df[wb_stocks_df['barcode'] != '']
-    for store in wb_stocks_df['warehouseName'].unique():
-        print('STORE:', store)
-        wb_stocks_store_df = wb_stocks_df[wb_stocks_df['warehouseName'] == store]
-
-        wb_stocks = wb_stocks_store_df.groupby('barcode').agg({'quantityNotInOrders': 'sum'})['quantityNotInOrders'].to_dict()
-        wb_stocks = defaultdict(int, wb_stocks)
-
-        print('Read MS Data...')
-        store_object = store_dict.strict_search_by_field_value('name', f'[WB] {store}')
-        if store_object is None:
-            print(store, 'Not found')
-            continue
-        else:
-            store_meta = store_object['meta']
-
-        ms_stocks = get_ms_stocks_by_store_meta(store_meta, ms_token)
-        ms_stocks = defaultdict(int, ms_stocks)
-
-        all_barcodes = set(ms_stocks.keys()) | set(wb_stocks.keys())
-        compare_dict = {
-            barcode: wb_stocks[barcode] - ms_stocks[barcode]
-            for barcode in all_barcodes
-        }
-
-        supplies = {barcode: difference for barcode, difference in compare_dict.items() if difference > 0}
-        losses = {barcode: difference for barcode, difference in compare_dict.items() if difference < 0}
-
-        print('Generating supply request')
-        supplies_data = generate_supplies_data(supplies, config, ms_token, store_meta)
-        print('Generating losses request')
-        losses_data = generate_losses_data(losses, config, ms_token, store_meta)
-
-        supply_ms_dict = MSDict('supply', ms_token)
-        losses_ms_dict = MSDict('loss', ms_token)
-        if len(supplies_data['positions']) > 0:
-            if len(supplies_data['positions']) < 500:
-                result_supplies = supply_ms_dict.create(supplies_data)
-            if len(supplies_data['positions']) >= 500:
-                data = supplies_data.copy()
-                data['positions'] = data['positions'][:500]
-                result_supplies = supply_ms_dict.create(data)
-                print(f'Incomes result:', result_supplies)
-
-                data = supplies_data.copy()
-                data['positions'] = data['positions'][500:1000]
-                result_supplies = supply_ms_dict.create(data)
-                print(f'Incomes result:', result_supplies)
-
-                if len(supplies_data['positions']) > 1000:
-                    data = supplies_data.copy()
-                    data['positions'] = data['positions'][1000:1500]
-                    result_supplies = supply_ms_dict.create(data)
-                    print(f'Incomes result:', result_supplies)
-
-        if len(losses_data['positions']) > 0:
-            result_loses = losses_ms_dict.create(losses_data)
-            print(f'Losses result:', result_loses.status_code)
+    with span('read_wb_data'):
+        wb_stocks_df = wb_connector.get_data_df(get_reporting_date_by_gap(365)).fillna('')
+        wb_stocks_df = wb_stocks_df[wb_stocks_df['barcode'] != '']
+    stores = wb_stocks_df['warehouseName'].unique()
+    with span('read_ms_stores'):
+        context.get_stores().ensure_stores(f'[WB] {store}' for store in stores)
+    with span('read_ms_assortment'):
+        assortment = context.get_assortment()
+
+    # Stores share MoySklad rate limiter and catalog, workers only overlap waiting for responses.
+    parent_span = current_span()
+    with ThreadPoolExecutor(max_workers=STORE_WORKERS) as executor:
+        futures = [executor.submit(sync_store, store, wb_stocks_df, context, assortment, parent_span)
+                   for store in stores]
+        results = [future.result() for future in futures]
+
+    print_summary(results)
+    failed_stores = [result.store for result in results if result.status == 'failed']
+    if failed_stores:
+        raise RuntimeError(f'Stocks sync failed for stores: {", ".join(failed_stores)}')
+
+
+if __name__ == '__main__':
+    profile_from_argv()
+    main()
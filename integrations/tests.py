@@ -0,0 +1,130 @@
+import pytest
+
+
+def test_image_cache_evicts_least_recently_used_images(tmp_path):
+    from image_cache import ImageCache
+
+    cache = ImageCache(str(tmp_path), max_bytes=25)
+    cache.put('https://wb/a.jpg', b'a' * 10)
+    cache.put('https://wb/b.jpg', b'b' * 10)
+    assert cache.get('https://wb/a.jpg') == b'a' * 10
+    cache.put('https://wb/c.jpg', b'c' * 10)
+
+    assert cache.total_bytes == 20
+    assert cache.get('https://wb/b.jpg') is None
+    assert cache.get_hash('https://wb/b.jpg') is None
+    assert cache.get('https://wb/a.jpg') == b'a' * 10
+
+    cache.put('https://wb/big.jpg', b'd' * 30)
+    assert cache.total_bytes <= 25
+    cache.save()
+    assert set(ImageCache(str(tmp_path), max_bytes=25).index) == set(cache.index)
+
+
+def test_image_pipeline_skips_entities_uploaded_before(tmp_path):
+    from image_cache import ImageCache, UploadManifest
+    from photo_update import Image, ImageTransferPipeline
+
+    cache = ImageCache(str(tmp_path))
+    manifest = UploadManifest(str(tmp_path / 'uploaded.json'))
+    image = Image('https://wb/big/new/1000/10000000-1.jpg')
+    manifest.add('product/1', cache.put(image.url, b'image'))
+    manifest.save()
+
+    pipeline = ImageTransferPipeline('token', download_workers=1, upload_workers=1, cache=cache,
+                                     manifest=UploadManifest(manifest.path))
+    request_url = 'https://online.moysklad.ru/api/remap/1.2/entity/product/1/images'
+    pipeline.run([(request_url, [image], None)])
+    assert pipeline.skipped.items == 1
+    assert pipeline.listing.items + pipeline.listing.errors == 0
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_run_jobs_skips_dependents_of_failed_job(monkeypatch, parallel):
+    import run
+
+    calls = []
+
+    def get_job(name, fail=False):
+        def job(context):
+            calls.append(name)
+            if fail:
+                raise ValueError(f'{name} failed')
+        return job
+
+    monkeypatch.setattr(run, 'JOBS', {'items': get_job('items', fail=True), 'sales': get_job('sales'),
+                                      'stocks': get_job('stocks'), 'prices': get_job('prices'),
+                                      'report': get_job('report')})
+    monkeypatch.setattr(run, 'DEPENDENCIES', {'sales': ('items',), 'stocks': ('sales',), 'report': ('prices',)})
+
+    results = run.run_jobs(['items', 'sales', 'stocks', 'prices', 'report'], None, parallel)
+    assert [result.status for result in results] == ['failed', 'skipped', 'skipped', 'ok', 'ok']
+    assert sorted(calls) == ['items', 'prices', 'report']
+    assert calls.index('prices') < calls.index('report')
+
+
+def test_products_update_finds_countries_dict_by_attribute_or_name():
+    import pymyskald
+    from fake_moysklad import FakeMoySklad
+    from procucts_update import get_producer_country_dict_id
+    from pyhttp import mount_redirects
+
+    fake = FakeMoySklad()
+    url = fake.start()
+    mount_redirects(pymyskald.session, {'https://online.moysklad.ru': url})
+    try:
+        countries = fake.add_custom_entity('Страна производства')
+        metadata = pymyskald.MSMetadataRegistry('token')
+        assert get_producer_country_dict_id(metadata) == countries['id']
+
+        other_countries = fake.add_custom_entity('Страны')
+        fake.add_attribute('product', 'Страна производства', custom_entity=other_countries)
+        assert get_producer_country_dict_id(pymyskald.MSMetadataRegistry('token')) == other_countries['id']
+    finally:
+        fake.stop()
+        pymyskald.session.adapters.pop('https://online.moysklad.ru', None)
+
+
+def test_sale_failures_skip_row_after_max_attempts(tmp_path):
+    from sales_update import SaleFailures
+
+    path = str(tmp_path / 'failures.json')
+    row = {'saleID': 'S1', 'barcode': '200', 'lastChangeDate': '2021-03-02T10:00:00'}
+    for attempts in (1, 2):
+        failures = SaleFailures(path, max_attempts=3)
+        failures.fail(row, 'Barcode 200 not found')
+        failures.save()
+        assert failures.retry['S1']['attempts'] == attempts
+
+    failures = SaleFailures(path, max_attempts=3)
+    assert failures.retry['S1']['attempts'] == 2
+    failures.fail(row, 'Barcode 200 not found')
+    assert failures.retry == {}
+    assert failures.skipped['S1']['attempts'] == 3
+    assert failures.new_skipped == ['S1']
+
+
+def test_sale_failures_resolve_and_expire_rows_to_retry(tmp_path):
+    from sales_update import SaleFailures
+
+    failures = SaleFailures(str(tmp_path / 'failures.json'), max_attempts=2)
+    failures.fail({'saleID': 'S1', 'barcode': '1', 'lastChangeDate': '2021-03-02T10:00:00'}, '500')
+    failures.fail({'saleID': 'S2', 'barcode': '2', 'lastChangeDate': '2021-03-03T10:00:00'}, '500')
+    failures.resolve(['S1', 'S3'])
+    assert list(failures.retry) == ['S2']
+
+    # Row WB stops returning counts the run as attempt and is skipped after max attempts.
+    failures.expire(['S1'])
+    assert failures.retry == {}
+    assert failures.skipped['S2']['reason'] == 'Not returned by WB'
+
+
+def test_sale_failures_cursor_stops_before_first_row_to_retry(tmp_path):
+    from sales_update import SaleFailures
+
+    failures = SaleFailures(str(tmp_path / 'failures.json'))
+    assert failures.get_cursor_date('2021-03-05T10:00:00') == '2021-03-05T10:00:00'
+    failures.fail({'saleID': 'S2', 'barcode': '2', 'lastChangeDate': '2021-03-03T10:00:00'}, '500')
+    failures.fail({'saleID': 'S1', 'barcode': '1', 'lastChangeDate': '2021-03-02T10:00:00'}, '500')
+    assert failures.get_cursor_date('2021-03-05T10:00:00') == '2021-03-02T10:00:00'
+    assert failures.get_cursor_date('2021-03-01T10:00:00') == '2021-03-01T10:00:00'
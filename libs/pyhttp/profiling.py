@@ -0,0 +1,193 @@
+"""
+Profiling of integration jobs: wall clock stack sampling of all threads or cProfile.
+"""
+import atexit
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from pyhttp import default_tracer
+
+
+class SamplingProfiler:
+    """
+    Samples stacks of all threads every `interval` seconds while running.
+    Stacks are wall clock: threads waiting for network or locks are sampled too,
+    so time blocked on I/O shows up next to time spent on CPU.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _frame_name(frame) -> str:
+        code = frame.f_code
+        return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_name(frame))
+                frame = frame.f_back
+            stack.append(thread_names.get(thread_id, str(thread_id)))
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='SamplingProfiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def get_top(self, n=30):
+        """
+        :return: (threads, own, total) lists of (name, samples): samples per thread, own counts samples
+        where frame is on top of stack, total counts samples where frame is anywhere in stack.
+        """
+        threads = Counter()
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            thread_name, *frames = stack.split(';')
+            threads[thread_name] += count
+            if frames:
+                own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        return threads.most_common(n), own.most_common(n), total.most_common(n)
+
+    def write_collapsed(self, path):
+        """
+        Collapsed stacks, input of flamegraph.pl and speedscope.
+        """
+        with open(path, 'w') as collapsed_file:
+            for stack, count in sorted(self.stacks.items()):
+                collapsed_file.write(f'{stack} {count}\n')
+
+
+class Profiler:
+    """
+    Profiles code between start and stop, writes reports to `{path_prefix}.*`:
+    'sampling' mode (default) - .collapsed flamegraph stacks of all threads and .txt top functions,
+    'cprofile' mode - deterministic profile of the starting thread to .pstats and .txt top functions.
+    Both reports start with wall time and cpu time of the process, the difference is time spent waiting.
+    """
+    MODES = ('sampling', 'cprofile')
+
+    def __init__(self, path_prefix, mode='sampling', top=30, interval=0.005):
+        if mode not in self.MODES:
+            raise ValueError(f'Unknown profile mode: {mode}')
+        self.path_prefix = path_prefix
+        self.mode = mode
+        self.top = top
+        self.interval = interval
+        self._profiler = None
+        self._started = None
+
+    def start(self):
+        self._started = (time.perf_counter(), time.process_time())
+        if self.mode == 'sampling':
+            self._profiler = SamplingProfiler(self.interval)
+            self._profiler.start()
+        else:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def stop(self):
+        if self._profiler is None:
+            return
+        if self.mode == 'sampling':
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+        wall = time.perf_counter() - self._started[0]
+        cpu = time.process_time() - self._started[1]
+
+        directory = os.path.dirname(self.path_prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        lines = [f'wall: {wall:.3f} s',
+                 f'cpu: {cpu:.3f} s (all threads)',
+                 f'waiting: {max(wall - cpu, 0.0):.3f} s (network, disk, locks, sleeps)',
+                 '']
+        if self.mode == 'sampling':
+            self._profiler.write_collapsed(f'{self.path_prefix}.collapsed')
+            lines += self._format_sampling_top()
+        else:
+            self._profiler.dump_stats(f'{self.path_prefix}.pstats')
+            lines += self._format_cprofile_top()
+        with open(f'{self.path_prefix}.txt', 'w') as report_file:
+            report_file.write('\n'.join(lines) + '\n')
+        self._profiler = None
+
+    def _format_sampling_top(self) -> list:
+        samples = max(self._profiler.samples, 1)
+        threads, own, total = self._profiler.get_top(self.top)
+        lines = [f'{self._profiler.samples} samples every {self.interval * 1000:g} ms of all threads', '',
+                 'Samples by thread (idle threads are sampled too):']
+        lines += [f'{count / samples:7.1%}  {thread_name}' for thread_name, count in threads]
+        lines += ['', f'Top {self.top} by own samples:']
+        lines += [f'{count / samples:7.1%}  {frame}' for frame, count in own]
+        lines += ['', f'Top {self.top} by total samples:']
+        lines += [f'{count / samples:7.1%}  {frame}' for frame, count in total]
+        return lines
+
+    def _format_cprofile_top(self) -> list:
+        import io
+        import pstats
+
+        lines = []
+        for sort in ('tottime', 'cumulative'):
+            stream = io.StringIO()
+            pstats.Stats(self._profiler, stream=stream).sort_stats(sort).print_stats(self.top)
+            lines += [f'Top {self.top} by {sort}:', stream.getvalue()]
+        return lines
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+
+def start_profiler(mode='sampling'):
+    """
+    Starts Profiler stopped at exit. Reports are written to PROFILE_DIR (default `profile`) with script name prefix.
+    :return: started Profiler.
+    """
+    path_prefix = os.path.join(os.getenv('PROFILE_DIR', 'profile'), default_tracer.service_name)
+    profiler = Profiler(path_prefix, mode).start()
+    atexit.register(profiler.stop)
+    return profiler
+
+
+def profile_from_argv(argv=None):
+    """
+    Starts profiler when script without own arguments parser is run with `--profile` or `--profile=cprofile`.
+    :return: started Profiler or None.
+    """
+    argv = sys.argv if argv is None else argv
+    for arg in argv[1:]:
+        if arg == '--profile' or arg.startswith('--profile='):
+            return start_profiler(arg.split('=', 1)[1] if '=' in arg else 'sampling')
+    return None
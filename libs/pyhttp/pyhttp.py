@@ -0,0 +1,985 @@
+import atexit
+import base64
+import gzip
+import hashlib
+import json
+import numbers
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from collections import Counter, defaultdict, deque
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timedelta, timezone
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.cookies import cookiejar_from_dict
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.exceptions import NewConnectionError
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+class RetriesExhaustedError(requests.RequestException):
+    """
+    Request kept failing after all attempts or deadline budget was spent.
+    """
+    pass
+
+
+class CassetteMissError(requests.RequestException):
+    """
+    Replayed cassette has no recorded response for the request.
+    """
+    pass
+
+
+class RetryableStatusError(requests.HTTPError):
+    """
+    Response status means that the same request can succeed later.
+    """
+    pass
+
+
+ID_SEGMENT_RE = re.compile(r'^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|\d+)$')
+API_PREFIXES = ('api/remap/1.2/',)
+
+
+def get_endpoint(url) -> str:
+    """
+    Endpoint template of url: path without api version prefix, ids replaced with {id} and file names with {file},
+    e.g. entity/product/{id}/images, card/list, big/new/{id}/{file}.
+    """
+    path = urllib.parse.urlsplit(url).path.strip('/')
+    for prefix in API_PREFIXES:
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+    segments = []
+    for segment in path.split('/'):
+        if ID_SEGMENT_RE.match(segment):
+            segment = '{id}'
+        elif '.' in segment:
+            segment = '{file}'
+        segments.append(segment)
+    return '/'.join(segments)
+
+
+def _get_body_size(body) -> int:
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode('utf-8'))
+    try:
+        return len(body)
+    except TypeError:
+        return 0
+
+
+class EndpointStats:
+    """
+    Counters of one (host, method, endpoint).
+    """
+
+    def __init__(self, buckets):
+        self.count = 0
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.latency_buckets = [0] * len(buckets)
+
+
+class Metrics:
+    """
+    Requests count, status codes, errors, retries, bytes and latency histogram per endpoint template.
+    Sessions report to it through mount_metrics, RetryPolicy reports retries.
+    """
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.endpoints = defaultdict(lambda: EndpointStats(self.buckets))
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_key(method, url):
+        return urllib.parse.urlsplit(url).netloc, method, get_endpoint(url)
+
+    def record_response(self, response, stream=False):
+        """
+        Streamed body is not read yet, its decoded size is added by record_body_size when it is read.
+        """
+        request = response.request
+        bytes_received = 0 if stream else len(response.content)
+        latency = response.elapsed.total_seconds()
+
+        with self._lock:
+            stats = self.endpoints[self._get_key(request.method, request.url)]
+            stats.count += 1
+            stats.statuses[response.status_code] += 1
+            stats.bytes_sent += _get_body_size(request.body)
+            stats.bytes_received += bytes_received
+            stats.latency_sum += latency
+            stats.latency_max = max(stats.latency_max, latency)
+            for i, bucket in enumerate(self.buckets):
+                if latency <= bucket:
+                    stats.latency_buckets[i] += 1
+                    break
+
+    def record_body_size(self, request, size):
+        with self._lock:
+            self.endpoints[self._get_key(request.method, request.url)].bytes_received += size
+
+    def record_error(self, request, error):
+        with self._lock:
+            stats = self.endpoints[self._get_key(request.method, request.url)]
+            stats.count += 1
+            stats.errors[type(error).__name__] += 1
+
+    def record_retry(self, request):
+        with self._lock:
+            self.endpoints[self._get_key(request.method, request.url)].retries += 1
+
+    def to_dict(self) -> dict:
+        """
+        JSON summary: list of endpoints sorted by total latency, slowest first.
+        """
+        with self._lock:
+            items = sorted(self.endpoints.items(), key=lambda item: -item[1].latency_sum)
+            return {'endpoints': [{
+                'host': host,
+                'method': method,
+                'endpoint': endpoint,
+                'count': stats.count,
+                'statuses': {str(status): count for status, count in sorted(stats.statuses.items())},
+                'errors': dict(stats.errors),
+                'retries': stats.retries,
+                'bytes_sent': stats.bytes_sent,
+                'bytes_received': stats.bytes_received,
+                'latency_sum': round(stats.latency_sum, 6),
+                'latency_max': round(stats.latency_max, 6),
+                'latency_buckets': {str(bucket): count for bucket, count in zip(self.buckets, stats.latency_buckets)},
+            } for (host, method, endpoint), stats in items]}
+
+    def to_prometheus(self) -> str:
+        """
+        Prometheus text exposition format.
+        """
+        lines = [
+            '# TYPE http_client_requests_total counter',
+            '# TYPE http_client_errors_total counter',
+            '# TYPE http_client_retries_total counter',
+            '# TYPE http_client_sent_bytes_total counter',
+            '# TYPE http_client_received_bytes_total counter',
+            '# TYPE http_client_request_duration_seconds histogram',
+        ]
+        with self._lock:
+            for (host, method, endpoint), stats in sorted(self.endpoints.items()):
+                labels = f'host="{host}",method="{method}",endpoint="{endpoint}"'
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(f'http_client_requests_total{{{labels},status="{status}"}} {count}')
+                for error, count in sorted(stats.errors.items()):
+                    lines.append(f'http_client_errors_total{{{labels},error="{error}"}} {count}')
+                lines.append(f'http_client_retries_total{{{labels}}} {stats.retries}')
+                lines.append(f'http_client_sent_bytes_total{{{labels}}} {stats.bytes_sent}')
+                lines.append(f'http_client_received_bytes_total{{{labels}}} {stats.bytes_received}')
+                cumulative = 0
+                for bucket, count in zip(self.buckets, stats.latency_buckets):
+                    cumulative += count
+                    le = '+Inf' if bucket == float('inf') else bucket
+                    lines.append(f'http_client_request_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f'http_client_request_duration_seconds_sum{{{labels}}} {stats.latency_sum:.6f}')
+                lines.append(f'http_client_request_duration_seconds_count{{{labels}}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    def save(self, path):
+        """
+        Writes Prometheus text when path ends with .prom, JSON summary otherwise.
+        """
+        if path.endswith('.prom'):
+            data = self.to_prometheus()
+        else:
+            data = json.dumps(self.to_dict(), indent=2)
+        with open(path, 'w') as metrics_file:
+            metrics_file.write(data)
+
+
+# Metrics of all sessions of the process, HTTP_METRICS env variable is path to save them at exit.
+default_metrics = Metrics()
+if os.getenv('HTTP_METRICS'):
+    atexit.register(lambda: default_metrics.save(os.getenv('HTTP_METRICS')))
+
+
+def mount_metrics(session, metrics=None):
+    """
+    Records every response of session to metrics, default_metrics by default.
+    """
+    metrics = metrics or default_metrics
+
+    def record_response(response, *args, **kwargs):
+        stream = kwargs.get('stream', False)
+        metrics.record_response(response, stream)
+        if stream:
+            # Readers of streamed body report its size, see iter_json_items.
+            response.metrics = metrics
+
+    session.hooks['response'].append(record_response)
+    return session
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter.
+    Waits for Retry-After (seconds or http date) or X-Lognex-Retry-After (MoySklad, milliseconds) when server sends it.
+    Non-idempotent requests (POST creating documents) may be already applied by server after 5xx or read error,
+    so they are retried only on 429, when server asks to retry or when connection was not established.
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout, RetryableStatusError)
+    IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE'))
+
+    def __init__(self, max_attempts=5, backoff=0.5, max_backoff=30.0, deadline=120.0,
+                 retry_statuses=RETRY_STATUSES, retry_exceptions=RETRY_EXCEPTIONS, metrics=None,
+                 idempotent_methods=IDEMPOTENT_METHODS):
+        """
+        :param backoff: base delay, n-th retry waits random value up to backoff * 2 ** n.
+        :param deadline: seconds for all attempts of one call including waits.
+        :param idempotent_methods: methods retried on any retryable status or error, e.g. with POST for read-only API.
+        :param metrics: Metrics counting retries and transport errors, default_metrics by default.
+        """
+        self.metrics = metrics or default_metrics
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.retry_statuses = tuple(retry_statuses)
+        self.retry_exceptions = tuple(retry_exceptions)
+        self.idempotent_methods = frozenset(idempotent_methods)
+
+    def check_response(self, response):
+        if response.status_code in self.retry_statuses and self.can_retry_response(response):
+            raise RetryableStatusError(f'{response.status_code} for {response.url}', response=response)
+        return response
+
+    def is_idempotent(self, request) -> bool:
+        # Calls without request (e.g. parsing of body) are repeated as is.
+        return request is None or request.method is None or request.method.upper() in self.idempotent_methods
+
+    def can_retry_response(self, response) -> bool:
+        if self.is_idempotent(response.request):
+            return True
+        return response.status_code == 429 or self.get_server_delay(response) is not None
+
+    def can_retry_error(self, error) -> bool:
+        if isinstance(error, RetryableStatusError) or self.is_idempotent(getattr(error, 'request', None)):
+            return True
+        return self.is_connect_error(error)
+
+    @staticmethod
+    def is_connect_error(error) -> bool:
+        """
+        Connection was not established, so request was not sent.
+        """
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        if not isinstance(error, requests.ConnectionError) or not error.args:
+            return False
+        return isinstance(getattr(error.args[0], 'reason', error.args[0]), NewConnectionError)
+
+    def get_delay(self, attempt, response=None) -> float:
+        server_delay = self.get_server_delay(response)
+        if server_delay is not None:
+            return min(server_delay, self.deadline)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    @staticmethod
+    def get_server_delay(response):
+        if response is None:
+            return None
+
+        lognex_retry_after = response.headers.get('X-Lognex-Retry-After')
+        if lognex_retry_after is not None:
+            try:
+                return int(lognex_retry_after) / 1000
+            except ValueError:
+                pass
+
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is None:
+            return None
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+        try:
+            retry_date = parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            return None
+        return max((retry_date - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls func until it does not raise one of retry_exceptions.
+        Errors of non-idempotent requests which can not be retried are raised as is.
+        Raises RetriesExhaustedError when attempts or deadline are over.
+        """
+        deadline_time = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except self.retry_exceptions as e:
+                if not self.can_retry_error(e):
+                    raise
+                error = e
+
+            attempt += 1
+            response = getattr(error, 'response', None)
+            request = getattr(error, 'request', None)
+            if request is None and response is not None:
+                request = response.request
+            # Responses are counted by session hooks, requests without response are not.
+            if request is not None and response is None:
+                self.metrics.record_error(request, error)
+
+            delay = self.get_delay(attempt - 1, response)
+            if attempt >= self.max_attempts or time.monotonic() + delay > deadline_time:
+                raise RetriesExhaustedError(
+                    f'Request failed after {attempt} attempts: {error}', response=response) from error
+            if request is not None:
+                self.metrics.record_retry(request)
+            time.sleep(delay)
+
+
+class RedirectAdapter(HTTPAdapter):
+    """
+    Sends requests for `source` url prefix to `target` instead, e.g. to local fake API server.
+    Request keeps original url, so cookies and hrefs still belong to source.
+    """
+
+    def __init__(self, source, target, **kwargs):
+        super().__init__(**kwargs)
+        self.source = source
+        self.target = target
+
+    def send(self, request, **kwargs):
+        url = request.url
+        request.url = self.target + url[len(self.source):]
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            request.url = url
+
+
+def get_redirects_from_env() -> dict:
+    """
+    HTTP_REDIRECTS env variable: "source=target,source=target".
+    """
+    redirects = dict()
+    for redirect in os.getenv('HTTP_REDIRECTS', '').split(','):
+        if '=' in redirect:
+            source, target = redirect.split('=', 1)
+            redirects[source.strip()] = target.strip()
+    return redirects
+
+
+def mount_redirects(session, redirects=None):
+    """
+    Mounts RedirectAdapter for every source prefix, redirects from HTTP_REDIRECTS by default.
+    """
+    if redirects is None:
+        redirects = get_redirects_from_env()
+    for source, target in redirects.items():
+        session.mount(source, RedirectAdapter(source, target))
+    return session
+
+
+def _hash_body(body) -> str:
+    body_hash = hashlib.sha256()
+    if body is None:
+        pass
+    elif isinstance(body, str):
+        body_hash.update(body.encode('utf-8'))
+    elif isinstance(body, bytes):
+        body_hash.update(body)
+    else:
+        # File-like body, e.g. Base64JsonBody, is rewound for sending.
+        body.seek(0)
+        for chunk in iter(lambda: body.read(2 ** 16), b''):
+            body_hash.update(chunk)
+        body.seek(0)
+    return body_hash.hexdigest()
+
+
+class Cassette:
+    """
+    HTTP interactions recorded to gzipped json lines file and served back in replay mode.
+    Auth headers, cookie values and token query parameters are redacted, request bodies are kept as sha256 only.
+
+    Replay looks for the next unused interaction with the same method, url and body,
+    then with the same method and url, then with the same method and url path,
+    so requests with timestamps in body or query are still served in recorded order.
+    Repeated GET of url is served with the last response of that url when recorded ones are used up.
+    """
+    RECORD = 'record'
+    REPLAY = 'replay'
+    ORIGINAL_TIMING = 'original'
+    ZERO_TIMING = 'zero'
+
+    REDACTED = 'REDACTED'
+    REDACT_HEADERS = ('authorization', 'cookie', 'set-cookie')
+    REDACT_PARAMS = ('key', 'token')
+    # Body is stored decoded, so transfer headers of original response are not valid for it.
+    SKIP_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+
+    def __init__(self, path, mode=REPLAY, timing=ZERO_TIMING, report_path=None):
+        """
+        :param timing: 'original' - replayed responses take recorded time, 'zero' - no waiting.
+        :param report_path: replay mode writes served requests per endpoint and misses to this json on close.
+        """
+        if mode not in (self.RECORD, self.REPLAY):
+            raise ValueError(f'Unknown cassette mode: {mode}')
+        if timing not in (self.ORIGINAL_TIMING, self.ZERO_TIMING):
+            raise ValueError(f'Unknown cassette timing: {timing}')
+        self.path = path
+        self.mode = mode
+        self.timing = timing
+        self.report_path = report_path
+        self._lock = threading.Lock()
+        self._file = None
+        self.served = Counter()
+        self.missed = Counter()
+
+        if mode == self.RECORD:
+            self._file = gzip.open(path, 'wt', encoding='utf-8')
+        else:
+            self.interactions = self._read()
+            self._used = set()
+            self._last_served = dict()
+            self._indexes = (dict(), dict(), dict())
+            for number, interaction in enumerate(self.interactions):
+                keys = self._get_keys(interaction['method'], interaction['url'], interaction['body_sha256'])
+                for index, key in zip(self._indexes, keys):
+                    index.setdefault(key, deque()).append(number)
+        atexit.register(self.close)
+
+    def _read(self) -> list:
+        interactions = []
+        with gzip.open(self.path, 'rt', encoding='utf-8') as cassette_file:
+            try:
+                for line in cassette_file:
+                    interactions.append(json.loads(line))
+            except (EOFError, ValueError):
+                # Recording process was killed: last line or gzip trailer is missing.
+                pass
+        return interactions
+
+    @classmethod
+    def redact_url(cls, url) -> str:
+        parts = urllib.parse.urlsplit(url)
+        query = [(name, cls.REDACTED if name.lower() in cls.REDACT_PARAMS else value)
+                 for name, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)]
+        return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
+    @staticmethod
+    def _get_keys(method, url, body_sha256):
+        return (method, url, body_sha256), (method, url), (method, url.split('?', 1)[0])
+
+    @classmethod
+    def _redact_headers(cls, headers) -> dict:
+        return {name: cls.REDACTED if name.lower() in cls.REDACT_HEADERS else value
+                for name, value in headers.items() if name.lower() not in cls.SKIP_HEADERS}
+
+    def record(self, request, response, body_sha256=None):
+        """
+        :param body_sha256: hash of request body taken before sending, file-like body is read to the end by then.
+        """
+        interaction = {
+            'method': request.method,
+            'url': self.redact_url(request.url),
+            'body_sha256': body_sha256 or _hash_body(request.body),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': self._redact_headers(response.headers),
+            'cookies': sorted(response.cookies.keys()),
+            'body': base64.b64encode(response.content).decode('ascii'),
+            'elapsed': response.elapsed.total_seconds(),
+        }
+        line = json.dumps(interaction, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def replay(self, request):
+        url = self.redact_url(request.url)
+        endpoint = f'{request.method} {url.split("?", 1)[0]}'
+        keys = self._get_keys(request.method, url, _hash_body(request.body))
+        interaction = None
+        with self._lock:
+            for index, key in zip(self._indexes, keys):
+                queue = index.get(key)
+                while queue and interaction is None:
+                    number = queue.popleft()
+                    if number not in self._used:
+                        self._used.add(number)
+                        interaction = self.interactions[number]
+                if interaction is not None:
+                    break
+            if interaction is None and request.method in ('GET', 'HEAD'):
+                interaction = self._last_served.get(keys[1])
+            if interaction is not None:
+                self._last_served[keys[1]] = interaction
+
+            if interaction is None:
+                self.missed[endpoint] += 1
+            else:
+                self.served[endpoint] += 1
+
+        if interaction is None:
+            raise CassetteMissError(f'No recorded response for {request.method} {url}', request=request)
+        if self.timing == self.ORIGINAL_TIMING:
+            time.sleep(interaction['elapsed'])
+
+        response = requests.Response()
+        response.status_code = interaction['status']
+        response.reason = interaction['reason']
+        response.headers = CaseInsensitiveDict(interaction['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.cookies = cookiejar_from_dict({name: self.REDACTED for name in interaction['cookies']})
+        response._content = base64.b64decode(interaction['body'])
+        response._content_consumed = True
+        response.elapsed = timedelta(seconds=interaction['elapsed'])
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self.mode == self.REPLAY and self.report_path:
+                with open(self.report_path, 'w') as report_file:
+                    report_file.write(json.dumps({'served': dict(sorted(self.served.items())),
+                                                  'missed': dict(sorted(self.missed.items()))},
+                                                 indent=2, ensure_ascii=False))
+
+
+class CassetteAdapter(BaseAdapter):
+    """
+    Records responses of wrapped adapter to cassette or serves them from cassette without network.
+    """
+
+    def __init__(self, adapter, cassette):
+        super().__init__()
+        self.adapter = adapter
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        if self.cassette.mode == Cassette.REPLAY:
+            return self.cassette.replay(request)
+        body_sha256 = _hash_body(request.body)
+        response = self.adapter.send(request, **kwargs)
+        self.cassette.record(request, response, body_sha256)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+_env_cassettes = dict()
+_env_cassettes_lock = threading.Lock()
+
+
+def get_cassette_from_env():
+    """
+    HTTP_CASSETTE env variable: path of cassette file, HTTP_CASSETTE_MODE: record or replay (default),
+    HTTP_CASSETTE_TIMING: zero (default) or original, HTTP_CASSETTE_REPORT: path of replay report.
+    All sessions of the process share one cassette.
+    """
+    path = os.getenv('HTTP_CASSETTE')
+    if not path:
+        return None
+    with _env_cassettes_lock:
+        if path not in _env_cassettes:
+            _env_cassettes[path] = Cassette(path, os.getenv('HTTP_CASSETTE_MODE', Cassette.REPLAY),
+                                            os.getenv('HTTP_CASSETTE_TIMING', Cassette.ZERO_TIMING),
+                                            os.getenv('HTTP_CASSETTE_REPORT'))
+        return _env_cassettes[path]
+
+
+def mount_cassette(session, cassette=None):
+    """
+    Sends every request of session through CassetteAdapter, cassette from HTTP_CASSETTE by default.
+    Adapters mounted later, e.g. with bigger pool, are wrapped too.
+    """
+    if cassette is None:
+        cassette = get_cassette_from_env()
+    if cassette is None:
+        return session
+
+    get_adapter = session.get_adapter
+
+    def get_cassette_adapter(url):
+        return CassetteAdapter(get_adapter(url), cassette)
+
+    session.get_adapter = get_cassette_adapter
+    return session
+
+
+def cap_timeout(timeout, deadline_time, min_timeout=0.1):
+    """
+    requests timeout (seconds or (connect, read) tuple, None - no limit) not longer than time left
+    to deadline_time of time.monotonic(), so hung attempt can not outlive retry deadline.
+    """
+    left = max(deadline_time - time.monotonic(), min_timeout)
+    if timeout is None:
+        return left
+    if isinstance(timeout, tuple):
+        return tuple(left if part is None else min(part, left) for part in timeout)
+    return min(timeout, left)
+
+
+class Session(requests.Session):
+    """
+    requests.Session retrying failed requests by RetryPolicy.
+    Every attempt waits for rate_limiter first, one limiter can be shared by sessions and threads.
+    Requests without timeout get `timeout`, every attempt is limited by time left to retry deadline too.
+    """
+    # (connect, read) seconds, read timeout limits waiting for each chunk of body, not whole response.
+    DEFAULT_TIMEOUT = (10.0, 60.0)
+
+    def __init__(self, retry_policy=None, rate_limiter=None, timeout=DEFAULT_TIMEOUT):
+        super().__init__()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        mount_redirects(self)
+        mount_cassette(self)
+        mount_metrics(self)
+
+    def request(self, method, url, *args, **kwargs):
+        deadline_time = time.monotonic() + self.retry_policy.deadline
+        timeout = kwargs.pop('timeout', self.timeout)
+
+        def send():
+            # File-like body is read to the end by previous attempt.
+            data = kwargs.get('data')
+            if hasattr(data, 'seek'):
+                data.seek(0)
+            if self.rate_limiter is not None:
+                self.rate_limiter.wait()
+            return self.retry_policy.check_response(super(Session, self).request(
+                method, url, *args, timeout=cap_timeout(timeout, deadline_time), **kwargs))
+
+        return self.retry_policy.call(send)
+
+
+# With ijson json bodies are parsed while downloaded, requests should be made with stream=STREAMING_JSON.
+STREAMING_JSON = ijson is not None
+# Broken or cut json body: response.json() raises ValueError, ijson its JSONError,
+# streamed body can also break in the middle of download.
+JSON_BODY_ERRORS = (ValueError, requests.exceptions.ChunkedEncodingError) + ((ijson.JSONError,) if ijson else ())
+
+
+def write_json_atomically(path, data, **dumps_kwargs):
+    """
+    Writes json to temporary file and replaces `path` with it, so readers never see partial data.
+    :param dumps_kwargs: json.dumps arguments, e.g. indent.
+    """
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as json_file:
+        json_file.write(json.dumps(data, **dumps_kwargs))
+    os.replace(tmp_path, path)
+
+
+class _ResponseReader:
+    """
+    File-like decoded body of streamed response for ijson.
+    First `head_size` bytes are kept to check body which had no items.
+    """
+
+    def __init__(self, response, chunk_size=64 * 1024, head_size=64 * 1024):
+        self._chunks = response.iter_content(chunk_size)
+        self._buffer = b''
+        self.head = b''
+        self.head_size = head_size
+        self.size = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self.size += len(chunk)
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        if len(self.head) < self.head_size:
+            self.head += data[:self.head_size - len(self.head)]
+        return data
+
+
+def _iter_path(data, keys):
+    if not keys:
+        yield data
+    elif keys[0] == 'item':
+        if isinstance(data, list):
+            for element in data:
+                yield from _iter_path(element, keys[1:])
+    elif isinstance(data, dict) and keys[0] in data:
+        yield from _iter_path(data[keys[0]], keys[1:])
+
+
+def iter_json_items(response, prefix, required=False):
+    """
+    Yields items of json response at ijson prefix like 'rows.item', 'item' is element of array.
+    With ijson body is parsed by chunks while downloaded, only current item is kept in memory.
+    Without it body is decoded by response.json() and walked the same way.
+    :param required: raise ValueError after items when body has no array at prefix, e.g. error json.
+    """
+    keys = prefix.split('.')
+    reader = None
+    try:
+        items_count = 0
+        if STREAMING_JSON:
+            reader = _ResponseReader(response)
+            for item in ijson.items(reader, prefix, use_float=True):
+                items_count += 1
+                yield item
+            if required and items_count == 0:
+                # Empty array and error json both give no items, short body is decoded to tell them apart.
+                head = reader.head if len(reader.head) < reader.head_size else b'null'
+                _check_json_array(json.loads(head.decode('utf-8')), keys, prefix, response)
+        else:
+            data = response.json()
+            if required:
+                _check_json_array(data, keys, prefix, response)
+            yield from _iter_path(data, keys)
+    finally:
+        response.close()
+        metrics = getattr(response, 'metrics', None)
+        if reader is not None and metrics is not None:
+            metrics.record_body_size(response.request, reader.size)
+
+
+def _check_json_array(data, keys, prefix, response):
+    if not any(isinstance(value, list) for value in _iter_path(data, keys[:-1])):
+        raise ValueError(f'No {prefix} in response of {response.url}')
+
+
+class Base64JsonBody:
+    """
+    File-like json request body: `fields` plus `content_field` with base64 of content.
+    Base64 is encoded chunk by chunk while requests reads the body, so there is no
+    encoded copy of content in memory. Length is known in advance for Content-Length.
+    """
+    CHUNK_SIZE = 3 * 2 ** 14
+
+    def __init__(self, content: bytes, fields: dict, content_field='content'):
+        head = json.dumps(fields)[:-1]
+        if fields:
+            head += ', '
+        self.prefix = f'{head}{json.dumps(content_field)}: "'.encode('utf-8')
+        self.suffix = b'"}'
+        self.content = memoryview(content)
+        self.length = len(self.prefix) + 4 * ((len(content) + 2) // 3) + len(self.suffix)
+        self.seek(0)
+
+    def __len__(self):
+        return self.length
+
+    def _chunks(self):
+        yield self.prefix
+        for start in range(0, len(self.content), self.CHUNK_SIZE):
+            yield base64.b64encode(self.content[start:start + self.CHUNK_SIZE])
+        yield self.suffix
+
+    def seek(self, offset, whence=0):
+        if offset != 0 or whence != 0:
+            raise ValueError('Only rewinding to start is supported')
+        self._chunks_iter = self._chunks()
+        self._buffer = bytearray()
+        return 0
+
+    def read(self, size=-1) -> bytes:
+        while size is None or size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks_iter, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+class RateLimiter:
+    """
+    Keeps at least `min_interval` seconds between starts of requests made from any thread.
+    """
+
+    def __init__(self, min_interval=0.0):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.min_interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Span:
+    """
+    Timed operation with attributes. Use as context manager, nested spans get it as parent.
+    """
+
+    def __init__(self, tracer, name, parent=None, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.parent = parent
+        self.attributes = dict(attributes or {})
+        self.span_id = os.urandom(8).hex()
+        self.start_time_ns = None
+        self.end_time_ns = None
+        self.error = None
+        self._started = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.start_time_ns = int(time.time() * 1e9)
+        self._started = time.perf_counter()
+        self.tracer._push(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end_time_ns = self.start_time_ns + int((time.perf_counter() - self._started) * 1e9)
+        if exc_type is not None:
+            self.error = f'{exc_type.__name__}: {exc_value}'
+        self.tracer._pop(self)
+        return False
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    # numbers ABCs match numpy scalars from dataframes too.
+    if isinstance(value, numbers.Integral):
+        return {'intValue': str(int(value))}
+    if isinstance(value, numbers.Real):
+        return {'doubleValue': float(value)}
+    return {'stringValue': str(value)}
+
+
+class Tracer:
+    """
+    Collects finished spans of all threads of the process.
+    Parent of a span is the innermost open span of the same thread, spans started
+    in worker threads get parent explicitly.
+    """
+    STATUS_OK = 1
+    STATUS_ERROR = 2
+
+    def __init__(self, service_name=None):
+        self.service_name = service_name or os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0]
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _get_stack(self) -> list:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _push(self, span):
+        stack = self._get_stack()
+        if span.parent is None and stack:
+            span.parent = stack[-1]
+        stack.append(span)
+
+    def _pop(self, span):
+        stack = self._get_stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+        with self._lock:
+            self.spans.append(span)
+
+    def span(self, name, parent=None, **attributes) -> Span:
+        return Span(self, name, parent, attributes)
+
+    def current_span(self):
+        stack = self._get_stack()
+        return stack[-1] if stack else None
+
+    def to_otlp(self) -> dict:
+        """
+        OpenTelemetry OTLP/JSON trace export of finished spans.
+        """
+        with self._lock:
+            spans = list(self.spans)
+        return {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': _otlp_value(self.service_name)}]},
+            'scopeSpans': [{
+                'scope': {'name': 'pyhttp'},
+                'spans': [{
+                    'traceId': self.trace_id,
+                    'spanId': span.span_id,
+                    'parentSpanId': span.parent.span_id if span.parent is not None else '',
+                    'name': span.name,
+                    'kind': 1,
+                    'startTimeUnixNano': str(span.start_time_ns),
+                    'endTimeUnixNano': str(span.end_time_ns),
+                    'attributes': [{'key': key, 'value': _otlp_value(value)}
+                                   for key, value in span.attributes.items()],
+                    'status': ({'code': self.STATUS_ERROR, 'message': span.error} if span.error
+                               else {'code': self.STATUS_OK}),
+                } for span in spans],
+            }],
+        }]}
+
+    def save(self, path):
+        with open(path, 'w') as trace_file:
+            trace_file.write(json.dumps(self.to_otlp(), ensure_ascii=False))
+
+
+# Tracer of the process, TRACE_PATH env variable is path to save spans at exit.
+default_tracer = Tracer()
+if os.getenv('TRACE_PATH'):
+    atexit.register(lambda: default_tracer.save(os.getenv('TRACE_PATH')))
+
+
+def current_span():
+    """
+    Innermost open span of default_tracer in this thread, parent for spans of worker threads.
+    """
+    return default_tracer.current_span()
+
+
+def span(name, parent=None, **attributes) -> Span:
+    """
+    Span of default_tracer:
+
+        with span('store', store=name) as store_span:
+            store_span.set_attribute('positions', len(positions))
+    """
+    return default_tracer.span(name, parent, **attributes)
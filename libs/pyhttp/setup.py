@@ -0,0 +1,17 @@
+import setuptools
+
+
+setuptools.setup(
+    name="pyhttp",
+    version="1.0.0",
+    author="Ruslan Talypov",
+    author_email="ruslan-skribl1998@mail.ru",
+    description="Shared HTTP tools for pymysklad and pywb",
+    long_description="TOBE",
+    long_description_content_type="text/markdown",
+    url="https://github.com/skribl5000/MoiSkladImplementation",
+    packages=setuptools.find_packages(),
+    classifiers=[
+    ],
+    python_requires='>=3.6',
+)
\ No newline at end of file
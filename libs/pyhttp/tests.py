@@ -0,0 +1,290 @@
+import pytest
+
+
+def test_import():
+    try:
+        import pyhttp
+        result = True
+
+    except ImportError:
+        result = False
+
+    assert result
+
+
+def _response(status_code, headers=None):
+    import requests
+
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return response
+
+
+def _stub_adapter(results, body=b'', sent=None):
+    """
+    Adapter answering with the next of `results`: status code of response with `body` or exception to raise.
+    Keyword arguments of every send are appended to `sent`.
+    """
+    import io
+    from requests.adapters import BaseAdapter
+
+    class StubAdapter(BaseAdapter):
+        def send(self, request, **kwargs):
+            if sent is not None:
+                sent.append(kwargs)
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                result.request = request
+                raise result
+            response = _response(result)
+            response.raw = io.BytesIO(body)
+            response.url = request.url
+            response.request = request
+            return response
+
+        def close(self):
+            pass
+
+    return StubAdapter()
+
+
+def test_retry_policy_waits_server_delay():
+    from pyhttp import RetryPolicy
+
+    policy = RetryPolicy()
+    assert policy.get_delay(3, _response(429, {'Retry-After': '2'})) == 2.0
+    assert policy.get_delay(3, _response(429, {'X-Lognex-Retry-After': '1500'})) == 1.5
+    assert 0 <= policy.get_delay(3, _response(503)) <= 4.0
+
+
+def test_retry_policy_retries_until_success():
+    from pyhttp import RetryPolicy
+
+    policy = RetryPolicy(backoff=0)
+    responses = [_response(503), _response(429), _response(200)]
+
+    result = policy.call(lambda: policy.check_response(responses.pop(0)))
+    assert result.status_code == 200
+
+
+def test_retry_policy_fails_fast_on_exhausted_attempts():
+    import requests
+    from pyhttp import RetryPolicy, RetriesExhaustedError
+
+    policy = RetryPolicy(max_attempts=3, backoff=0)
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise requests.ConnectionError('connection refused')
+
+    with pytest.raises(RetriesExhaustedError):
+        policy.call(fail)
+    assert len(calls) == 3
+
+
+def test_retry_policy_does_not_repeat_non_idempotent_requests():
+    import requests
+    from urllib3.exceptions import MaxRetryError, NewConnectionError
+    from pyhttp import RetryPolicy, Session
+
+    results = []
+    session = Session(RetryPolicy(backoff=0))
+    session.mount('https://', _stub_adapter(results))
+    url = 'https://online.moysklad.ru/api/remap/1.2/entity/supply'
+
+    results[:] = [503]
+    assert session.post(url, json={}).status_code == 503
+    results[:] = [429, 503]
+    assert session.post(url, json={}).status_code == 503
+    results[:] = [requests.ReadTimeout('read timed out')]
+    with pytest.raises(requests.ReadTimeout):
+        session.post(url, json={})
+    results[:] = [requests.ConnectionError(MaxRetryError(None, url, NewConnectionError(None, 'refused'))), 200]
+    assert session.post(url, json={}).status_code == 200
+    results[:] = [503, requests.ReadTimeout('read timed out'), 200]
+    assert session.get(url).status_code == 200
+    assert results == []
+
+
+def test_session_limits_timeout_by_retry_deadline():
+    from pyhttp import RetryPolicy, Session
+
+    sent = []
+    session = Session(RetryPolicy(deadline=5.0))
+    session.mount('https://', _stub_adapter([200, 200], sent=sent))
+    session.get('https://example.com/stats')
+    session.get('https://example.com/stats', timeout=1.0)
+    assert sent[0]['timeout'][0] <= 5.0 and sent[0]['timeout'][1] <= 5.0
+    assert sent[1]['timeout'] == 1.0
+
+
+def test_base64_json_body_is_valid_json():
+    import base64
+    import json
+    from pyhttp import Base64JsonBody
+
+    content = bytes(range(256)) * 1000
+    body = Base64JsonBody(content, {'filename': 'фото.jpg'})
+
+    data = b''.join(iter(lambda: body.read(1000), b''))
+    assert len(data) == len(body)
+    assert json.loads(data.decode('utf-8')) == {'filename': 'фото.jpg',
+                                                'content': base64.b64encode(content).decode('utf-8')}
+
+    body.seek(0)
+    assert body.read() == data
+
+
+def test_cassette_records_redacted_and_replays(tmp_path):
+    import gzip
+    import json
+    import requests
+    from requests.adapters import BaseAdapter
+    from pyhttp import Base64JsonBody, Cassette, CassetteMissError, mount_cassette
+
+    class EchoAdapter(BaseAdapter):
+        def send(self, request, **kwargs):
+            # File-like body is read while sent, like HTTPAdapter does.
+            body = request.body.read() if hasattr(request.body, 'read') else request.body
+            response = _response(200, {'Set-Cookie': 'WBToken=secret', 'Content-Type': 'application/json'})
+            response._content = json.dumps({'url': request.url, 'body': len(body or '')}).encode('utf-8')
+            response.cookies.set('WBToken', 'secret')
+            response.url = request.url
+            response.request = request
+            return response
+
+        def close(self):
+            pass
+
+    path = str(tmp_path / 'cassette.jsonl.gz')
+    cassette = Cassette(path, Cassette.RECORD)
+    session = requests.Session()
+    session.mount('https://', EchoAdapter())
+    mount_cassette(session, cassette)
+    recorded = [session.get('https://example.com/stats', params={'key': 'secret', 'page': page},
+                            headers={'Authorization': 'Basic secret'}).json() for page in (1, 2)]
+    uploads = [session.post('https://example.com/images', data=Base64JsonBody(content, {'filename': 'a.jpg'})).json()
+               for content in (b'small', b'bigger image')]
+    cassette.close()
+
+    with gzip.open(path, 'rt', encoding='utf-8') as cassette_file:
+        assert 'secret' not in cassette_file.read()
+
+    cassette = Cassette(path, Cassette.REPLAY)
+    session = mount_cassette(requests.Session(), cassette)
+    response = session.get('https://example.com/stats', params={'key': 'other', 'page': 1})
+    assert response.json() == recorded[0]
+    assert response.cookies['WBToken'] == Cassette.REDACTED
+    # Unknown query is served by url path in recorded order.
+    assert session.get('https://example.com/stats', params={'page': 3}).json() == recorded[1]
+    with pytest.raises(CassetteMissError):
+        session.get('https://example.com/stats')
+    # Uploads to the same url are told apart by body.
+    assert session.post('https://example.com/images',
+                        data=Base64JsonBody(b'bigger image', {'filename': 'a.jpg'})).json() == uploads[1]
+    assert session.post('https://example.com/images',
+                        data=Base64JsonBody(b'small', {'filename': 'a.jpg'})).json() == uploads[0]
+
+
+def test_metrics_count_requests_retries_and_bytes():
+    from pyhttp import Metrics, RetryPolicy, Session, get_endpoint, mount_metrics
+
+    metrics = Metrics()
+    session = Session(RetryPolicy(backoff=0, metrics=metrics))
+    session.mount('https://', _stub_adapter([503, 200], body=b'{"rows": []}'))
+    mount_metrics(session, metrics)
+    url = 'https://online.moysklad.ru/api/remap/1.2/entity/product/0b4e4a9f-600f-11eb-0a80-069d0001bb3c'
+    session.put(url, data='{"name": "A"}')
+
+    assert get_endpoint(url) == 'entity/product/{id}'
+    assert get_endpoint('https://img1.wbstatic.net/big/new/1000/10000000-1.jpg') == 'big/new/{id}/{file}'
+    endpoint, = metrics.to_dict()['endpoints']
+    assert endpoint['endpoint'] == 'entity/product/{id}'
+    assert endpoint['count'] == 2
+    assert endpoint['statuses'] == {'200': 1, '503': 1}
+    assert endpoint['retries'] == 1
+    assert endpoint['bytes_sent'] == 26
+    assert endpoint['bytes_received'] == 24
+    assert 'http_client_requests_total{host="online.moysklad.ru",method="PUT",endpoint="entity/product/{id}",' \
+           'status="503"} 1' in metrics.to_prometheus()
+
+
+def test_metrics_count_bytes_of_streamed_body_when_read():
+    import pyhttp
+    from pyhttp import Metrics, RetryPolicy, Session, iter_json_items, mount_metrics
+
+    body = b'{"rows": [' + b','.join(b'{"code": "%d"}' % i for i in range(10000)) + b']}'
+    metrics = Metrics()
+    session = Session(RetryPolicy(metrics=metrics))
+    session.mount('https://', _stub_adapter([200], body=body))
+    mount_metrics(session, metrics)
+    response = session.get('https://online.moysklad.ru/api/remap/1.2/entity/product', stream=True)
+    assert metrics.to_dict()['endpoints'][0]['bytes_received'] == 0
+
+    assert len(list(iter_json_items(response, 'rows.item'))) == 10000
+    assert metrics.to_dict()['endpoints'][0]['bytes_received'] == (len(body) if pyhttp.STREAMING_JSON else 0)
+
+
+def test_tracer_nests_spans_and_exports_otlp():
+    from pyhttp import Tracer
+
+    tracer = Tracer('stocks_sync')
+    with tracer.span('store', store='Коледино') as store_span:
+        with tracer.span('read_ms_data'):
+            pass
+        store_span.set_attribute('supplies', 3)
+    with pytest.raises(ValueError):
+        with tracer.span('create_documents'):
+            raise ValueError('bad request')
+
+    spans = {span['name']: span for span in tracer.to_otlp()['resourceSpans'][0]['scopeSpans'][0]['spans']}
+    assert spans['read_ms_data']['parentSpanId'] == spans['store']['spanId']
+    assert spans['store']['parentSpanId'] == ''
+    assert {'key': 'supplies', 'value': {'intValue': '3'}} in spans['store']['attributes']
+    assert int(spans['store']['endTimeUnixNano']) >= int(spans['read_ms_data']['endTimeUnixNano'])
+    assert spans['create_documents']['status'] == {'code': Tracer.STATUS_ERROR, 'message': 'ValueError: bad request'}
+
+
+def test_profiler_writes_collapsed_stacks_and_report(tmp_path):
+    import time
+    from profiling import Profiler
+
+    def busy_loop():
+        started = time.perf_counter()
+        while time.perf_counter() - started < 0.1:
+            pass
+
+    path_prefix = str(tmp_path / 'job')
+    with Profiler(path_prefix, interval=0.001):
+        busy_loop()
+
+    with open(f'{path_prefix}.collapsed') as collapsed_file:
+        stacks = collapsed_file.read().splitlines()
+    assert any(line.startswith('MainThread;') and 'busy_loop' in line for line in stacks)
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in stacks)
+    with open(f'{path_prefix}.txt') as report_file:
+        report = report_file.read()
+    assert report.startswith('wall: ') and 'busy_loop' in report
+
+
+@pytest.mark.parametrize('streaming', [True, False])
+def test_iter_json_items_reads_rows_from_body(monkeypatch, streaming):
+    import io
+    import pyhttp
+
+    if streaming and pyhttp.ijson is None:
+        pytest.skip('ijson is not installed')
+    monkeypatch.setattr(pyhttp, 'STREAMING_JSON', streaming)
+    body = b'{"meta": {"size": 2}, "rows": [{"code": "a", "stock": 1.5}, {"code": "b", "stock": 2}]}'
+    response = _response(200)
+    response.raw = io.BytesIO(body)
+
+    rows = list(pyhttp.iter_json_items(response, 'rows.item'))
+    assert rows == [{'code': 'a', 'stock': 1.5}, {'code': 'b', 'stock': 2}]
+    assert isinstance(rows[0]['stock'], float)
+    error_response = _response(200)
+    error_response.raw = io.BytesIO(b'{"error": {"message": "unauthorized"}}')
+    with pytest.raises(ValueError):
+        list(pyhttp.iter_json_items(error_response, 'result.cards.item', required=True))
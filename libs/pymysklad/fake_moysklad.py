@@ -0,0 +1,602 @@
+"""
+Local stand-in for the parts of MoySklad JSON API 1.2 used by pymysklad and integrations.
+Data lives in memory, server answers with production-like hrefs, so clients are
+pointed to it with HTTP_REDIRECTS (see pyhttp.mount_redirects).
+
+    python fake_moysklad.py --port 8081 --products 1000 --latency 0.05
+"""
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, defaultdict, deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+API_PATH = '/api/remap/1.2/'
+PUBLIC_URL = 'https://online.moysklad.ru/api/remap/1.2/'
+
+ID_PATTERN = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+
+class FakeMoySkladError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeMoySklad:
+    """
+    In-memory MoySklad account served over HTTP.
+
+    :param latency: seconds added to every response.
+    :param rate_limit: (requests, seconds) allowed per sliding window, 429 with X-Lognex-Retry-After above it.
+    """
+    MAX_LIMIT = 1000
+    MAX_EXPAND_LIMIT = 100
+    # Stock change sign of applicable documents.
+    STOCK_DOCUMENTS = {'supply': 1, 'salesreturn': 1, 'loss': -1, 'demand': -1}
+    UNIQUE_CODE_ENTITIES = ('product', 'variant')
+
+    def __init__(self, latency=0.0, rate_limit=None, public_url=PUBLIC_URL):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.public_url = public_url
+
+        self.entities = defaultdict(OrderedDict)
+        self.images = defaultdict(list)
+        self.attributes = defaultdict(list)
+        self.characteristics = []
+        self.custom_entities = OrderedDict()
+        self.stocks = defaultdict(lambda: defaultdict(float))
+        self._codes = dict()
+        self._code_parts = defaultdict(set)
+        self.request_counts = Counter()
+
+        self._lock = threading.RLock()
+        self._request_times = deque()
+        self._server = None
+
+    # Data
+
+    def meta(self, name, item_id):
+        meta = {
+            'href': f'{self.public_url}entity/{name}/{item_id}',
+            'metadataHref': f'{self.public_url}entity/{name}/metadata',
+            'type': name,
+            'mediaType': 'application/json',
+        }
+        if name.startswith('customentity/'):
+            meta['type'] = 'customentity'
+            meta['metadataHref'] = f'{self.public_url}context/companysettings/metadata/customEntities/' \
+                                   f'{name.split("/")[1]}'
+        return meta
+
+    def add(self, name, data: dict) -> dict:
+        with self._lock:
+            if name in self.UNIQUE_CODE_ENTITIES and data.get('code') in self._codes:
+                raise FakeMoySkladError(412, f'Код "{data["code"]}" уже используется')
+            if name == 'variant' and 'product' not in data:
+                raise FakeMoySkladError(412, "Ошибка сохранения объекта: поле 'product' не может быть пустым")
+
+            item_id = str(uuid.uuid4())
+            item = dict(data)
+            item['id'] = item_id
+            item['meta'] = self.meta(name, item_id)
+            item.setdefault('externalCode', item_id[:8])
+            if name == 'product':
+                item.setdefault('variantsCount', 0)
+            if name == 'variant':
+                item['characteristics'] = self._get_variant_characteristics(item.get('characteristics', []))
+                product = self.get_by_href(item['product']['meta']['href'])
+                if product is not None:
+                    product['variantsCount'] = product.get('variantsCount', 0) + 1
+                    item.setdefault('name', product.get('name', ''))
+            if name in self.STOCK_DOCUMENTS and item.get('applicable', True):
+                self._apply_stock_document(name, item)
+
+            self.entities[name][item_id] = item
+            if item.get('code') is not None:
+                self._index_code(name, item)
+            return item
+
+    def _index_code(self, name, item):
+        """
+        Codes look like {chrtId}_{barcode}: parts index answers code~barcode filters without full scan.
+        Such filter finds codes having the value as a whole part, which is how barcodes are searched.
+        """
+        if name in self.UNIQUE_CODE_ENTITIES:
+            self._codes[item['code']] = (name, item['id'])
+        for part in str(item['code']).split('_'):
+            self._code_parts[(name, part)].add(item['id'])
+
+    def _get_variant_characteristics(self, values):
+        characteristics = {char['id']: char for char in self.characteristics}
+        result = []
+        for value in values:
+            char = characteristics.get(value.get('id'))
+            if char is None:
+                raise FakeMoySkladError(412, f'Характеристика {value.get("id")} не найдена')
+            result.append({'meta': char['meta'], 'id': char['id'], 'name': char['name'], 'value': value.get('value')})
+        return result
+
+    def _apply_stock_document(self, name, document):
+        store_id = document['store']['meta']['href'].split('/')[-1]
+        for position in document.get('positions', []):
+            href = position['assortment']['meta']['href']
+            self.stocks[store_id][href] += self.STOCK_DOCUMENTS[name] * position.get('quantity', 0)
+
+    def get_by_href(self, href):
+        path = href[len(self.public_url):] if href.startswith(self.public_url) else href
+        parts = path.split('/')
+        if len(parts) < 3 or parts[0] != 'entity':
+            return None
+        name = '/'.join(parts[1:-1])
+        return self.entities[name].get(parts[-1])
+
+    def add_custom_entity(self, name, dict_id=None) -> dict:
+        with self._lock:
+            dict_id = dict_id or str(uuid.uuid4())
+            custom_entity = {
+                'meta': {
+                    'href': f'{self.public_url}context/companysettings/metadata/customEntities/{dict_id}',
+                    'type': 'customentitymetadata',
+                    'mediaType': 'application/json',
+                },
+                'id': dict_id,
+                'name': name,
+                'entityMeta': {
+                    'href': f'{self.public_url}entity/customentity/{dict_id}',
+                    'type': 'customentity',
+                    'mediaType': 'application/json',
+                },
+            }
+            self.custom_entities[dict_id] = custom_entity
+            return custom_entity
+
+    def add_attribute(self, entity_name, name, attribute_type='string', custom_entity=None) -> dict:
+        with self._lock:
+            attribute_id = str(uuid.uuid4())
+            attribute = {
+                'meta': {
+                    'href': f'{self.public_url}entity/{entity_name}/metadata/attributes/{attribute_id}',
+                    'type': 'attributemetadata',
+                    'mediaType': 'application/json',
+                },
+                'id': attribute_id,
+                'name': name,
+                'type': attribute_type,
+                'required': False,
+            }
+            if custom_entity is not None:
+                attribute['type'] = 'customentity'
+                attribute['customEntityMeta'] = custom_entity['meta']
+            self.attributes[entity_name].append(attribute)
+            return attribute
+
+    def add_characteristic(self, name) -> dict:
+        with self._lock:
+            for char in self.characteristics:
+                if char['name'] == name:
+                    raise FakeMoySkladError(412, f'Характеристика "{name}" уже существует')
+            char_id = str(uuid.uuid4())
+            char = {
+                'meta': {
+                    'href': f'{self.public_url}entity/variant/metadata/characteristics/{char_id}',
+                    'type': 'attributemetadata',
+                    'mediaType': 'application/json',
+                },
+                'id': char_id,
+                'name': name,
+                'type': 'string',
+                'required': False,
+            }
+            self.characteristics.append(char)
+            return char
+
+    def add_image(self, entity_name, item_id, filename, content: bytes) -> dict:
+        with self._lock:
+            if item_id not in self.entities[entity_name]:
+                raise FakeMoySkladError(404, f'Объект {entity_name}/{item_id} не найден')
+            image_id = str(uuid.uuid4())
+            image = {
+                'meta': {
+                    'href': f'{self.public_url}entity/{entity_name}/{item_id}/images/{image_id}',
+                    'type': 'image',
+                    'mediaType': 'application/json',
+                    'downloadHref': f'https://online.moysklad.ru/api/remap/1.2/download/{image_id}',
+                },
+                'title': filename.rsplit('.', 1)[0],
+                'filename': filename,
+                'size': len(content),
+                'updated': time.strftime('%Y-%m-%d %H:%M:%S.000'),
+            }
+            self.images[(entity_name, item_id)].append(image)
+            return image
+
+    def seed_catalog(self, single_products=100, variant_products=20, variants_per_product=3, stores=3,
+                     images_per_item=2, seed=0) -> dict:
+        """
+        Fills account with dictionaries, attributes, characteristics, stores, products, variants,
+        images and stocks. Same seed gives same names, codes and barcodes.
+        :return: dict with created brand and country dictionaries and store names.
+        """
+        rnd = random.Random(seed)
+        brands = self.add_custom_entity('Бренды')
+        countries = self.add_custom_entity('Страна производства')
+        for brand in ('Nike', 'Adidas', 'Puma', 'Reebok'):
+            self.add(f'customentity/{brands["id"]}', {'name': brand})
+        for country in ('Россия', 'Китай', 'Турция'):
+            self.add(f'customentity/{countries["id"]}', {'name': country})
+            self.add('country', {'name': country})
+
+        for attribute_name in ('Основной цвет', 'Размер', 'Баркод'):
+            self.add_attribute('product', attribute_name)
+        self.add_attribute('product', 'Бренд', custom_entity=brands)
+        self.add_attribute('product', 'Страна производства', custom_entity=countries)
+        for char_name in ('Размер', 'Цвет', 'Баркод'):
+            self.add_characteristic(char_name)
+
+        self.add('currency', {'name': 'руб', 'isoCode': 'RUB'})
+        self.add('uom', {'name': 'шт'})
+        self.add('counterparty', {'name': 'ООО "Поставщик"'})
+        self.add('organization', {'name': 'Организация'})
+
+        store_metas = [self.add('store', {'name': f'[WB] Склад {i}'})['meta'] for i in range(stores)]
+
+        def barcode():
+            return ''.join(rnd.choice('0123456789') for _ in range(13))
+
+        def add_images(name, item):
+            for i in range(images_per_item):
+                self.add_image(name, item['id'], f'{item["code"]}-{i}.jpg', b'')
+
+        assortment = []
+        for i in range(single_products):
+            item_barcode = barcode()
+            product = self.add('product', {
+                'name': f'Товар {i}',
+                'code': f'{10000 + i}_{item_barcode}',
+                'article': f'A{i}',
+                'barcodes': [{'ean13': item_barcode}],
+            })
+            add_images('product', product)
+            assortment.append(product['meta'])
+
+        char_ids = {char['name']: char['id'] for char in self.characteristics}
+        for i in range(variant_products):
+            product = self.add('product', {'name': f'Модель {i}', 'code': f'M{i}_base', 'article': f'M{i}'})
+            for j in range(variants_per_product):
+                item_barcode = barcode()
+                variant = self.add('variant', {
+                    'code': f'{20000 + i * variants_per_product + j}_{item_barcode}',
+                    'barcodes': [{'ean13': item_barcode}],
+                    'product': {'meta': product['meta']},
+                    'characteristics': [{'id': char_ids['Размер'], 'value': str(40 + j)},
+                                        {'id': char_ids['Баркод'], 'value': item_barcode}],
+                })
+                add_images('variant', variant)
+                assortment.append(variant['meta'])
+
+        for store_meta in store_metas:
+            store_id = store_meta['href'].split('/')[-1]
+            for item_meta in assortment:
+                if rnd.random() < 0.5:
+                    self.stocks[store_id][item_meta['href']] = float(rnd.randint(1, 20))
+
+        return {'brands': brands, 'countries': countries,
+                'stores': [self.get_by_href(store_meta['href'])['name'] for store_meta in store_metas]}
+
+    # Queries
+
+    @staticmethod
+    def parse_filter(filter_value) -> list:
+        conditions = []
+        for condition in filter_value.split(';'):
+            match = re.match(r'^([\w.]+)(!=|~|=)(.*)$', condition)
+            if match is not None:
+                conditions.append(match.groups())
+        return conditions
+
+    @staticmethod
+    def match(item, conditions) -> bool:
+        for field, operator, value in conditions:
+            item_value = item.get(field)
+            if isinstance(item_value, dict) and 'meta' in item_value:
+                item_value = item_value['meta']['href']
+            item_value = '' if item_value is None else str(item_value)
+            if operator == '=' and item_value != value:
+                return False
+            if operator == '!=' and item_value == value:
+                return False
+            if operator == '~' and value.lower() not in item_value.lower():
+                return False
+        return True
+
+    def _get_candidates(self, name, conditions):
+        items = self.entities[name]
+        for field, operator, value in conditions:
+            if field != 'code':
+                continue
+            if operator == '=':
+                name_id = self._codes.get(value)
+                return [items[name_id[1]]] if name_id is not None and name_id[0] == name else []
+            if operator == '~' and (name, value) in self._code_parts:
+                return [items[item_id] for item_id in self._code_parts[(name, value)] if item_id in items]
+        return items.values()
+
+    def collection(self, href, rows, query, expand_row=None):
+        expand = query.get('expand')
+        max_limit = self.MAX_EXPAND_LIMIT if expand else self.MAX_LIMIT
+        limit = int(query.get('limit', max_limit))
+        if limit > max_limit:
+            raise FakeMoySkladError(400, f'Параметр limit должен быть не больше {max_limit}')
+        offset = int(query.get('offset', 0))
+
+        page = rows[offset:offset + limit]
+        if expand_row is not None:
+            page = [expand_row(row, expand) for row in page]
+        meta = {'href': href, 'type': 'collection', 'mediaType': 'application/json',
+                'size': len(rows), 'limit': limit, 'offset': offset}
+        if offset + limit < len(rows):
+            meta['nextHref'] = f'{href}?limit={limit}&offset={offset + limit}'
+        return {'meta': meta, 'rows': page}
+
+    def _expand_item(self, name, item, expand):
+        item = dict(item)
+        images = self.images.get((name, item['id']), [])
+        images_meta = {'href': f'{item["meta"]["href"]}/images', 'type': 'image',
+                       'mediaType': 'application/json', 'size': len(images), 'limit': 1000, 'offset': 0}
+        if expand and 'images' in expand.split(','):
+            item['images'] = {'meta': images_meta, 'rows': list(images)}
+        elif name in ('product', 'variant'):
+            item['images'] = {'meta': images_meta}
+        return item
+
+    def stock_by_store(self, query):
+        conditions = self.parse_filter(query.get('filter', ''))
+        store_hrefs = [value for field, operator, value in conditions if field == 'store' and operator == '=']
+        rows = []
+        for store_href in store_hrefs:
+            store_id = store_href.split('/')[-1]
+            store = self.entities['store'].get(store_id)
+            if store is None:
+                raise FakeMoySkladError(412, f'Склад {store_href} не найден')
+            rows += [(store, href, stock) for href, stock in self.stocks[store_id].items() if stock != 0]
+
+        def expand_row(row, expand):
+            store, href, stock = row
+            return {
+                'meta': {'href': href, 'type': href.split('/')[-2], 'mediaType': 'application/json'},
+                'stockByStore': [{'meta': store['meta'], 'name': store['name'],
+                                  'stock': stock, 'reserve': 0.0, 'inTransit': 0.0}],
+            }
+
+        return self.collection(f'{self.public_url}report/stock/bystore', rows, query, expand_row)
+
+    # HTTP
+
+    @staticmethod
+    def get_endpoint(path) -> str:
+        """
+        Request path with ids replaced by {id}, e.g. entity/product/{id}/images.
+        """
+        return '/'.join('{id}' if ID_PATTERN.match(part) else part for part in path.strip('/').split('/'))
+
+    def _check_rate_limit(self):
+        if self.rate_limit is None:
+            return None
+        requests_count, seconds = self.rate_limit
+        with self._lock:
+            now = time.monotonic()
+            while self._request_times and self._request_times[0] <= now - seconds:
+                self._request_times.popleft()
+            if len(self._request_times) >= requests_count:
+                return int((self._request_times[0] + seconds - now) * 1000) + 1
+            self._request_times.append(now)
+        return None
+
+    def handle(self, method, path, query, body):
+        """
+        :return: (status, response data, extra headers)
+        """
+        route = path[len(API_PATH):] if path.startswith(API_PATH) else path.lstrip('/')
+        self.request_counts[f'{method} {self.get_endpoint(route)}'] += 1
+        parts = route.strip('/').split('/')
+
+        if parts[:2] == ['report', 'stock'] and parts[2:] == ['bystore'] and method == 'GET':
+            return 200, self.stock_by_store(query), {}
+        if parts[:3] == ['context', 'companysettings', 'metadata'] and method == 'GET':
+            return 200, {'customEntities': list(self.custom_entities.values())}, {}
+        if parts[0] != 'entity' or len(parts) < 2:
+            raise FakeMoySkladError(404, f'Неизвестный адрес {path}')
+
+        name, rest = parts[1], parts[2:]
+        if name == 'customentity':
+            if not rest:
+                if method == 'POST':
+                    return 200, self.add_custom_entity(body['name']), {}
+                raise FakeMoySkladError(405, 'Метод не поддерживается')
+            name, rest = f'customentity/{rest[0]}', rest[1:]
+            if rest == [] and name.split('/')[1] not in self.custom_entities:
+                raise FakeMoySkladError(404, f'Справочник {name} не найден')
+
+        if rest[:1] == ['metadata']:
+            return self._handle_metadata(method, name, rest[1:], query, body)
+        if not rest:
+            return self._handle_list(method, name, query, body)
+
+        item = self.entities[name].get(rest[0])
+        if item is None:
+            raise FakeMoySkladError(404, f'Объект {name}/{rest[0]} не найден')
+        if rest[1:] == ['images']:
+            if method == 'GET':
+                return 200, self.collection(f'{item["meta"]["href"]}/images',
+                                            self.images.get((name, item['id']), []), query), {}
+            if method == 'POST':
+                images = body if isinstance(body, list) else [body]
+                created = [self.add_image(name, item['id'], image['filename'], base64.b64decode(image['content']))
+                           for image in images]
+                return 200, created if isinstance(body, list) else created[0], {}
+        if rest[1:] == []:
+            if method == 'GET':
+                return 200, self._expand_item(name, item, query.get('expand')), {}
+            if method == 'PUT':
+                with self._lock:
+                    item.update({key: value for key, value in body.items() if key not in ('id', 'meta')})
+                return 200, item, {}
+            if method == 'DELETE':
+                with self._lock:
+                    del self.entities[name][item['id']]
+                    if self._codes.get(item.get('code'), (None, None))[1] == item['id']:
+                        del self._codes[item['code']]
+                return 200, None, {}
+        raise FakeMoySkladError(405, 'Метод не поддерживается')
+
+    def _handle_list(self, method, name, query, body):
+        if method == 'GET':
+            conditions = self.parse_filter(query.get('filter', ''))
+            with self._lock:
+                rows = [item for item in self._get_candidates(name, conditions) if self.match(item, conditions)]
+            return 200, self.collection(f'{self.public_url}entity/{name}', rows, query,
+                                        lambda row, expand: self._expand_item(name, row, expand)), {}
+        if method == 'POST':
+            if isinstance(body, list):
+                return 200, [self.add(name, item) for item in body], {}
+            return 200, self.add(name, body), {}
+        raise FakeMoySkladError(405, 'Метод не поддерживается')
+
+    def _handle_metadata(self, method, name, rest, query, body):
+        href = f'{self.public_url}entity/{name}/metadata'
+        if rest == [] and method == 'GET':
+            metadata = {'meta': {'href': href, 'mediaType': 'application/json'},
+                        'attributes': {'meta': {'href': f'{href}/attributes', 'type': 'attributemetadata',
+                                                'mediaType': 'application/json',
+                                                'size': len(self.attributes[name])}}}
+            if name == 'variant':
+                metadata['characteristics'] = list(self.characteristics)
+            return 200, metadata, {}
+        if rest == ['attributes'] and method == 'GET':
+            return 200, self.collection(f'{href}/attributes', self.attributes[name], query), {}
+        if rest == ['characteristics'] and name == 'variant':
+            if method == 'GET':
+                return 200, self.collection(f'{href}/characteristics', self.characteristics, query), {}
+            if method == 'POST':
+                if isinstance(body, list):
+                    return 200, [self.add_characteristic(char['name']) for char in body], {}
+                return 200, self.add_characteristic(body['name']), {}
+        raise FakeMoySkladError(404, f'Неизвестный адрес {href}')
+
+    def start(self, host='127.0.0.1', port=0) -> str:
+        """
+        Starts server in background thread.
+        :return: server url to use as HTTP_REDIRECTS target of https://online.moysklad.ru
+        """
+        handler = type('Handler', (FakeMoySkladHandler,), {'fake': self})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f'http://{host}:{self._server.server_address[1]}'
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class FakeMoySkladHandler(BaseHTTPRequestHandler):
+    fake = None
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes, Nagle's algorithm would delay keep-alive responses.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self, method):
+        fake = self.fake
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        length = int(self.headers.get('Content-Length') or 0)
+        raw_body = self.rfile.read(length) if length else b''
+
+        headers = {}
+        try:
+            if not self.headers.get('Authorization'):
+                raise FakeMoySkladError(401, 'Ошибка аутентификации')
+            retry_after = fake._check_rate_limit()
+            if retry_after is not None:
+                headers = {'X-Lognex-Retry-After': str(retry_after), 'X-Lognex-Retry-TimeInterval': '3000'}
+                raise FakeMoySkladError(429, 'Превышено ограничение на количество запросов')
+
+            url = urlsplit(self.path)
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            body = json.loads(raw_body.decode('utf-8')) if raw_body else None
+            status, data, extra_headers = fake.handle(method, url.path, query, body)
+            headers.update(extra_headers)
+        except FakeMoySkladError as e:
+            status, data = e.status, {'errors': [{'error': e.message, 'code': 1000 + e.status}]}
+        except (ValueError, KeyError, TypeError) as e:
+            status, data = 400, {'errors': [{'error': f'Ошибка формата запроса: {e}', 'code': 2016}]}
+
+        response_body = b'' if data is None else json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=utf-8')
+        self.send_header('Content-Length', str(len(response_body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake MoySklad API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--products', type=int, default=100, help='single products count')
+    parser.add_argument('--variant-products', type=int, default=20)
+    parser.add_argument('--variants', type=int, default=3, help='variants per product')
+    parser.add_argument('--stores', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per response')
+    parser.add_argument('--rate-limit', type=int, default=None, help='requests per 3 seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    fake = FakeMoySklad(latency=args.latency,
+                        rate_limit=(args.rate_limit, 3) if args.rate_limit else None)
+    fake.seed_catalog(args.products, args.variant_products, args.variants, args.stores, seed=args.seed)
+    url = fake.start(args.host, args.port)
+    print(f'Fake MoySklad is running on {url}')
+    print(f'HTTP_REDIRECTS=https://online.moysklad.ru={url}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,27 @@
-import requests
+import hashlib
 import json
+import os
+import sys
+import threading
+import time
 
+from array import array
 from exceptions import *
-from collections import Iterable
+from typing import Iterable
 
-import urllib
+import urllib.parse
 from functools import lru_cache
 
+from pyhttp import STREAMING_JSON, RateLimiter, Session, iter_json_items, span, write_json_atomically
+
+# Shared by all MoySklad requests: keeps connections alive and retries transient failures.
+# MoySklad allows 45 requests per 3 seconds for an account, jobs share this limit.
+MIN_REQUEST_INTERVAL = float(os.getenv('MS_MIN_REQUEST_INTERVAL', 3 / 45))
+session = Session(rate_limiter=RateLimiter(MIN_REQUEST_INTERVAL))
+
 class MSResponseItem:
+    __slots__ = ('data',)
+
     def __init__(self, item_data: dict):
         self.data = item_data
 
@@ -78,7 +92,7 @@ class MSDict:
 
     def set_response_by_dict_name(self):
         request_url = self.URL
-        r = requests.get(request_url, headers={'Authorization': self.auth})
+        r = session.get(request_url, headers={'Authorization': self.auth})
         self.response = r
 
     def __str__(self):
@@ -145,7 +159,7 @@ class MSDict:
         data = {
             'name': item_name,
         }
-        r = requests.post(request_url, headers=headers, data=json.dumps(data))
+        r = session.post(request_url, headers=headers, data=json.dumps(data))
         return r
 
     def create_or_get_item_by_name(self, item_name):
@@ -165,7 +179,7 @@ class MSDict:
             request_url = f'{self.URL}?filter={field}={value}'
         else:
             request_url = f'{self.URL}?filter={field}~{value}'
-        r = requests.get(request_url, headers=headers)
+        r = session.get(request_url, headers=headers)
         try:
             return r.json().get('rows', [])
         except Exception as e:
@@ -173,7 +187,7 @@ class MSDict:
             return []
 
     def get_all_codes(self, batch_size=100):
-        r = requests.get(self.URL, headers={'Authorization': self.auth})
+        r = session.get(self.URL, headers={'Authorization': self.auth})
         response_data = r.json()
         size = response_data['meta']['size']
         total = batch_size
@@ -181,7 +195,7 @@ class MSDict:
         codes = [item['code'] for item in list(filter(lambda item: 'code' in item, response_data.get('rows', [])))]
 
         while total < size:
-            r = requests.get(f'{self.URL}?limit={batch_size}&offset={total}',
+            r = session.get(f'{self.URL}?limit={batch_size}&offset={total}',
                              headers={'Authorization': self.auth})
             response_data = r.json()
             codes += [item['code'] for item in list(filter(lambda item: 'code' in item, response_data.get('rows', [])))]
@@ -190,14 +204,14 @@ class MSDict:
         return codes
 
     def create(self, request_data):
-        r = requests.post(self.URL,
+        r = session.post(self.URL,
                           headers={'Authorization': self.auth, 'Content-Type': 'Application/json'},
                           json=request_data)
         return r
 
     def strict_search_by_field_value(self, field, value):
-        items = requests.get(f'https://online.moysklad.ru/api/remap/1.2/entity/store?filter={field}={value}',
-                                  headers={'Authorization': self.auth}).json()['rows']
+        items = session.get(self.URL, params={'filter': f'{field}={value}'},
+                            headers={'Authorization': self.auth}).json()['rows']
         if len(items) == 0:
             return
         return items[0]
@@ -227,17 +241,33 @@ class MSUserDict:
     """
     Custom user dictionary
     Пользовательский справочник
+    Items are read by pages once and indexed by lower case name, created items are added to the index.
     """
+    CREATE_BATCH_SIZE = 1000
 
     def __init__(self, dict_id, token):
         self.id = dict_id
         self.token = token
+        self.url = f'https://online.moysklad.ru/api/remap/1.2/entity/customentity/{self.id}'
+        self._items_by_name = None
+
+    def _get_index(self) -> dict:
+        if self._items_by_name is None:
+            self.get_items()
+        return self._items_by_name
+
+    def _add_to_index(self, item):
+        self._items_by_name[item['name'].lower()] = item
 
     def get_items(self):
-        request_url = f'https://online.moysklad.ru/api/remap/1.2/entity/customentity/{self.id}'
-        headers = {'Authorization': f'Basic {self.token}'}
-        r = requests.get(request_url, headers=headers)
-        return r.json().get('rows', [])
+        """
+        Reads all items again.
+        """
+        items = list(iter_all_rows(self.url, self.token))
+        self._items_by_name = dict()
+        for item in items:
+            self._add_to_index(item)
+        return items
 
     def create_item(self, item_name):
         if item_name == '':
@@ -245,49 +275,97 @@ class MSUserDict:
         if self.is_item_exists(item_name):
             raise MSDictItemException(f'Item "{item_name}" is already exists in dictionary')
 
-        request_url = f'https://online.moysklad.ru/api/remap/1.2/entity/customentity/{self.id}'
         request_data = json.dumps({'name': item_name})
         headers = {
             'Content-Type': 'Application/json',
             'Authorization': f'Basic {self.token}'
         }
-        r = requests.post(request_url, data=request_data, headers=headers)
-        return r.json()
+        r = session.post(self.url, data=request_data, headers=headers)
+        item = r.json()
+        if 'name' in item:
+            self._add_to_index(item)
+        return item
 
     def find_item_by_name(self, item_name: str):
-        item_name_lower_case = item_name.lower()
-        items = self.get_items()
-        for item in items:
-            if item['name'].lower() == item_name_lower_case:
-                return item
-        return None
+        return self._get_index().get(item_name.lower())
 
     def is_item_exists(self, item_name: str) -> bool:
         item = self.find_item_by_name(item_name)
         return item is not None
 
     def create_items_if_not_exists(self, items: Iterable):
+        """
+        Creates missing items by batches of CREATE_BATCH_SIZE.
+        """
+        index = self._get_index()
+        missing_names = dict()
         for item_name in items:
-            if item_name == '':
-                continue
-            if self.is_item_exists(item_name):
-                continue
-            self.create_item(item_name)
+            if item_name != '' and item_name.lower() not in index:
+                missing_names.setdefault(item_name.lower(), item_name)
+        missing_names = list(missing_names.values())
+
+        headers = {
+            'Content-Type': 'Application/json',
+            'Authorization': f'Basic {self.token}'
+        }
+        for start in range(0, len(missing_names), self.CREATE_BATCH_SIZE):
+            request_data = [{'name': name} for name in missing_names[start:start + self.CREATE_BATCH_SIZE]]
+            r = session.post(self.url, data=json.dumps(request_data), headers=headers)
+            if r.status_code != 200:
+                raise MSDictItemException(f'Items were not created: {r.text}')
+            for item in r.json():
+                self._add_to_index(item)
 
     def get_items_dict(self) -> dict:
         """
         Returns dict like {'name': {item_data}}
         """
-        items = self.get_items()
-        return {item['name']: item for item in items}
+        return {item['name']: item for item in self._get_index().values()}
 
     def get_items_dict_filtered_by_names(self, names: Iterable) -> dict:
+        """
+        Names are matched case insensitive, result is keyed by requested names.
+        """
         names = [name for name in names if name != '']
-        items_dict = self.get_items_dict()
+        index = self._get_index()
         for name in names:
-            if name not in items_dict:
+            if name.lower() not in index:
                 raise MSDictItemException(f'Item "{name}" does not exists in dict')
-        return {name: items_dict[name] for name in names}
+        return {name: index[name.lower()] for name in names}
+
+
+BASE_API_URL = 'https://online.moysklad.ru/api/remap/1.2/'
+
+
+def iter_all_rows(request_url, token, params=None, batch_size=1000):
+    """
+    Yields rows of all pages of request_url.
+    With ijson rows are parsed while page is downloaded, so only current row is kept in memory.
+    Raises MSException on error response, so it is never taken for an empty list.
+    :param batch_size: page limit, MoySklad allows 100 at most with expand.
+    """
+    params = dict(params or {})
+    params['limit'] = batch_size
+    offset = 0
+    while True:
+        params['offset'] = offset
+        with span('ms.get_page', url=request_url, offset=offset) as page_span:
+            response = session.get(request_url, params=params, headers={'Authorization': f'Basic {token}'},
+                                   stream=STREAMING_JSON)
+        if not response.ok:
+            message = f'Failed to read {request_url} (offset {offset}): {response.status_code} {response.text}'
+            response.close()
+            raise MSException(message)
+        rows_count = 0
+        for row in iter_json_items(response, 'rows.item', required=True):
+            rows_count += 1
+            yield row
+        page_span.set_attribute('rows', rows_count)
+
+        # Short page is the last one.
+        if rows_count < batch_size:
+            return
+        offset += batch_size
 
 
 def get_all_single_product_codes(auth) -> list:
@@ -296,11 +374,11 @@ def get_all_single_product_codes(auth) -> list:
 
     request_url = 'https://online.moysklad.ru/api/remap/1.2/entity/product'
     headers = {'Authorization': auth}
-    response = requests.get(f'{request_url}?limit=1', headers=headers)
+    response = session.get(f'{request_url}?limit=1', headers=headers)
 
     size = response.json()['meta']['size']
     for offset in range(0, size, BATCH_SIZE):
-        response = requests.get(f'{request_url}?limit={BATCH_SIZE}&offset={offset}', headers=headers)
+        response = session.get(f'{request_url}?limit={BATCH_SIZE}&offset={offset}', headers=headers)
         products = response.json().get('rows', None)
         if products is None:
             return []
@@ -314,12 +392,12 @@ def get_all_product_codes(auth) -> list:
     BATCH_SIZE = 500
     codes = []
     request_url = f'https://online.moysklad.ru/api/remap/1.2/entity/product'
-    response = requests.get(f'{request_url}?limit=1', headers={'Authorization': auth})
+    response = session.get(f'{request_url}?limit=1', headers={'Authorization': auth})
     size = response.json()['meta']['size']
 
     for offset in range(0, size, BATCH_SIZE):
         url = f'{request_url}?limit={BATCH_SIZE}&offset={offset}'
-        response = requests.get(url, headers={'Authorization': auth})
+        response = session.get(url, headers={'Authorization': auth})
         products = response.json().get('rows', None)
         if products is None:
             break
@@ -333,7 +411,7 @@ def get_all_product_codes(auth) -> list:
 def get_all_multi_product_codes(auth) -> list:
     codes = []
     request_url = 'https://online.moysklad.ru/api/remap/1.2/entity/variant?offset=0'
-    response = requests.get(request_url, headers={'Authorization': auth})
+    response = session.get(request_url, headers={'Authorization': auth})
 
     variants = response.json().get('rows', None)
     if variants is None:
@@ -346,7 +424,7 @@ def get_all_multi_product_codes(auth) -> list:
     if size > 1000:
         for offset in range(1000, size, 1000):
             request_url = f'https://online.moysklad.ru/api/remap/1.2/entity/variant?offset={offset}'
-            response = requests.get(request_url, headers={'Authorization': auth})
+            response = session.get(request_url, headers={'Authorization': auth})
 
             variants = response.json().get('rows', None)
             if variants is None:
@@ -360,7 +438,7 @@ def get_all_multi_product_codes(auth) -> list:
 
 def get_product_meta_by_code(product_code, token):
     request_url = f'https://online.moysklad.ru/api/remap/1.2/entity/product?filter=code={urllib.parse.quote_plus(product_code)}'
-    response = requests.get(request_url, headers={'Authorization': f'Basic {token}'})
+    response = session.get(request_url, headers={'Authorization': f'Basic {token}'})
     response_dict = response.json()
     if response_dict.get('meta', None) is not None and response_dict['meta'].get('size', 0) > 0:
         return response_dict['rows'][0]['meta']
@@ -370,7 +448,7 @@ def get_product_meta_by_code(product_code, token):
 
 def get_product_attributes(token):
     request_url = 'https://online.moysklad.ru/api/remap/1.2/entity/product/metadata/attributes'
-    r = requests.get(request_url, headers={'Authorization': f'Basic {token}'})
+    r = session.get(request_url, headers={'Authorization': f'Basic {token}'})
     ms_r = MSResponse(r)
     return ms_r
 
@@ -379,21 +457,19 @@ class MSVariants(MSDict):
     def __init__(self, dict_name, token):
         # FIXME: Фтигня какая-то по логике. Класс очевидно dict_name==variant, но наследование требует явного задания.
         super().__init__(dict_name, token)
+        self.token = token
 
-    def get_chars_id_dict_for_list(self, values: list):
-        values = set(values)
+    def get_chars_id_dict_for_list(self, values: list, metadata=None) -> dict:
+        """
+        Ids of variant characteristics found by names, missing names are not in result.
+        :param metadata: MSMetadataRegistry to share loaded characteristics with.
+        """
+        metadata = metadata or MSMetadataRegistry(self.token)
         result = dict()
-
-        data = self.get_data()
-        for variant in data:
-            chars = variant.get('characteristics')
-            if chars is not None:
-                for char in chars:
-                    if char.get('name') in values:
-                        result[char.get('name')] = char.get('id')
-                        values.remove(char.get('name'))
-            if len(values) == 0:
-                return result
+        for value in values:
+            char = metadata.get_characteristic(value)
+            if char is not None:
+                result[value] = char['id']
         return result
 
 
@@ -405,7 +481,7 @@ def get_all_single_products_code_id_info(token) -> dict:
     products_result = {}
 
     request_url = 'https://online.moysklad.ru/api/remap/1.2/entity/product?offset=0'
-    response = requests.get(request_url, headers={
+    response = session.get(request_url, headers={
         'Authorization': f'Basic {token}'
     })
 
@@ -421,7 +497,7 @@ def get_all_single_products_code_id_info(token) -> dict:
     if size > 1000:
         for offset in range(1000, size, 1000):
             request_url = f'https://online.moysklad.ru/api/remap/1.2/entity/product?offset={offset}'
-            response = requests.get(request_url, headers={
+            response = session.get(request_url, headers={
                 'Authorization': f'Basic {token}'
             })
 
@@ -443,7 +519,7 @@ def get_all_multi_product_info(token) -> dict:
     """
     variant_code_id_meta = dict()
     request_url = 'https://online.moysklad.ru/api/remap/1.2/entity/variant?offset=0'
-    response = requests.get(request_url,
+    response = session.get(request_url,
                             headers={'Authorization': f'Basic {token}'})
 
     variants = response.json().get('rows', None)
@@ -457,7 +533,7 @@ def get_all_multi_product_info(token) -> dict:
     if size > 1000:
         for offset in range(1000, size, 1000):
             request_url = f'https://online.moysklad.ru/api/remap/1.2/entity/variant?offset={offset}'
-            response = requests.get(request_url,
+            response = session.get(request_url,
                                     headers={'Authorization': f'Basic {token}'})
 
             variants = response.json().get('rows', None)
@@ -470,6 +546,24 @@ def get_all_multi_product_info(token) -> dict:
     return variant_code_id_meta
 
 
+def get_images_inventory(entity_name, token) -> dict:
+    """
+    Image filenames of all items read from paged list with expand=images,
+    instead of images request for every item.
+    :param entity_name: product or variant. Products with variants are skipped.
+    :return: dict where: key - code, value - (id, set of image filenames).
+    """
+    inventory = dict()
+    rows = iter_all_rows(f'{BASE_API_URL}entity/{entity_name}', token, params={'expand': 'images'}, batch_size=100)
+    for item in rows:
+        if 'code' not in item or item.get('variantsCount', 0) != 0:
+            continue
+        images = item.get('images', {}).get('rows', [])
+        inventory[item['code']] = (item['id'], {image.get('filename', '') for image in images})
+
+    return inventory
+
+
 @lru_cache(50)
 def get_item_by_barcode_id(barcode, token):
     product_dict = MSDict('product', token)
@@ -501,54 +595,367 @@ def get_barcode_meta(barcode, token):
     return meta
 
 
-def get_ms_stocks_by_store_meta(store_meta, ms_token):
-    store_id = store_meta['href'].split('/')[-1]
-    def get_stock_from_data(data):
-        count = data['stockByStore'][0]['stock']
-        product_meta = data['meta']['href']
-        r = requests.get(product_meta, headers=ms_headers)
-        product_data = r.json()
-        try:
-            code = product_data['code']
-        except:
-            print(r.json())
-        if 'base' in code:
-            print('base item')
+class MSRecord:
+    """
+    Product or variant kept as fields used by integrations, raw json is requested by href when needed.
+    """
+    __slots__ = ('id', 'type', 'code', 'barcode')
+
+    def __init__(self, item_id, item_type, code, barcode):
+        self.id = item_id
+        self.type = item_type
+        self.code = code
+        self.barcode = barcode
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        :param row: product or variant json, barcode is the first barcode if it is ean13.
+        """
+        barcodes = row.get('barcodes', [])
+        barcode = barcodes[0].get('ean13') if len(barcodes) > 0 else None
+        return cls(row['id'], sys.intern(row['meta']['type']), row.get('code', ''), barcode)
+
+    @property
+    def href(self):
+        return f'{BASE_API_URL}entity/{self.type}/{self.id}'
+
+    @property
+    def meta(self):
+        return {'href': self.href, 'metadataHref': f'{BASE_API_URL}entity/{self.type}/metadata',
+                'type': self.type, 'mediaType': 'application/json'}
+
+    @property
+    def stock_barcode(self):
+        """
+        Barcode stocks of item are counted by, None for base products of variants.
+        """
+        if 'base' in self.code:
             return None
+        return self.barcode
 
-        barcodes = product_data['barcodes']
-        if len(barcodes) > 0 and 'ean13' in barcodes[0]:
-            return {barcodes[0]['ean13']: int(count)}
+    def get_raw(self, token) -> dict:
+        return session.get(self.href, headers={'Authorization': f'Basic {token}'}).json()
 
-    limit = 1000
 
-    STORE_URL = f'https://online.moysklad.ru/api/remap/1.2/entity/store/{store_id}'
-    ms_request_url = 'https://online.moysklad.ru/api/remap/1.2/report/stock/bystore'
+class MSAssortment:
+    """
+    Products and variants of account in parallel lists, compact for catalogs of hundreds of thousands items:
+    row json of several KB is kept as id, type, code and barcode.
+    """
+    TYPES = ('product', 'variant')
+
+    def __init__(self):
+        self.ids = []
+        self.types = array('B')
+        self.codes = []
+        self.barcodes = []
+        self._positions = dict()
+        self._barcode_positions = dict()
+
+    @classmethod
+    def load(cls, token):
+        """
+        Reads all products and variants by pages, rows are not kept.
+        """
+        assortment = cls()
+        for entity_name in cls.TYPES:
+            for row in iter_all_rows(f'{BASE_API_URL}entity/{entity_name}', token):
+                assortment.add(MSRecord.from_row(row))
+        return assortment
+
+    def add(self, record: MSRecord):
+        position = self._positions.get(record.id)
+        if position is None:
+            self._positions[record.id] = len(self.ids)
+            self.ids.append(record.id)
+            self.types.append(self.TYPES.index(record.type))
+            self.codes.append(record.code)
+            self.barcodes.append(record.barcode)
+        else:
+            self.codes[position] = record.code
+            self.barcodes[position] = record.barcode
+        # The first item wins like in get_item_by_barcode_id, products are loaded before variants.
+        if record.stock_barcode is not None:
+            self._barcode_positions.setdefault(record.stock_barcode, self._positions[record.id])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for position in range(len(self.ids)):
+            yield self._get_record(position)
+
+    def _get_record(self, position) -> MSRecord:
+        return MSRecord(self.ids[position], self.TYPES[self.types[position]],
+                        self.codes[position], self.barcodes[position])
+
+    def get(self, item_id):
+        position = self._positions.get(item_id)
+        if position is not None:
+            return self._get_record(position)
+
+    def get_by_href(self, href):
+        """
+        :param href: product or variant href, query like ?expand=supplier is ignored.
+        """
+        return self.get(href.split('?')[0].rstrip('/').split('/')[-1])
+
+    def get_by_barcode(self, barcode):
+        position = self._barcode_positions.get(barcode)
+        if position is not None:
+            return self._get_record(position)
+
+    def get_barcode_meta(self, barcode, token):
+        """
+        Meta of item with barcode, items missing in snapshot are searched by get_barcode_meta.
+        """
+        record = self.get_by_barcode(barcode)
+        if record is None:
+            return get_barcode_meta(barcode, token)
+        return record.meta
+
+
+def get_ms_stocks_by_store_meta(store_meta, ms_token, assortment: MSAssortment = None):
+    """
+    Report rows are read page by page and not kept.
+    :param assortment: items missing in it are requested one by one.
+    """
+    store_id = store_meta['href'].split('/')[-1]
     ms_headers = {'Authorization': f'Basic {ms_token}'}
-    ms_params = {'filter': f'store={STORE_URL}',
-                 'limit': limit,
-                 'offset': 0
-                 }
-    r_ms = requests.get(ms_request_url, headers=ms_headers, params=ms_params)
-
-    if r_ms.status_code != 200:
-        print('МС не отдал остатки!')
-
-    all_ms_stocks = r_ms.json()['rows']
-
-    while ms_params['limit'] + ms_params['offset'] < r_ms.json()['meta']['size']:
-        ms_params['offset'] += limit
-        r_ms = requests.get(ms_request_url, headers=ms_headers, params=ms_params)
-        if r_ms.status_code != 200:
-            print('МС не отдал остатки!')
-            break
 
-        all_ms_stocks += r_ms.json()['rows']
+    def get_stock_barcode(data):
+        record = assortment.get_by_href(data['meta']['href']) if assortment is not None else None
+        if record is None:
+            product_data = session.get(data['meta']['href'], headers=ms_headers).json()
+            if 'code' not in product_data:
+                print(product_data)
+                return None
+            record = MSRecord.from_row(product_data)
+        return record.stock_barcode
+
+    STORE_URL = f'https://online.moysklad.ru/api/remap/1.2/entity/store/{store_id}'
+    ms_request_url = 'https://online.moysklad.ru/api/remap/1.2/report/stock/bystore'
     ms_stocks = {}
-    for stock_json in all_ms_stocks:
-        stock = get_stock_from_data(stock_json)
-        if stock is not None:
-            ms_stocks = {**ms_stocks, **stock}
+    for stock_json in iter_all_rows(ms_request_url, ms_token, params={'filter': f'store={STORE_URL}'}):
+        barcode = get_stock_barcode(stock_json)
+        if barcode is not None:
+            ms_stocks[barcode] = int(stock_json['stockByStore'][0]['stock'])
 
     return {barcode: count for barcode, count in ms_stocks.items() if count != 0}
 
+class MSStoreRegistry:
+    """
+    All stores of account read by pages once and indexed by name, externalCode and id.
+    With cache_path stores are kept in json file, cache older than max_age seconds is read again.
+    Unknown name reloads stores before they are created, so stores added by others are not duplicated.
+    """
+
+    def __init__(self, token, cache_path=None, max_age=24 * 3600):
+        self.token = token
+        self.cache_path = cache_path
+        self.max_age = max_age
+        self.url = f'{BASE_API_URL}entity/store'
+        self._lock = threading.RLock()
+        self._by_name = None
+        self._by_external_code = None
+        self._by_id = None
+        self._from_cache = False
+
+    def _index(self, stores):
+        self._by_name = {store['name']: store for store in stores}
+        self._by_external_code = {store['externalCode']: store for store in stores if 'externalCode' in store}
+        self._by_id = {store['id']: store for store in stores}
+
+    def _read_cache(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return None
+        if time.time() - os.path.getmtime(self.cache_path) > self.max_age:
+            return None
+        with open(self.cache_path) as cache_file:
+            return json.loads(cache_file.read())
+
+    def _save_cache(self):
+        if self.cache_path is None:
+            return
+        write_json_atomically(self.cache_path, list(self._by_id.values()))
+
+    def refresh(self):
+        with self._lock:
+            with span('ms.read_stores'):
+                self._index(list(iter_all_rows(self.url, self.token)))
+            self._from_cache = False
+            self._save_cache()
+
+    def _load(self):
+        with self._lock:
+            if self._by_id is not None:
+                return
+            stores = self._read_cache()
+            if stores is None:
+                self.refresh()
+            else:
+                self._index(stores)
+                self._from_cache = True
+
+    def get_by_name(self, name):
+        self._load()
+        return self._by_name.get(name)
+
+    def get_by_external_code(self, external_code):
+        self._load()
+        return self._by_external_code.get(external_code)
+
+    def get_by_id(self, store_id):
+        self._load()
+        return self._by_id.get(store_id)
+
+    def ensure_stores(self, names: Iterable) -> dict:
+        """
+        Creates missing stores with one request.
+        :return: dict where: key - name, value - store.
+        """
+        names = [name for name in dict.fromkeys(names) if name != '']
+        with self._lock:
+            self._load()
+            if self._from_cache and any(name not in self._by_name for name in names):
+                self.refresh()
+
+            missing_names = [name for name in names if name not in self._by_name]
+            if missing_names:
+                r = session.post(self.url, json=[{'name': name} for name in missing_names],
+                                 headers={'Authorization': f'Basic {self.token}',
+                                          'Content-Type': 'Application/json'})
+                if r.status_code != 200:
+                    raise MSException(f'Stores {", ".join(missing_names)} were not created: {r.text}')
+                self._index(list(self._by_id.values()) + r.json())
+                self._save_cache()
+                print('Созданы склады:', ', '.join(missing_names))
+
+            return {name: self._by_name[name] for name in names}
+
+
+class MSMetadataRegistry:
+    """
+    Attributes, variant characteristics, custom entities and entities like uom or currency of account found by name.
+    Attributes, characteristics and custom entities are read by one request per kind on first use,
+    entities by name filter.
+    With cache_path everything found is kept in json file for max_age seconds. Cache of other account
+    or CACHE_VERSION is ignored, name missing in cached attributes, characteristics or custom entities reads them again.
+    """
+    CACHE_VERSION = 1
+
+    def __init__(self, token, cache_path=None, max_age=24 * 3600):
+        self.token = token
+        self.cache_path = cache_path
+        self.max_age = max_age
+        self.account = hashlib.sha256(token.encode()).hexdigest()[:16]
+        self._lock = threading.RLock()
+        self._sections = self._read_cache()
+        self._fresh_sections = set()
+
+    def _read_cache(self) -> dict:
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return dict()
+        if time.time() - os.path.getmtime(self.cache_path) > self.max_age:
+            return dict()
+        with open(self.cache_path) as cache_file:
+            cache = json.loads(cache_file.read())
+        if cache.get('version') != self.CACHE_VERSION or cache.get('account') != self.account:
+            return dict()
+        return cache['sections']
+
+    def _save_cache(self):
+        if self.cache_path is None:
+            return
+        write_json_atomically(self.cache_path, {'version': self.CACHE_VERSION, 'account': self.account,
+                                                 'sections': self._sections})
+
+    def _get_from_section(self, section, name, load):
+        with self._lock:
+            items = self._sections.get(section)
+            if items is None or (name not in items and section not in self._fresh_sections):
+                with span('ms.read_metadata', section=section):
+                    items = load()
+                self._sections[section] = items
+                self._fresh_sections.add(section)
+                self._save_cache()
+            return items.get(name)
+
+    def get_attribute(self, entity_name, name):
+        """
+        :return: attribute with meta or None.
+        """
+        def load():
+            request_url = f'{BASE_API_URL}entity/{entity_name}/metadata/attributes'
+            return {attribute['name']: attribute for attribute in iter_all_rows(request_url, self.token)}
+        return self._get_from_section(f'attributes/{entity_name}', name, load)
+
+    def get_attribute_meta(self, entity_name, name):
+        attribute = self.get_attribute(entity_name, name)
+        if attribute is None:
+            raise MSException(f'Attribute "{name}" of {entity_name} not found')
+        return attribute['meta']
+
+    def get_attribute_dict_id(self, entity_name, name):
+        """
+        :return: id of custom entity (user dictionary) of attribute, e.g. brands of 'Бренд'.
+        """
+        attribute = self.get_attribute(entity_name, name)
+        if attribute is None or 'customEntityMeta' not in attribute:
+            raise MSException(f'Attribute "{name}" of {entity_name} with custom entity not found')
+        return attribute['customEntityMeta']['href'].split('/')[-1]
+
+    def get_custom_entity(self, name):
+        """
+        :return: custom entity metadata with id, meta and entityMeta or None.
+        """
+        def load():
+            r = session.get(f'{BASE_API_URL}context/companysettings/metadata',
+                            headers={'Authorization': f'Basic {self.token}'})
+            return {custom_entity['name']: custom_entity for custom_entity in r.json().get('customEntities', [])}
+        return self._get_from_section('customentities', name, load)
+
+    def get_characteristic(self, name):
+        """
+        :return: variant characteristic with id and meta or None.
+        """
+        def load():
+            r = session.get(f'{BASE_API_URL}entity/variant/metadata', headers={'Authorization': f'Basic {self.token}'})
+            return {char['name']: char for char in r.json().get('characteristics', [])}
+        return self._get_from_section('characteristics', name, load)
+
+    def ensure_characteristics(self, names: Iterable) -> dict:
+        """
+        Creates missing variant characteristics with one request.
+        :return: dict where: key - name, value - characteristic id.
+        """
+        names = list(dict.fromkeys(names))
+        with self._lock:
+            missing_names = [name for name in names if self.get_characteristic(name) is None]
+            if missing_names:
+                r = session.post(f'{BASE_API_URL}entity/variant/metadata/characteristics',
+                                 json=[{'name': name} for name in missing_names],
+                                 headers={'Authorization': f'Basic {self.token}',
+                                          'Content-Type': 'Application/json'})
+                if r.status_code != 200:
+                    raise MSException(f'Characteristics {", ".join(missing_names)} were not created: {r.text}')
+                self._sections['characteristics'].update({char['name']: char for char in r.json()})
+                self._save_cache()
+            return {name: self._sections['characteristics'][name]['id'] for name in names}
+
+    def get_entity(self, entity_name, name):
+        """
+        :return: first entity named `name` or None.
+        """
+        section = f'entity/{entity_name}'
+        with self._lock:
+            items = self._sections.setdefault(section, dict())
+            if name not in items and (section, name) not in self._fresh_sections:
+                self._fresh_sections.add((section, name))
+                rows = session.get(f'{BASE_API_URL}entity/{entity_name}', params={'filter': f'name={name}'},
+                                   headers={'Authorization': f'Basic {self.token}'}).json().get('rows', [])
+                if len(rows) > 0:
+                    items[name] = rows[0]
+                    self._save_cache()
+            return items.get(name)
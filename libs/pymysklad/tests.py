@@ -1,3 +1,5 @@
+import pytest
+
 
 def test_import():
     try:
@@ -8,3 +10,110 @@ def test_import():
         result = False
 
     assert result
+
+
+@pytest.fixture
+def fake_ms():
+    """
+    Local fake MoySklad serving pymyskald session, catalog is seeded by tests.
+    """
+    import pymyskald
+    from pyhttp import mount_redirects
+    from fake_moysklad import FakeMoySklad
+
+    fake = FakeMoySklad()
+    url = fake.start()
+    mount_redirects(pymyskald.session, {'https://online.moysklad.ru': url})
+    yield fake
+    fake.stop()
+    pymyskald.session.adapters.pop('https://online.moysklad.ru', None)
+
+
+def test_fake_moysklad_serves_pymysklad_requests(fake_ms):
+    import pymyskald
+
+    seeded = fake_ms.seed_catalog(single_products=150, variant_products=2, variants_per_product=2, stores=1)
+    products = pymyskald.get_images_inventory('product', 'token')
+    assert len(products) == 150
+    assert all(len(filenames) == 2 for _, filenames in products.values())
+
+    brands = pymyskald.MSUserDict(seeded['brands']['id'], 'token')
+    assert brands.find_item_by_name('nike')['name'] == 'Nike'
+
+    store = pymyskald.MSDict('store', 'token').strict_search_by_field_value('name', seeded['stores'][0])
+    stocks = pymyskald.get_ms_stocks_by_store_meta(store['meta'], 'token')
+    assert len(stocks) > 0 and all(count > 0 for count in stocks.values())
+    assert fake_ms.request_counts['GET entity/product'] == 2
+
+    assortment = pymyskald.MSAssortment.load('token')
+    assert len(assortment) == 150 + 2 + 4
+    product = next(iter(assortment))
+    assert assortment.get_by_href(product.href + '?expand=supplier').code == product.code
+    assert product.get_raw('token')['barcodes'][0]['ean13'] == product.barcode
+    assert assortment.get_barcode_meta(product.barcode, 'token') == product.meta
+    stock_requests = sum(fake_ms.request_counts.values())
+    assert pymyskald.get_ms_stocks_by_store_meta(store['meta'], 'token', assortment) == stocks
+    assert sum(fake_ms.request_counts.values()) == stock_requests + 1
+
+    missing_store = dict(store['meta'], href=store['meta']['href'][:-4] + '0000')
+    with pytest.raises(pymyskald.MSException):
+        pymyskald.get_ms_stocks_by_store_meta(missing_store, 'token', assortment)
+
+
+def test_store_registry_creates_missing_stores_and_uses_cache(fake_ms, tmp_path):
+    import pymyskald
+
+    seeded = fake_ms.seed_catalog(single_products=1, variant_products=0, stores=2)
+    cache_path = str(tmp_path / 'stores.json')
+    registry = pymyskald.MSStoreRegistry('token', cache_path)
+    stores = registry.ensure_stores([seeded['stores'][0], '[WB] New', '[WB] New'])
+    assert stores['[WB] New']['name'] == '[WB] New'
+    assert fake_ms.request_counts['POST entity/store'] == 1
+
+    requests_count = sum(fake_ms.request_counts.values())
+    cached = pymyskald.MSStoreRegistry('token', cache_path)
+    assert cached.get_by_id(stores['[WB] New']['id'])['name'] == '[WB] New'
+    assert cached.get_by_external_code(stores[seeded['stores'][0]]['externalCode']) is not None
+    assert sum(fake_ms.request_counts.values()) == requests_count
+
+
+def test_metadata_registry_finds_metadata_by_name_and_uses_cache(fake_ms, tmp_path):
+    import pymyskald
+
+    seeded = fake_ms.seed_catalog(single_products=1, variant_products=0, stores=1)
+    cache_path = str(tmp_path / 'metadata.json')
+    metadata = pymyskald.MSMetadataRegistry('token', cache_path)
+    brand = metadata.get_attribute('product', 'Бренд')
+    assert brand['customEntityMeta']['href'].endswith(seeded['brands']['id'])
+    assert metadata.get_custom_entity('Страна производства')['id'] == seeded['countries']['id']
+    assert metadata.get_attribute_dict_id('product', 'Страна производства') == seeded['countries']['id']
+    assert metadata.get_entity('uom', 'шт')['name'] == 'шт'
+    assert metadata.get_entity('country', 'Атлантида') is None
+
+    requests_count = sum(fake_ms.request_counts.values())
+    cached = pymyskald.MSMetadataRegistry('token', cache_path)
+    assert cached.get_attribute_meta('product', 'Баркод') is not None
+    assert cached.get_entity('uom', 'шт')['meta'] == metadata.get_entity('uom', 'шт')['meta']
+    assert sum(fake_ms.request_counts.values()) == requests_count
+    assert pymyskald.MSMetadataRegistry('other token', cache_path).get_attribute('product', 'Бренд') is not None
+    assert sum(fake_ms.request_counts.values()) == requests_count + 1
+
+    chars = metadata.ensure_characteristics(['Размер', 'Материал'])
+    assert fake_ms.request_counts['POST entity/variant/metadata/characteristics'] == 1
+    assert pymyskald.MSVariants('variant', 'token').get_chars_id_dict_for_list(['Материал', 'Вес']) == \
+        {'Материал': chars['Материал']}
+
+
+def test_user_dict_creates_missing_items_in_bulk(fake_ms):
+    import pymyskald
+
+    seeded = fake_ms.seed_catalog(single_products=1, variant_products=0, stores=1)
+    brands = pymyskald.MSUserDict(seeded['brands']['id'], 'token')
+    names = ['NIKE', 'Nike', ''] + [f'Brand {i}' for i in range(1500)]
+    requests_count = sum(fake_ms.request_counts.values())
+    brands.create_items_if_not_exists(names)
+    assert sum(fake_ms.request_counts.values()) == requests_count + 3
+
+    brands_map = pymyskald.MSUserDict(seeded['brands']['id'], 'token').get_items_dict_filtered_by_names(names)
+    assert brands_map['NIKE']['name'] == 'Nike'
+    assert len(brands.get_items_dict()) == 1504
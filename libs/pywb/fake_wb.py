@@ -0,0 +1,394 @@
+"""
+Local stand-in for Wildberries content (login, card/list), statistics (sales, orders, stocks)
+and image hosts with generated catalog. Clients are pointed to it with HTTP_REDIRECTS
+(see pyhttp.mount_redirects), one server answers for all hosts in PUBLIC_HOSTS.
+
+    python fake_wb.py --port 8082 --cards 1000 --error-rate 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+PUBLIC_HOSTS = (
+    'https://content-suppliers.wildberries.ru',
+    'https://suppliers-stats.wildberries.ru',
+    'https://img1.wbstatic.net',
+)
+IMAGES_URL = 'https://img1.wbstatic.net/big/new/'
+STATS_PATH = '/api/v1/supplier/'
+
+BRANDS = ('Nike', 'Adidas', 'Puma', 'Reebok', 'Demix')
+SUBJECTS = ('Футболки', 'Кроссовки', 'Шорты', 'Куртки')
+COLORS = ('черный', 'белый', 'красный', 'синий')
+SIZES = ('42', '44', '46', '48', '50', '52')
+COUNTRIES = ('Россия', 'Китай', 'Турция')
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeWildberries:
+    """
+    Generated WB supplier account served over HTTP.
+
+    :param cards: cards count, each has nomenclatures (colors) with variations (sizes) and one barcode per variation.
+    :param single_cards_share: share of cards without supplierVendorCode (single products in MoySklad).
+    :param sales_per_day: sales rows generated for every day of `days` before today.
+    :param latency: seconds added to every response.
+    :param error_rate: share of requests answered with 500.
+    :param empty_json_rate: share of statistics requests answered with 200 and empty body.
+    :param session_ttl: card/list requests accepted per login before 401, None - no expiration.
+    """
+    SALES_OBJECTS = ('sales', 'orders')
+
+    def __init__(self, cards=100, nomenclatures_per_card=2, variations_per_nomenclature=3,
+                 photos_per_nomenclature=3, single_cards_share=0.5, warehouses=3,
+                 sales_per_day=50, days=30, image_size=20 * 2 ** 10, seed=0,
+                 latency=0.0, error_rate=0.0, empty_json_rate=0.0, session_ttl=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.empty_json_rate = empty_json_rate
+        self.session_ttl = session_ttl
+        self.image_size = image_size
+        self.request_counts = Counter()
+
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sessions = dict()
+        self._server = None
+
+        self.warehouses = [f'Склад {name}' for name in ('Подольск', 'Коледино', 'Казань', 'Электросталь',
+                                                         'Краснодар', 'Екатеринбург', 'Новосибирск',
+                                                         'Хабаровск')[:warehouses]]
+        self.warehouses += [f'Склад {i}' for i in range(len(self.warehouses), warehouses)]
+        self.cards = [self._generate_card(i, nomenclatures_per_card, variations_per_nomenclature,
+                                          photos_per_nomenclature, single_cards_share)
+                      for i in range(cards)]
+        self.items = list(self.iter_items())
+        self.sales = self._generate_sales(sales_per_day, days)
+        self.stocks = self._generate_stocks()
+
+    # Data
+
+    def _barcode(self):
+        return ''.join(self._rnd.choice('0123456789') for _ in range(13))
+
+    @staticmethod
+    def _addin(addin_type, *values, key='value'):
+        return {'type': addin_type, 'params': [{key: value} for value in values]}
+
+    def _generate_card(self, card_number, nomenclatures_count, variations_count, photos_count, single_share):
+        rnd = self._rnd
+        single = rnd.random() < single_share
+        brand = rnd.choice(BRANDS)
+        subject = rnd.choice(SUBJECTS)
+        supplier_vendor_code = '' if single else f'SV{card_number:06d}'
+
+        nomenclatures = []
+        for n in range(nomenclatures_count if not single else 1):
+            nm_id = 10000000 + card_number * 100 + n
+            variations = []
+            for v in range(variations_count if not single else 1):
+                variations.append({
+                    'id': str(uuid.UUID(int=rnd.getrandbits(128))),
+                    'chrtId': 30000000 + card_number * 1000 + n * 10 + v,
+                    'barcodes': [self._barcode()],
+                    'addin': [self._addin('Размер', SIZES[v % len(SIZES)]),
+                              self._addin('Розничная цена', rnd.randint(5, 50) * 100, key='count')],
+                })
+            photos = [f'{IMAGES_URL}{nm_id // 10000}/{nm_id}-{p + 1}.jpg' for p in range(photos_count)]
+            nomenclatures.append({
+                'id': str(uuid.UUID(int=rnd.getrandbits(128))),
+                'nmId': nm_id,
+                'vendorCode': f'VC{card_number:06d}{n}',
+                'variations': variations,
+                'addin': [self._addin('Фото', *photos),
+                          self._addin('Основной цвет', COLORS[n % len(COLORS)])],
+            })
+
+        return {
+            'id': str(uuid.UUID(int=rnd.getrandbits(128))),
+            'imtId': 5000000 + card_number,
+            'supplierId': 'fake-supplier',
+            'imtSupplierId': card_number,
+            'object': subject,
+            'parent': 'Одежда',
+            'countryProduction': rnd.choice(COUNTRIES),
+            'supplierVendorCode': supplier_vendor_code,
+            'createdAt': '2021-01-20T10:00:00.000000Z',
+            'updatedAt': '2021-01-20T10:00:00.000000Z',
+            'addin': [self._addin('Бренд', brand),
+                      self._addin('Заголовок', f'{subject} {brand}'),
+                      self._addin('Описание', f'{subject} {brand}, артикул {card_number}'),
+                      self._addin('Тнвэд', '6109100000'),
+                      self._addin('Комплектация', subject)],
+            'nomenclatures': nomenclatures,
+        }
+
+    def iter_items(self):
+        """
+        Yields one dict per barcode: fields integrations use to link WB items with MoySklad.
+        """
+        for card in self.cards:
+            brand = card['addin'][0]['params'][0]['value']
+            for nomenclature in card['nomenclatures']:
+                photos = [param['value'] for param in nomenclature['addin'][0]['params']]
+                for variation in nomenclature['variations']:
+                    for barcode in variation['barcodes']:
+                        yield {
+                            'key': f'{variation["chrtId"]}_{barcode}',
+                            'barcode': barcode,
+                            'chrtId': variation['chrtId'],
+                            'nmId': nomenclature['nmId'],
+                            'vendorCode': nomenclature['vendorCode'],
+                            'supplierVendorCode': card['supplierVendorCode'],
+                            'brand': brand,
+                            'subject': card['object'],
+                            'size': variation['addin'][0]['params'][0]['value'],
+                            'photos': photos,
+                        }
+
+    def _generate_sales(self, sales_per_day, days):
+        rnd = self._rnd
+        sales = []
+        today = datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+        for day in range(days, -1, -1):
+            day_start = today - timedelta(days=day)
+            for i in range(sales_per_day):
+                item = rnd.choice(self.items)
+                moment = day_start + timedelta(seconds=rnd.randint(0, 86399))
+                is_return = rnd.random() < 0.1
+                price = rnd.randint(5, 50) * 100
+                sales.append({
+                    'gNumber': str(rnd.getrandbits(60)),
+                    'date': moment.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'lastChangeDate': (moment + timedelta(hours=rnd.randint(0, 48))).strftime('%Y-%m-%dT%H:%M:%S'),
+                    'supplierArticle': item['vendorCode'],
+                    'techSize': item['size'],
+                    'barcode': item['barcode'],
+                    'quantity': -1 if is_return else 1,
+                    'totalPrice': price,
+                    'discountPercent': 0,
+                    'isSupply': False,
+                    'isRealization': True,
+                    'forPay': -price * 0.85 if is_return else price * 0.85,
+                    'finishedPrice': price,
+                    'priceWithDisc': price,
+                    'nmId': item['nmId'],
+                    'subject': item['subject'],
+                    'brand': item['brand'],
+                    'warehouseName': rnd.choice(self.warehouses),
+                    'saleID': f'{"R" if is_return else "S"}{rnd.getrandbits(40)}',
+                    'odid': rnd.getrandbits(50),
+                })
+        return sales
+
+    def _generate_stocks(self):
+        rnd = self._rnd
+        stocks = []
+        now = datetime.today()
+        for item in self.items:
+            for warehouse in self.warehouses:
+                if rnd.random() < 0.5:
+                    continue
+                quantity = rnd.randint(0, 30)
+                stocks.append({
+                    'lastChangeDate': (now - timedelta(days=rnd.randint(0, 300))).strftime('%Y-%m-%dT%H:%M:%S'),
+                    'supplierArticle': item['vendorCode'],
+                    'techSize': item['size'],
+                    'barcode': item['barcode'],
+                    'quantity': quantity,
+                    'isSupply': True,
+                    'isRealization': False,
+                    'quantityFull': quantity,
+                    'quantityNotInOrders': quantity,
+                    'warehouseName': warehouse,
+                    'nmId': item['nmId'],
+                    'subject': item['subject'],
+                    'brand': item['brand'],
+                })
+        return stocks
+
+    def get_statistics(self, request_object, query) -> list:
+        date_from = query.get('dateFrom', '')
+        if request_object == 'stocks':
+            return [row for row in self.stocks if row['lastChangeDate'] >= date_from]
+        if request_object in self.SALES_OBJECTS:
+            if query.get('flag') == '1':
+                return [row for row in self.sales if row['date'][:10] == date_from[:10]]
+            return [row for row in self.sales if row['lastChangeDate'] >= date_from]
+        return []
+
+    def get_image(self, path) -> bytes:
+        # Same path gives same content, so content hashes are stable between runs.
+        rnd = random.Random(path)
+        content = rnd.getrandbits(8 * self.image_size).to_bytes(self.image_size, 'little')
+        return b'\xff\xd8\xff\xe0' + content + b'\xff\xd9'
+
+    # HTTP
+
+    def _roll(self, rate) -> bool:
+        if not rate:
+            return False
+        with self._lock:
+            return self._rnd.random() < rate
+
+    def login(self, body):
+        if not body or not body.get('token'):
+            return None
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[token] = 0
+        return token
+
+    def check_session(self, token) -> bool:
+        with self._lock:
+            if token not in self._sessions:
+                return False
+            self._sessions[token] += 1
+            return self.session_ttl is None or self._sessions[token] <= self.session_ttl
+
+    def handle(self, method, path, query, body, cookies):
+        """
+        :return: (status, response body bytes, extra headers)
+        """
+        if path.startswith(STATS_PATH):
+            endpoint = f'{method} {path.strip("/")}'
+        elif path.startswith('/big/'):
+            endpoint = f'{method} big/{{image}}'
+        else:
+            endpoint = f'{method} {path.strip("/")}'
+        self.request_counts[endpoint] += 1
+
+        if self._roll(self.error_rate):
+            return 500, b'{"error": "internal error"}', {}
+
+        if path == '/passport/api/v2/auth/login' and method == 'POST':
+            token = self.login(body)
+            if token is None:
+                return 400, b'{"error": "token is required"}', {}
+            return 200, b'{}', {'Set-Cookie': f'WBToken={token}; Path=/'}
+
+        if path == '/card/list' and method == 'POST':
+            if not self.check_session(cookies.get('WBToken')):
+                return 401, b'{"error": "unauthorized"}', {}
+            query_params = body['params']['query']
+            offset, limit = int(query_params.get('offset', 0)), int(query_params.get('limit', 100))
+            result = {'id': body.get('id'), 'jsonrpc': '2.0',
+                      'result': {'cards': self.cards[offset:offset + limit], 'cursor': {'total': len(self.cards)}}}
+            return 200, json.dumps(result, ensure_ascii=False).encode('utf-8'), {}
+
+        if path.startswith(STATS_PATH) and method == 'GET':
+            if not query.get('key'):
+                return 401, b'{"errors": ["invalid key"]}', {}
+            if self._roll(self.empty_json_rate):
+                return 200, b'', {}
+            rows = self.get_statistics(path[len(STATS_PATH):].strip('/'), query)
+            return 200, json.dumps(rows, ensure_ascii=False).encode('utf-8'), {}
+
+        if path.startswith('/big/') and method == 'GET':
+            return 200, self.get_image(path), {'Content-Type': 'image/jpeg'}
+
+        return 404, b'{"error": "not found"}', {}
+
+    def start(self, host='127.0.0.1', port=0) -> str:
+        """
+        Starts server in background thread.
+        :return: server url to use as HTTP_REDIRECTS target of every PUBLIC_HOSTS host.
+        """
+        handler = type('Handler', (FakeWildberriesHandler,), {'fake': self})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f'http://{host}:{self._server.server_address[1]}'
+
+    def get_redirects(self, url) -> dict:
+        return {public_host: url for public_host in PUBLIC_HOSTS}
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class FakeWildberriesHandler(BaseHTTPRequestHandler):
+    fake = None
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes, Nagle's algorithm would delay keep-alive responses.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self, method):
+        fake = self.fake
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        length = int(self.headers.get('Content-Length') or 0)
+        raw_body = self.rfile.read(length) if length else b''
+        cookies = dict(cookie.strip().split('=', 1)
+                       for cookie in (self.headers.get('Cookie') or '').split(';') if '=' in cookie)
+
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            body = json.loads(raw_body.decode('utf-8')) if raw_body else None
+            status, response_body, headers = fake.handle(method, url.path, query, body, cookies)
+        except (ValueError, KeyError, TypeError) as e:
+            status, response_body, headers = 400, json.dumps({'error': str(e)}).encode('utf-8'), {}
+
+        self.send_response(status)
+        headers.setdefault('Content-Type', 'application/json; charset=utf-8')
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Wildberries API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8082)
+    parser.add_argument('--cards', type=int, default=100)
+    parser.add_argument('--warehouses', type=int, default=3)
+    parser.add_argument('--sales-per-day', type=int, default=50)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per response')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--empty-json-rate', type=float, default=0.0)
+    parser.add_argument('--session-ttl', type=int, default=None, help='card/list requests per login')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    fake = FakeWildberries(cards=args.cards, warehouses=args.warehouses, sales_per_day=args.sales_per_day,
+                           days=args.days, seed=args.seed, latency=args.latency, error_rate=args.error_rate,
+                           empty_json_rate=args.empty_json_rate, session_ttl=args.session_ttl)
+    url = fake.start(args.host, args.port)
+    print(f'Fake Wildberries is running on {url}')
+    print('HTTP_REDIRECTS=' + ','.join(f'{source}={target}' for source, target in fake.get_redirects(url).items()))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
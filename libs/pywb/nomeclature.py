@@ -1,19 +1,46 @@
-import requests
 import json
-import pandas as pd
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE
+
+from pyhttp import STREAMING_JSON, RetryPolicy, Session, iter_json_items, span
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+BATCH_SIZE = 100
 
 
 class WBNomenclature:
     AUTH_LOGIN_URL = 'https://content-suppliers.wildberries.ru/passport/api/v2/auth/login'
     CARDS_URL = 'https://content-suppliers.wildberries.ru/card/list'
+    AUTH_ERROR_STATUSES = (401,)
+
+    def __init__(self, token, supplier_id, page_size=BATCH_SIZE, prefetch=0):
+        """
+        :param page_size: cards per card/list request.
+        :param prefetch: number of pages downloaded concurrently ahead of the consumer, 0 - sequential.
+        """
+        # Login and card/list are POST requests which only read data, so they are retried like GET.
+        self.session = Session(RetryPolicy(idempotent_methods=RetryPolicy.IDEMPOTENT_METHODS | {'POST'}))
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=max(prefetch, DEFAULT_POOLSIZE)))
+        self._auth_lock = threading.Lock()
 
-    def __init__(self, token, supplier_id):
         self.cookies = self.get_cookies(token)
         self.token = token
         self.supplier_id = supplier_id
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self._cleaned_cards_df = None
 
     def get_cookies(self, token):
-        r = requests.post(
+        """
+        Logs in with token. Session keeps received cookies for next requests.
+        """
+        r = self.session.post(
             self.AUTH_LOGIN_URL,
             headers={
                 'Content-Type': 'Application/json',
@@ -27,64 +54,131 @@ class WBNomenclature:
         )
         return dict(r.cookies)
 
-    def get_cards(self) -> list:
-        counter = 0
-        all_cards = []
-        while True:
-            BATCH_SIZE = 100
-            cook = self.cookies
-
-            r = requests.post(
-                'https://content-suppliers.wildberries.ru/card/list',
-                headers={
-                    'Content-Type': 'Application/json',
-                    'Accept': 'Application/json'
-                },
-                data=json.dumps({
-                    "id": 2282282,
-                    "jsonrpc": "2.0",
-                    "params": {
-                        "query": {
-                            "limit": BATCH_SIZE,
-                            "offset": counter
-                        },
-                        "supplierID": self.supplier_id
-                    }
+    def refresh_cookies(self, expired_cookies):
+        """
+        Logs in again if cookies were not refreshed by another thread yet.
+        """
+        with self._auth_lock:
+            if self.cookies is expired_cookies:
+                self.cookies = self.get_cookies(self.token)
+
+    def get_cards_page(self, offset, limit=BATCH_SIZE) -> list:
+        """
+        Returns raw cards of one card/list page.
+        Expired session is refreshed once and the same page is requested again.
+        """
+        cookies = self.cookies
+        r = self._post_cards_page(offset, limit)
+        if r.status_code in self.AUTH_ERROR_STATUSES:
+            r.close()
+            self.refresh_cookies(cookies)
+            r = self._post_cards_page(offset, limit)
+
+        return list(iter_json_items(r, 'result.cards.item', required=True))
+
+    def _post_cards_page(self, offset, limit):
+        return self.session.post(
+            self.CARDS_URL,
+            headers={
+                'Content-Type': 'Application/json',
+                'Accept': 'Application/json'
+            },
+            data=json.dumps({
+                "id": 2282282,
+                "jsonrpc": "2.0",
+                "params": {
+                    "query": {
+                        "limit": limit,
+                        "offset": offset
+                    },
+                    "supplierID": self.supplier_id
                 }
-                ),
-                cookies=cook)
-
-            counter += BATCH_SIZE
-
-            cards = r.json()['result']['cards']
-
-            data = []
-            for card in cards:
-                for item in card['nomenclatures']:
-                    for variant in item['variations']:
-                        item_data = self.get_all_params(card)
-                        item_data.update(self.get_all_params(item))
-                        item_data.update(self.get_all_params(variant))
-                        if len(variant['barcodes']) != 0:
-                            for barcode in variant['barcodes']:
-
-                                # item_data['barcode'] = barcode
-                                i_d = item_data.copy()
-                                i_d['barcode'] = barcode
-                                data.append(i_d)
-                                # data.append(item_data)
-                        else:
-                            data.append(item_data)
-            all_cards += data
-            if len(cards) < BATCH_SIZE:
-                break
-        return all_cards
+            }
+            ),
+            stream=STREAMING_JSON)
+
+    def iter_cards_pages(self, page_size=None, prefetch=None):
+        """
+        Yields raw card pages in offset order.
+        With prefetch > 0 up to `prefetch` next pages are downloaded concurrently
+        while the current one is processed.
+        """
+        page_size = page_size or self.page_size
+        prefetch = self.prefetch if prefetch is None else prefetch
+
+        if prefetch <= 0:
+            offset = 0
+            while True:
+                cards = self.get_cards_page(offset, page_size)
+                yield cards
+                if len(cards) < page_size:
+                    return
+                offset += page_size
+
+        with ThreadPoolExecutor(max_workers=prefetch) as executor:
+            pending = deque()
+            next_offset = 0
+            try:
+                while True:
+                    while len(pending) < prefetch:
+                        pending.append(executor.submit(self.get_cards_page, next_offset, page_size))
+                        next_offset += page_size
+
+                    cards = pending.popleft().result()
+                    yield cards
+                    if len(cards) < page_size:
+                        return
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def iter_cards(self, page_size=None, prefetch=None):
+        """
+        Yields flattened cards rows page by page.
+        Only pages in flight are kept in memory.
+        """
+        for cards in self.iter_cards_pages(page_size, prefetch):
+            for item_data in self.get_rows_from_cards(cards):
+                yield item_data
+
+    def get_rows_from_cards(self, cards) -> list:
+        data = []
+        for card in cards:
+            for item in card['nomenclatures']:
+                for variant in item['variations']:
+                    item_data = self.get_all_params(card)
+                    item_data.update(self.get_all_params(item))
+                    item_data.update(self.get_all_params(variant))
+                    if len(variant['barcodes']) != 0:
+                        for barcode in variant['barcodes']:
+                            i_d = item_data.copy()
+                            i_d['barcode'] = barcode
+                            data.append(i_d)
+                    else:
+                        data.append(item_data)
+        return data
+
+    def get_cards(self) -> list:
+        with span('wb.get_cards', page_size=self.page_size, prefetch=self.prefetch) as cards_span:
+            cards = list(self.iter_cards())
+            cards_span.set_attribute('rows', len(cards))
+        return cards
+
+    def get_cards_dataframe(self) -> 'pd.DataFrame':
+        import pandas as pd
 
-    def get_cards_dataframe(self) -> pd.DataFrame:
         data = self.get_cards()
         return pd.DataFrame(data)
 
-    def get_cards_cleaned_dataframe(self) -> pd.DataFrame:
+    def get_cards_cleaned_dataframe(self) -> 'pd.DataFrame':
+        """
+        Cards are loaded once per instance, next calls return the same snapshot.
+        """
+        if self._cleaned_cards_df is None:
+            self._cleaned_cards_df = self._load_cards_cleaned_dataframe()
+        return self._cleaned_cards_df
+
+    def _load_cards_cleaned_dataframe(self) -> 'pd.DataFrame':
         df = self.get_cards_dataframe()
         df = df.drop_duplicates()
         df['Розница'] = 0
@@ -1,15 +1,68 @@
-from datetime import datetime, timedelta
-import requests
-import pandas as pd
+from datetime import datetime
+import json
+import os
 import time
+from typing import TYPE_CHECKING
+import requests
+
+from pyhttp import JSON_BODY_ERRORS, STREAMING_JSON, RateLimiter, RetryPolicy, Session, cap_timeout, \
+    iter_json_items, mount_cassette, mount_metrics, mount_redirects, span, write_json_atomically
+
+# pandas is imported by DataFrame methods only, so dict methods and import stay light.
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Statistics API allows one request per minute for each object (sales, orders, stocks).
+MIN_REQUEST_INTERVAL = float(os.getenv('WB_MIN_REQUEST_INTERVAL', 60))
+
+
+class LastChangeCursor:
+    """
+    lastChangeDate watermarks of statistics objects (sales, orders, stocks) persisted in json file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.watermarks = self._read()
+
+    def _read(self) -> dict:
+        if not os.path.exists(self.path):
+            return dict()
+        with open(self.path) as cursor_file:
+            return json.loads(cursor_file.read())
+
+    def get(self, request_object, default=None):
+        return self.watermarks.get(request_object, default)
+
+    def set(self, request_object, last_change_date):
+        """
+        Saves new watermark. File is replaced atomically, so it never holds partial data.
+        """
+        watermarks = dict(self.watermarks)
+        watermarks[request_object] = last_change_date
+
+        write_json_atomically(self.path, watermarks, indent=2)
+        self.watermarks = watermarks
 
 
 class WBConnector:
     BASE_API_URL = 'https://suppliers-stats.wildberries.ru/api/v1/supplier/'
 
-    def __init__(self, token, request_object):
+    # Statistics API sometimes answers 200 with empty body, so broken json is retried too.
+    RETRY_EXCEPTIONS = RetryPolicy.RETRY_EXCEPTIONS + JSON_BODY_ERRORS
+
+    def __init__(self, token, request_object, rate_limiter=None, retry_policy=None, timeout=Session.DEFAULT_TIMEOUT):
+        """
+        :param timeout: requests timeout of one attempt, limited by time left to retry deadline too.
+        """
+        self.request_object = request_object
         self.request_url = self._collect_url(request_object)
         self.params = {'key': token}
+        self.rate_limiter = rate_limiter or RateLimiter(MIN_REQUEST_INTERVAL)
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=10, backoff=1.0, max_backoff=60.0,
+                                                        deadline=300.0, retry_exceptions=self.RETRY_EXCEPTIONS)
+        self.timeout = timeout
+        self.session = mount_metrics(mount_cassette(mount_redirects(requests.Session())))
 
     def _collect_url(self, request_object):
         return self.BASE_API_URL + request_object
@@ -26,22 +79,43 @@ class WBConnector:
         params.update(self.params)
         params.update({'dateFrom': date_from})
 
-        for i in range(10):
-            try:
-                response = requests.get(self.request_url, params=params)
-                result = response.json()
-                return result
-            except ValueError as e:
-                print(f'Fail to get json, retrying... {i}')
-                time.sleep(5)
+        with span('wb.statistics', object=self.request_object, date_from=date_from) as statistics_span:
+            deadline_time = time.monotonic() + self.retry_policy.deadline
+            data = self.retry_policy.call(self._request_json, params, deadline_time)
+            statistics_span.set_attribute('rows', len(data))
+        return data
+
+    def _request_json(self, params, deadline_time):
+        """
+        Rows are parsed while downloaded when ijson is installed, body is never kept whole.
+        """
+        self.rate_limiter.wait()
+        response = self.retry_policy.check_response(
+            self.session.get(self.request_url, params=params, stream=STREAMING_JSON,
+                             timeout=cap_timeout(self.timeout, deadline_time)))
+        return list(iter_json_items(response, 'item', required=True))
 
+    def get_data_df(self, date_from, params={}) -> 'pd.DataFrame':
+        import pandas as pd
 
-    def get_data_df(self, date_from, params={}):
         response_dict = self.get_data_dict(date_from, params=params)
         return pd.DataFrame(data=response_dict)
 
+    def get_changes_df(self, cursor: LastChangeCursor, default_date_from) -> 'pd.DataFrame':
+        """
+        Rows changed since the object watermark, default_date_from for the first run.
+        Cursor is not moved: call cursor.set() when rows are processed.
+        """
+        date_from = cursor.get(self.request_object, default_date_from)
+        return self.get_data_df(date_from)
+
+    @staticmethod
+    def get_last_change_date(df: 'pd.DataFrame', default=None):
+        if len(df) == 0 or 'lastChangeDate' not in df.columns:
+            return default
+        return df['lastChangeDate'].max()
+
     @staticmethod
     def format_date(date):
         pattern = '%Y-%m-%d'
         return date.strftime(pattern)
-
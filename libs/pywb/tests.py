@@ -8,3 +8,68 @@ def test_import():
         result = False
 
     assert result
+
+
+def test_import_does_not_load_pandas():
+    import os
+    import subprocess
+    import sys
+
+    code = 'import sys, pywb, nomeclature; print("pandas" in sys.modules)'
+    output = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.PIPE, check=True).stdout
+    assert output.strip() == b'False'
+
+
+def _fake_nomenclature(cards, page_size, prefetch):
+    from nomeclature import WBNomenclature
+
+    nom = WBNomenclature.__new__(WBNomenclature)
+    nom.page_size = page_size
+    nom.prefetch = prefetch
+    nom.get_cards_page = lambda offset, limit: cards[offset:offset + limit]
+    return nom
+
+
+def test_iter_cards_prefetch_keeps_order():
+    cards = [{'imtId': i,
+              'nomenclatures': [{'nmId': i, 'variations': [{'chrtId': i, 'barcodes': [str(i)]}]}]}
+             for i in range(25)]
+
+    sequential = list(_fake_nomenclature(cards, 10, 0).iter_cards())
+    prefetched = list(_fake_nomenclature(cards, 10, 3).iter_cards())
+
+    assert [row['barcode'] for row in sequential] == [str(i) for i in range(25)]
+    assert prefetched == sequential
+
+
+def test_last_change_cursor_persists_watermarks(tmp_path):
+    from pywb import LastChangeCursor
+
+    path = str(tmp_path / 'cursor.json')
+    cursor = LastChangeCursor(path)
+    assert cursor.get('sales', '2021-01-01') == '2021-01-01'
+
+    cursor.set('sales', '2021-02-01T10:00:00')
+    assert LastChangeCursor(path).get('sales') == '2021-02-01T10:00:00'
+
+
+def test_fake_wb_serves_nomenclature_and_statistics(monkeypatch):
+    from fake_wb import FakeWildberries
+    from nomeclature import WBNomenclature
+    from pyhttp import RateLimiter, RetryPolicy
+    from pywb import WBConnector
+
+    fake = FakeWildberries(cards=25, sales_per_day=5, days=3, session_ttl=2, empty_json_rate=0.3)
+    url = fake.start()
+    monkeypatch.setenv('HTTP_REDIRECTS', ','.join(f'{host}={target}' for host, target in fake.get_redirects(url).items()))
+    try:
+        rows = list(WBNomenclature('token', 'supplier', page_size=10).iter_cards())
+        assert sorted(row['barcode'] for row in rows) == sorted(item['barcode'] for item in fake.items)
+        assert fake.request_counts['POST passport/api/v2/auth/login'] == 2
+
+        sales = WBConnector('key', 'sales', rate_limiter=RateLimiter(), retry_policy=RetryPolicy(
+            max_attempts=20, backoff=0, retry_exceptions=WBConnector.RETRY_EXCEPTIONS))
+        assert len(sales.get_data_dict('2000-01-01')) == len(fake.sales)
+    finally:
+        fake.stop()